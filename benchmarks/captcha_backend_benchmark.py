@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Captcha recognition with the NumPy backend vs. mxnet: load time, per batch latency, and whether both give the same
+labels on a regression set of captcha images.
+
+    PYTHONPATH=. python benchmarks/captcha_backend_benchmark.py [captcha image directory]
+
+Needs the converted weights (model/*.npz, see weibo_api.simple_captcha.numpy_backend). mxnet is compared if it is
+installed and the .params file is present. Without the converted weights, times the NumPy backend alone with random
+weights and random images.
+"""
+
+import ast
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from weibo_api.simple_captcha.numpy_backend import NumpyCaptchaNet
+from weibo_api.simple_captcha.weibo_com_captcha import WeiboComCaptcha
+
+BATCH_SIZES = (1, 8, 32)
+RUNS = 20
+MODEL_DIR = os.path.join(WeiboComCaptcha.CURRENT_DIR, 'model')
+SYMBOL_PATH = os.path.join(MODEL_DIR, '0.9269662921348315.net.all-symbol.json')
+NPZ_PATH = os.path.join(MODEL_DIR, '0.9269662921348315.net.all.npz')
+PARAMS_PATH = os.path.join(MODEL_DIR, '0.9269662921348315.net.all-0001.params')
+
+
+def random_net():
+    with open(SYMBOL_PATH) as f:
+        symbol = json.load(f)
+    # Input sizes left to shape inference in the symbol (0)
+    inferred = {'hybridsequential1_conv': 64, 'hybridsequential2_dense0': 3840, 'concatlayer0_dense': 256}
+    rng = np.random.RandomState(0)
+    params = {}
+    for node in symbol['nodes']:
+        if node['op'] == 'null' and node['name'] != 'data':
+            shape = list(ast.literal_eval(node['attrs']['__shape__']))
+            if len(shape) > 1 and shape[1] == 0:
+                shape[1] = next(size for key, size in inferred.items() if key in node['name'])
+            params[node['name']] = np.abs(rng.standard_normal(shape)).astype(np.float32) * 0.1
+    return NumpyCaptchaNet(symbol, params)
+
+
+def load(backend):
+    start = time.perf_counter()
+    captcha = WeiboComCaptcha(backend=backend)
+    return captcha, time.perf_counter() - start
+
+
+def time_net(net, batch_size):
+    data = np.random.RandomState(1).standard_normal((batch_size, 1, 40, 100)).astype(np.float32)
+    net(data)
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        net(data)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    backends = {}
+    if os.path.exists(NPZ_PATH):
+        backends['numpy'], elapsed = load('numpy')
+        print(f'numpy: loaded in {elapsed * 1000:.1f} ms')
+    try:
+        import mxnet  # noqa: F401
+        if os.path.exists(PARAMS_PATH):
+            backends['mxnet'], elapsed = load('mxnet')
+            print(f'mxnet: loaded in {elapsed * 1000:.1f} ms')
+    except ImportError:
+        print('mxnet is not installed, not compared.')
+
+    nets = {name: captcha.net for name, captcha in backends.items()}
+    if not nets:
+        print('No converted weights, timing the NumPy backend with random weights.')
+        nets['numpy (random weights)'] = random_net()
+    for name, net in nets.items():
+        for batch_size in BATCH_SIZES:
+            elapsed = time_net(net, batch_size)
+            print(f'{name:<24} batch {batch_size:3d}: {elapsed * 1000:8.2f} ms, '
+                  f'{elapsed * 1000 / batch_size:7.2f} ms per captcha')
+
+    if len(sys.argv) > 1 and len(backends) == 2:
+        paths = [os.path.join(sys.argv[1], name) for name in sorted(os.listdir(sys.argv[1]))]
+        ims_bytes = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                ims_bytes.append(f.read())
+        labels = {name: captcha.predict_batch(ims_bytes) for name, captcha in backends.items()}
+        mismatches = [(path, numpy_label, mxnet_label)
+                      for path, numpy_label, mxnet_label in zip(paths, labels['numpy'], labels['mxnet'])
+                      if numpy_label != mxnet_label]
+        print(f'{len(paths) - len(mismatches)} of {len(paths)} labels identical')
+        for path, numpy_label, mxnet_label in mismatches:
+            print(f'  {path}: numpy {numpy_label}, mxnet {mxnet_label}')
+
+
+if __name__ == '__main__':
+    main()
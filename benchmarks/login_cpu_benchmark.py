@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+CPU time per weibo.com login spent outside the network: parsing the prelogin, redirect and cross domain pages and
+encrypting the password, as in bulk logins of many accounts. Compares the previous inline regexes over decoded text
+with a fresh rsa.PublicKey per login against login_parsing over the response bytes with a shared RsaKeyCache.
+
+    PYTHONPATH=. python benchmarks/login_cpu_benchmark.py
+"""
+
+import binascii
+import json
+import re
+import time
+
+import requests
+import rsa
+
+from weibo_api.weibo_login import login_parsing
+from weibo_api.weibo_login.rsa_keys import RsaKeyCache, _cryptography_available
+
+ACCOUNTS = 300
+PADDING = b'<div class="W_layer">' + b'x' * 200 + b'</div>\n'
+PUBLIC_KEY, _ = rsa.newkeys(1024)
+PUBKEY = format(PUBLIC_KEY.n, 'X')
+
+
+def response(content, content_type):
+    r = requests.models.Response()
+    r._content = content
+    r.headers['Content-Type'] = content_type
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    return r
+
+
+def pages(charset):
+    content_type = 'text/html' + (f'; charset={charset}' if charset else '')
+    prelogin = json.dumps({'retcode': 0, 'servertime': 1600000000, 'pcid': 'gz-1', 'nonce': 'ABCDEF',
+                           'pubkey': PUBKEY, 'rsakv': '1330428213', 'showpin': 0}).encode('utf-8')
+    urls = json.dumps({'retcode': 0, 'arrURL': [f'https://d{i}.example/sso/crossdomain?action=login&t={i:040d}'
+                                               for i in range(6)]}).encode('utf-8')
+    return {
+        'prelogin': response(b'sinaSSOController.preloginCallBack(' + prelogin + b')',
+                             'application/javascript' + (f'; charset={charset}' if charset else '')),
+        'redirect': response(PADDING * 40 + b'<script>location.replace("https://login.sina.com.cn/crossdomain2.php'
+                             b'?action=login&r=https%3A%2F%2Fweibo.com");</script>' + PADDING * 40, content_type),
+        'cross_domain': response(PADDING * 60 + b'<script>sinaSSOController.setCrossDomainUrlList(' + urls +
+                                 b');\nlocation.replace(\'https://passport.weibo.com/wbsso/login?ticket=ST-1\');'
+                                 b'</script>' + PADDING * 60, content_type),
+    }
+
+
+def secret(i):
+    return f'1600000000\tABCDEF\npassword{i}'.encode('utf-8')
+
+
+def inline_login(p, i):
+    # Fresh Response objects per login, as in a real login
+    p = {name: response(r.content, r.headers['Content-Type']) for name, r in p.items()}
+    data = json.loads(re.findall(r'preloginCallBack\(([\w\W]+?)\)', p['prelogin'].text)[0])
+    key = rsa.PublicKey(int(data['pubkey'], 16), 65537)
+    binascii.b2a_hex(rsa.encrypt(secret(i), key))
+    for _ in range(2):  # weibo.com cross domain login and weibo.cn auth
+        re.search(r'location.replace\("([^"]+)"\);', p['redirect'].text).group(1)
+        json.loads(re.search(r'setCrossDomainUrlList\(([\w\W]+?)\)', p['cross_domain'].text).group(1))['arrURL']
+        re.search(r'location.replace\(\'([^\']+)\'\)', p['cross_domain'].text).group(1)
+
+
+def parsing_login(cache):
+    def login(p, i):
+        p = {name: response(r.content, r.headers['Content-Type']) for name, r in p.items()}
+        data = login_parsing.prelogin_data(p['prelogin'].content)
+        binascii.b2a_hex(cache.encrypt(data['rsakv'], data['pubkey'], secret(i)))
+        for _ in range(2):
+            login_parsing.location_replace(p['redirect'].content)
+            login_parsing.cross_domain_urls(p['cross_domain'].content)
+            login_parsing.location_replace(p['cross_domain'].content, quote="'")
+    return login
+
+
+def cpu_per_login(login, p):
+    start = time.process_time()
+    for i in range(ACCOUNTS):
+        login(p, i)
+    return (time.process_time() - start) / ACCOUNTS
+
+
+def main():
+    scenarios = {'inline re, rsa.PublicKey per login': inline_login,
+                 'login_parsing, RsaKeyCache(rsa)': parsing_login(RsaKeyCache(backend='rsa'))}
+    if _cryptography_available():
+        scenarios['login_parsing, RsaKeyCache(cryptography)'] = parsing_login(RsaKeyCache(backend='cryptography'))
+    print(f'{ACCOUNTS} logins, 1024 bit key, pages of {len(pages("utf-8")["cross_domain"].content) // 1024} KiB')
+    for charset in ('utf-8', None):
+        p = pages(charset)
+        print(f'charset {"declared" if charset else "not declared"}:')
+        for name, login in scenarios.items():
+            print(f'  {name:<42} {cpu_per_login(login, p) * 1e6:8.1f} us CPU per login')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Peak Python heap allocation of a m.weibo.cn picture upload, streamed vs. building the multipart body in memory.
+
+Uploads go to a local stub server that discards the body in small blocks.
+
+    PYTHONPATH=. python benchmarks/pic_upload_memory_benchmark.py
+"""
+
+import json
+import os
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests_toolbelt import MultipartEncoder
+
+from weibo_api import WeiboCnApi
+from weibo_api.weibo_cn_api import weibo_cn_api
+
+SIZES_MB = (1, 4)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.reply({'data': {'login': True, 'st': 'st'}, 'ok': 1})
+
+    def do_POST(self):
+        left = int(self.headers['Content-Length'])
+        while left:
+            left -= len(self.rfile.read(min(left, 64 * 1024)))
+        self.reply({'pic_id': 'pic_id'})
+
+    def reply(self, rsp):
+        data = json.dumps(rsp).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def in_memory_upload(session, filename):
+    """The previous implementation: read the file and render the whole multipart body before sending."""
+    with open(filename, 'rb') as f:
+        encoder = MultipartEncoder([('type', 'json'), ('st', 'st'), ('pic', ('pic', f.read(), 'image/jpeg'))])
+        session.post(weibo_cn_api.UPLOAD_PIC_URL, headers={'Content-Type': encoder.content_type},
+                     data=encoder.to_string())
+
+
+def measure(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    weibo_cn_api.ST_URL = base_url + '/api/config'
+    weibo_cn_api.UPLOAD_PIC_URL = base_url + '/api/statuses/uploadPic'
+
+    session = requests.Session()
+    weibo = WeiboCnApi(session=session)
+    try:
+        for size_mb in SIZES_MB:
+            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+                f.write(os.urandom(size_mb * 1024 * 1024))
+            try:
+                streamed = measure(lambda: weibo.get_pic_id(f.name))
+                in_memory = measure(lambda: in_memory_upload(session, f.name))
+                print(f'{size_mb} MB picture: streamed peak {streamed:6.2f} MB, in-memory peak {in_memory:6.2f} MB')
+            finally:
+                os.remove(f.name)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
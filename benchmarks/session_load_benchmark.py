@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cost of the JSON session files of SessionStore compared with pickled requests sessions (the previous format), for
+many accounts with a realistic number of cookies each. JSON is not faster: it loads about as fast as pickle and saves
+slower. It is used because loading it cannot run code, and it does not depend on the pickled requests internals, so
+session files survive requests upgrades and can be read by other tools.
+
+    PYTHONPATH=. python benchmarks/session_load_benchmark.py
+"""
+
+import os
+import pickle
+import tempfile
+import time
+
+from weibo_api.session_factory import SessionFactory
+from weibo_api.session_store import SessionStore
+
+ACCOUNTS = 500
+COOKIES_PER_DOMAIN = 10
+DOMAINS = ('.weibo.com', '.weibo.cn', '.sina.com.cn', 'login.sina.com.cn', 'passport.weibo.com', '.sina.cn')
+
+
+def account_session(i):
+    session = SessionFactory().create()
+    for domain in DOMAINS:
+        for j in range(COOKIES_PER_DOMAIN):
+            session.cookies.set(f'cookie{j}', f'{i:08x}' * 12, domain=domain, path='/',
+                                expires=int(time.time()) + 86400, rest={'HttpOnly': None})
+    return session
+
+
+def timed(function, paths):
+    start = time.perf_counter()
+    for path in paths:
+        function(path)
+    return (time.perf_counter() - start) / len(paths)
+
+
+def main():
+    store = SessionStore()
+    factory = SessionFactory()
+    sessions = [account_session(i) for i in range(ACCOUNTS)]
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_paths = [os.path.join(tmp, f'{i}.pkl') for i in range(ACCOUNTS)]
+        json_paths = [os.path.join(tmp, f'{i}.json') for i in range(ACCOUNTS)]
+
+        def save_pickle(i):
+            with open(pickle_paths[i], 'wb') as f:
+                pickle.dump(sessions[i], f)
+
+        def load_pickle(path):
+            with open(path, 'rb') as f:
+                return factory.mount(pickle.load(f))
+
+        results = {
+            'pickle save': timed(save_pickle, range(ACCOUNTS)),
+            'json save': timed(lambda i: store.save(json_paths[i], sessions[i]), range(ACCOUNTS)),
+            'json save, unchanged': timed(lambda i: store.save(json_paths[i], sessions[i]), range(ACCOUNTS)),
+            'pickle load': timed(load_pickle, pickle_paths),
+            'json load': timed(lambda path: store.load(path, factory.create()), json_paths),
+            'json cookies only': timed(store.load_cookies, json_paths),
+        }
+        sizes = {'pickle': os.path.getsize(pickle_paths[0]), 'json': os.path.getsize(json_paths[0])}
+
+    print(f'{ACCOUNTS} accounts, {len(DOMAINS) * COOKIES_PER_DOMAIN} cookies each; file size: pickle '
+          f'{sizes["pickle"]} B, json {sizes["json"]} B')
+    for name, elapsed in results.items():
+        print(f'{name:<22} {elapsed * 1000:7.3f} ms per account')
+
+
+if __name__ == '__main__':
+    main()
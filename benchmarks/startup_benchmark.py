@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process startup cost of weibo_api: wall time and peak RSS of fresh interpreters importing the package and
+constructing a WeiboLoginApi, and which heavy dependencies (mxnet, PIL, numpy) got imported on the way.
+
+    PYTHONPATH=. python benchmarks/startup_benchmark.py
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 10
+
+SCENARIOS = {
+    'python': 'pass',
+    'import weibo_api': 'import weibo_api',
+    'WeiboLoginApi()': ('from weibo_api.weibo_login import WeiboLoginApi\n'
+                        "WeiboLoginApi(login_user='user', login_password='password')"),
+}
+
+PROBE = """
+import json, resource, sys
+{code}
+print(json.dumps({{'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'heavy': [m for m in ('mxnet', 'PIL', 'numpy') if m in sys.modules]}}))
+"""
+
+
+def run(code):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', PROBE.format(code=code)], capture_output=True, text=True,
+                            check=True, env=dict(os.environ, PYTHONPATH=os.getcwd())).stdout
+    return time.perf_counter() - start, json.loads(output)
+
+
+def main():
+    for name, code in SCENARIOS.items():
+        results = [run(code) for _ in range(RUNS)]
+        times = sorted(elapsed for elapsed, _ in results)
+        probe = results[-1][1]
+        print(f'{name:<18} median {statistics.median(times) * 1000:7.1f} ms, min {times[0] * 1000:7.1f} ms, '
+              f'peak RSS {probe["rss_mb"]:6.1f} MB, heavy modules: {", ".join(probe["heavy"]) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
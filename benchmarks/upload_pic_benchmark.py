@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput and peak Python heap allocation of WeiboComApi.upload_pic, streamed base64 form body vs. encoding the
+whole picture in memory, against a local stub of picupload.weibo.com.
+
+    PYTHONPATH=. python benchmarks/upload_pic_benchmark.py
+"""
+
+import base64
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from weibo_api import WeiboComApi
+from weibo_api.weibo_com_api import weibo_com_api
+
+SIZES_MB = (10, 30, 50)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        left = int(self.headers['Content-Length'])
+        while left:
+            left -= len(self.rfile.read(min(left, 64 * 1024)))
+        self.send_response(302)
+        self.send_header('Location', '/upimgback.html?ret=1&pid=pid')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def in_memory_upload(session, filename):
+    """The previous implementation: base64 encode the whole picture into a form dict."""
+    with open(filename, 'rb') as f:
+        data = {'b64_data': base64.b64encode(f.read())}
+        session.post(weibo_com_api.MULTIMEDIA_UPLOAD_PIC_URL, data=data)
+
+
+def measure(fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    weibo_com_api.MULTIMEDIA_UPLOAD_PIC_URL = f'http://127.0.0.1:{server.server_address[1]}/interface/pic_upload.php'
+
+    session = requests.Session()
+    weibo = WeiboComApi(session=session)
+    try:
+        for size_mb in SIZES_MB:
+            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+                f.write(os.urandom(size_mb * 1024 * 1024))
+            try:
+                for name, fn in (('streamed', lambda: weibo.upload_pic(f.name)),
+                                 ('in-memory', lambda: in_memory_upload(session, f.name))):
+                    elapsed, peak = measure(fn)
+                    print(f'{size_mb:3d} MB {name:<10} {size_mb / elapsed:7.1f} MB/s, peak {peak:8.2f} MB')
+            finally:
+                os.remove(f.name)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
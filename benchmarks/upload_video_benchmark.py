@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Video upload throughput against a local stub of the multimedia upload endpoints.
+
+The stub delays every chunk by a fixed round trip plus a per-connection transfer time, which is roughly what a
+single upload connection to fileplatform.api.weibo.com looks like.
+
+    PYTHONPATH=. python benchmarks/upload_video_benchmark.py
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from weibo_api import WeiboComApi
+from weibo_api.weibo_com_api import weibo_com_api
+
+FILE_SIZE = 16 * 1024 * 1024
+CHUNK_KB = 1024
+ROUND_TRIP = 0.05
+CONNECTION_BANDWIDTH = 20 * 1024 * 1024  # bytes per second per connection
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    received = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path.endswith('init.json'):
+            StubHandler.received.clear()
+            rsp = {'fileToken': 'token', 'length': CHUNK_KB}
+        else:
+            time.sleep(ROUND_TRIP + len(body) / CONNECTION_BANDWIDTH)
+            with StubHandler.lock:
+                StubHandler.received[int(query['startloc'][0])] = len(body)
+                done = sum(StubHandler.received.values()) >= FILE_SIZE
+            rsp = {'fid': 'fid'} if done else {'succ': True}
+        data = json.dumps(rsp).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    weibo_com_api.MULTIMEDIA_INIT_URL = base_url + '/init.json'
+    weibo_com_api.MULTIMEDIA_UPLOAD_DATA_URL = base_url + '/upload.json'
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(FILE_SIZE))
+    try:
+        for concurrency in (1, 2, 4, 8):
+            weibo = WeiboComApi(session=requests.Session(), upload_concurrency=concurrency)
+            start = time.perf_counter()
+            assert weibo.upload_video(f.name) == 'fid'
+            elapsed = time.perf_counter() - start
+            print(f'concurrency={concurrency}: {elapsed:6.2f}s, {FILE_SIZE / elapsed / 1024 / 1024:6.1f} MB/s')
+    finally:
+        os.remove(f.name)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
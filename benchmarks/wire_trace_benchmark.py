@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-request overhead of the wire trace modes, measured on a response carrying an upload-sized request body.
+
+    PYTHONPATH=. python benchmarks/wire_trace_benchmark.py
+"""
+
+import logging
+import timeit
+
+import requests
+from requests_toolbelt.utils import dump
+from urllib3.response import HTTPHeaderDict
+
+from weibo_api.wire_trace import WireTrace, WIRE_TRACE_FULL, WIRE_TRACE_HEADERS, WIRE_TRACE_OFF
+
+BODY_SIZE = 8 * 1024 * 1024
+ROUNDS = 50
+
+
+def make_response():
+    request = requests.Request('POST', 'https://fileplatform.api.weibo.com/2/multimedia/upload.json',
+                               data=b'\0' * BODY_SIZE).prepare()
+    rsp = requests.Response()
+    rsp.request = request
+    rsp.status_code = 200
+    rsp.reason = 'OK'
+    rsp._content = b'{"succ":true}'
+    rsp.connection = None
+    rsp.raw = type('Raw', (), {'version': 11, 'status': 200, 'headers': HTTPHeaderDict()})()
+    return rsp
+
+
+def legacy(logger, rsp):
+    data = dump.dump_all(rsp)
+    logger.debug(str(bytes(data), encoding='utf-8', errors='ignore').replace('\r\n', '\n'))
+
+
+def main():
+    logger = logging.getLogger('wire_trace_benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    rsp = make_response()
+
+    for level in (logging.INFO, logging.DEBUG):
+        logger.setLevel(level)
+        print(f'Logger level: {logging.getLevelName(level)}')
+        cases = [('legacy dump_all', lambda: legacy(logger, rsp))]
+        for mode in (WIRE_TRACE_OFF, WIRE_TRACE_HEADERS, WIRE_TRACE_FULL):
+            trace = WireTrace(mode)
+            cases.append((mode, lambda trace=trace: trace.log(logger, rsp)))
+        for name, case in cases:
+            seconds = timeit.timeit(case, number=ROUNDS) / ROUNDS
+            print(f'  {name:<16} {seconds * 1e6:12.1f} us/request')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import sys
+import time
+
+from weibo_api.aio import AsyncWeiboCnApi, AsyncWeiboComApi
+
+
+async def post():
+    async with AsyncWeiboCnApi(weibo_session_file='./weibo_session.pkl') as weibo:
+        pic_id = await weibo.get_pic_id('./zyene.png')
+        response = await weibo.post_status("test post " + str(time.time()), [pic_id])
+        print(f'Response status: {response.get("ok", "Unknown error")}. (1 means successful.)')
+
+
+async def post_video():
+    async with AsyncWeiboComApi(weibo_session_file='./weibo_session.pkl', upload_concurrency=4) as weibo:
+        vid, pid = await asyncio.gather(weibo.upload_video('video.mp4'), weibo.upload_pic('zyene.png'))
+        response = await weibo.post_status('test post' + str(time.time()), vid, pid)
+        print(f'Response status: {response.get("code", "Unknown error")}. (100000 means successful.)')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    asyncio.run(post())
+    asyncio.run(post_video())
@@ -9,13 +9,15 @@ setup(
     author=__author__,
     license='MIT',
     url='https://github.com/wdwind/weibo_api/tree/master',
-    install_requires=['cookiejar', 'mxnet>=1.3.1,<1.6.0', 'pillow', 'requests', 'requests_toolbelt', 'rsa'],
+    install_requires=['cookiejar', 'numpy', 'pillow', 'requests', 'requests_toolbelt', 'rsa'],
+    extras_require={'aio': ['aiohttp>=3.8'], 'mxnet': ['mxnet>=1.3.1,<1.6.0'],
+                    'cryptography': ['cryptography']},
     test_requires=[],
     include_package_data=True,
     keywords='Weibo api',
     description='An api for posting weibo (text, image, and video).',
     packages=find_packages(exclude=('tests',)),
-    package_data={'': ['model/*.params', 'model/*.json', 'model/*.pkl']},
+    package_data={'': ['model/*.params', 'model/*.npz', 'model/*.json', 'model/*.pkl']},
     classifiers=[
         'Development Status :: Beta',
         'Intended Audience :: Developers',
@@ -0,0 +1,245 @@
+import base64
+import os
+import pickle
+import tempfile
+import unittest
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+import aiohttp
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from yarl import URL
+
+from weibo_api.aio import AsyncWeiboCnApi, AsyncWeiboComApi
+from weibo_api.aio.async_requests_wrapper import to_cookie_jar
+from weibo_api.hashing import file_digests
+from weibo_api.http_metrics import HttpMetrics
+from weibo_api.weibo_com_api.upload_manifest import UploadManifest
+
+
+def requests_session():
+    session = requests.Session()
+    session.cookies.set('SUB', 'cn-sub', domain='.weibo.cn', path='/')
+    session.cookies.set('SUB', 'com-sub', domain='.weibo.com', path='/')
+    return session
+
+
+class CookieConversionTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_to_cookie_jar_keeps_domains(self):
+        jar = to_cookie_jar(requests_session())
+        self.assertEqual(jar.filter_cookies(URL('https://m.weibo.cn/api/config'))['SUB'].value, 'cn-sub')
+        self.assertEqual(jar.filter_cookies(URL('https://www.weibo.com/aj/mblog/add'))['SUB'].value, 'com-sub')
+        self.assertNotIn('SUB', jar.filter_cookies(URL('https://example.com/')))
+
+    def test_weibo_session_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session_file = os.path.join(tmp, 'session.pkl')
+            with open(session_file, 'wb') as f:
+                pickle.dump(requests_session(), f)
+            weibo = AsyncWeiboCnApi(weibo_session_file=session_file)
+            self.assertEqual({cookie.value for cookie in weibo.cookies}, {'cn-sub', 'com-sub'})
+
+    def test_no_session(self):
+        with self.assertRaises(ValueError):
+            AsyncWeiboComApi(weibo_session_file='missing.pkl')
+
+
+class AsyncTestCase(unittest.IsolatedAsyncioTestCase):
+    """Runs the clients against a local aiohttp server with the endpoints under test."""
+
+    MODULE = None
+
+    def routes(self):
+        raise NotImplementedError
+
+    async def asyncSetUp(self):
+        self.requests = []
+        app = web.Application()
+        app.add_routes(self.routes())
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.session = aiohttp.ClientSession()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.server.close()
+
+    def url(self, path):
+        return str(self.server.make_url(path))
+
+
+class AsyncWeiboCnApiTest(AsyncTestCase):
+
+    def routes(self):
+        return [web.get('/api/config', self.config), web.post('/api/statuses/uploadPic', self.upload_pic),
+                web.post('/api/statuses/update', self.update), web.post('/api/statuses/repost', self.update)]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.st_count = 0
+        self.expire_next = False
+        urls = {'ST_URL': self.url('/api/config'), 'UPLOAD_PIC_URL': self.url('/api/statuses/uploadPic'),
+                'POST_STATUS_URL': self.url('/api/statuses/update'), 'REPOST_URL': self.url('/api/statuses/repost')}
+        self.patcher = patch.multiple('weibo_api.aio.async_weibo_cn_api', **urls)
+        self.patcher.start()
+        self.weibo = AsyncWeiboCnApi(session=self.session)
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await super().asyncTearDown()
+
+    async def config(self, request):
+        self.st_count += 1
+        return web.json_response({'data': {'login': True, 'st': f'st{self.st_count}'}, 'ok': 1})
+
+    async def upload_pic(self, request):
+        form = await request.post()
+        self.requests.append((request.headers, dict(form, pic=(form['pic'].content_type, form['pic'].file.read()))))
+        return web.json_response({'pic_id': 'pic_id'})
+
+    async def update(self, request):
+        form = await request.post()
+        self.requests.append((request.headers, form))
+        if self.expire_next:
+            self.expire_next = False
+            return web.json_response({'ok': 0, 'errno': '100006'})
+        return web.json_response({'ok': 1, 'data': {}})
+
+    async def test_post_status(self):
+        await self.weibo.post_status('content', ['a', 'b'])
+        headers, form = self.requests[0]
+        self.assertEqual(headers['X-XSRF-TOKEN'], 'st1')
+        self.assertEqual(dict(form), {'content': 'content', 'picId': 'a,b', 'st': 'st1'})
+
+    async def test_metrics(self):
+        events = []
+        self.weibo.http_metrics = HttpMetrics([events.append])
+        await self.weibo.post_status('content')
+        self.assertEqual([(e.operation, e.status) for e in events], [('cn.st', 200), ('cn.post_status', 200)])
+        self.assertGreater(events[0].bytes_received, 0)
+
+    async def test_repost_refreshes_expired_st(self):
+        await self.weibo.post_status('content')
+        self.expire_next = True
+        await self.weibo.repost('123', 'content')
+        self.assertEqual([form['st'] for _, form in self.requests], ['st1', 'st1', 'st2'])
+        self.assertEqual(self.requests[-1][1]['mid'], '123')
+
+    async def test_get_pic_id(self):
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
+            f.write(b'png data')
+        try:
+            self.assertEqual(await self.weibo.get_pic_id(f.name), 'pic_id')
+            self.assertEqual(await self.weibo.get_pic_id(memoryview(b'raw data')), 'pic_id')
+        finally:
+            os.remove(f.name)
+
+        (headers, form), (_, raw_form) = self.requests
+        self.assertEqual(headers['X-XSRF-TOKEN'], 'st1')
+        self.assertEqual(form['st'], 'st1')
+        self.assertEqual(form['type'], 'json')
+        self.assertEqual(form['pic'], ('image/png', b'png data'))
+        self.assertEqual(raw_form['pic'][1], b'raw data')
+        self.assertEqual(self.weibo.st_cache.stats, {'hits': 1, 'misses': 1})
+
+
+class AsyncWeiboComApiTest(AsyncTestCase):
+
+    def routes(self):
+        return [web.post('/init.json', self.init), web.post('/upload.json', self.upload_data),
+                web.post('/pic_upload.php', self.upload_pic), web.get('/upimgback.html', self.upimgback),
+                web.post('/aj/mblog/add', self.add)]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.chunks = {}
+        urls = {'MULTIMEDIA_INIT_URL': self.url('/init.json'), 'MULTIMEDIA_UPLOAD_DATA_URL': self.url('/upload.json'),
+                'MULTIMEDIA_UPLOAD_PIC_URL': self.url('/pic_upload.php'), 'POST_WEIBO_URL': self.url('/aj/mblog/add')}
+        self.patcher = patch.multiple('weibo_api.aio.async_weibo_com_api', **urls)
+        self.patcher.start()
+        self.weibo = AsyncWeiboComApi(session=self.session, upload_concurrency=2)
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await super().asyncTearDown()
+
+    async def init(self, request):
+        self.requests.append('init')
+        return web.json_response({'fileToken': 'token', 'length': 1})
+
+    async def upload_data(self, request):
+        if request.query['filetoken'] != 'token':
+            return web.json_response({'error': 'invalid filetoken'})
+        start_location = int(request.query['startloc'])
+        self.chunks[start_location] = await request.read()
+        if len(self.chunks) < 3:
+            return web.json_response({'succ': True})
+        return web.json_response({'fid': 'fid'})
+
+    async def upload_pic(self, request):
+        self.requests.append((request.headers, await request.read()))
+        raise web.HTTPFound('/upimgback.html?ret=1&pid=pid')
+
+    async def upimgback(self, request):
+        return web.Response(text='')
+
+    async def add(self, request):
+        self.requests.append((request.headers, await request.post()))
+        return web.json_response({'code': '100000', 'data': {}})
+
+    async def test_upload_video(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(os.urandom(2500))
+        try:
+            self.assertEqual(await self.weibo.upload_video(f.name), 'fid')
+            with open(f.name, 'rb') as f:
+                data = f.read()
+        finally:
+            os.remove(f.name)
+        self.assertEqual(b''.join(self.chunks[start] for start in sorted(self.chunks)), data)
+        self.assertEqual(sorted(self.chunks), [0, 1024, 2048])
+
+    async def test_dead_resumed_token_restarts_upload(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'video.mp4')
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(2500))
+            manifest_dir = os.path.join(tmp_dir, 'manifests')
+            md5, _ = file_digests(filename)
+            UploadManifest.load(manifest_dir, filename, md5).start('expired', 1024)
+            weibo = AsyncWeiboComApi(session=self.session, upload_manifest_dir=manifest_dir, chunk_retries=0)
+
+            with self.assertRaises(RuntimeError):
+                await weibo.upload_video(filename)
+            self.assertNotIn('init', self.requests)
+            self.assertEqual(os.listdir(manifest_dir), [])
+
+            self.assertEqual(await weibo.upload_video(filename), 'fid')
+            self.assertIn('init', self.requests)
+
+    async def test_upload_pic(self):
+        data = os.urandom(100000)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(data)
+        try:
+            self.assertEqual(await self.weibo.upload_pic(f.name), 'pid')
+        finally:
+            os.remove(f.name)
+        headers, body = self.requests[0]
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        self.assertEqual(base64.b64decode(parse_qs(body.decode('ascii'))['b64_data'][0]), data)
+
+    async def test_post_status(self):
+        rsp_data = await self.weibo.post_status('caption of the video', 'video_id', 'pic_id', ['a', 'b'])
+        self.assertEqual(rsp_data['code'], '100000')
+        _, form = self.requests[0]
+        self.assertEqual(form['video_fid'], 'video_id')
+        self.assertEqual(form['video_tags'], 'a|b')
+        self.assertEqual(form['video_covers'], 'http://wx3.sinaimg.cn/large/pic_id.jpg|640|360')
+
+    async def test_post_status_short_caption(self):
+        with self.assertRaises(ValueError):
+            await self.weibo.post_status('short', 'video_id', 'pic_id')
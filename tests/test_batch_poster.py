@@ -0,0 +1,134 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+import requests
+
+from weibo_api.exceptions import CircuitOpenError, LoginException, WeiboApiError
+from weibo_api.weibo_cn_api import BatchPoster, PostJob
+
+
+def api(side_effect=None):
+    api = MagicMock()
+    api.post_status.side_effect = side_effect or (lambda content, pic_ids: {'ok': 1, 'content': content})
+    api.repost.side_effect = lambda repost_id, content: {'ok': 1, 'repost_id': repost_id}
+    return api
+
+
+def throttled():
+    rsp_data = {'ok': 0, 'errno': '20016'}
+    return WeiboApiError('throttled', rsp_data)
+
+
+class BatchPosterTest(unittest.TestCase):
+
+    FAST = {'account_rate': 1000, 'account_burst': 10, 'global_rate': 1000, 'global_burst': 10,
+            'backoff_base': 0.01, 'backoff_max': 0.05}
+
+    def test_results_in_submission_order(self):
+        apis = {'a': api(), 'b': api()}
+        jobs = [PostJob('a', 'a1'), PostJob('b', 'b1'), PostJob('a', 'a2', repost_id='123'), PostJob('b', 'b2')]
+        results = BatchPoster(apis, **self.FAST).run(jobs)
+        self.assertEqual([result.job for result in results], jobs)
+        self.assertEqual(results[2].rsp_data, {'ok': 1, 'repost_id': '123'})
+        apis['a'].post_status.assert_called_once_with('a1', None)
+        self.assertEqual(apis['b'].post_status.call_count, 2)
+
+    def test_one_job_in_flight_per_account(self):
+        in_flight = []
+        lock = threading.Lock()
+        overlap = []
+
+        def post_status(content, pic_ids):
+            with lock:
+                overlap.append(content in in_flight or bool(in_flight))
+                in_flight.append(content)
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(content)
+            return {'ok': 1}
+
+        poster = BatchPoster({'a': api(post_status)}, max_workers=4, **self.FAST)
+        poster.run([PostJob('a', str(i)) for i in range(5)])
+        self.assertFalse(any(overlap))
+
+    def test_global_rate_limit(self):
+        apis = {name: api() for name in 'abcd'}
+        config = dict(self.FAST, global_rate=50, global_burst=1)
+        start = time.monotonic()
+        BatchPoster(apis, **config).run([PostJob(name, 'content') for name in 'abcd'])
+        # The first job uses the burst token, the other three wait for 1/50s each.
+        self.assertGreaterEqual(time.monotonic() - start, 3 / 50 * 0.9)
+
+    def test_account_rate_limit(self):
+        config = dict(self.FAST, account_rate=50, account_burst=1)
+        start = time.monotonic()
+        BatchPoster({'a': api()}, **config).run([PostJob('a', str(i)) for i in range(3)])
+        self.assertGreaterEqual(time.monotonic() - start, 2 / 50 * 0.9)
+
+    def test_throttling_backs_off_and_slows_down(self):
+        post_status = MagicMock(side_effect=[throttled(), {'ok': 1}])
+        poster = BatchPoster({'a': api(post_status)}, **self.FAST)
+        results = poster.run([PostJob('a', 'content')])
+
+        self.assertEqual(results[0].rsp_data, {'ok': 1})
+        self.assertEqual(results[0].attempts, 2)
+        stats = poster.stats
+        self.assertEqual(stats['retried'], 1)
+        self.assertEqual(stats['throttled'], 1)
+        # Halved, then raised by a tenth on success
+        self.assertAlmostEqual(stats['accounts']['a']['rate'], 1000 * 0.6)
+
+    def test_gives_up_after_max_attempts(self):
+        error = WeiboApiError('error', {'ok': 0})
+        poster = BatchPoster({'a': api(MagicMock(side_effect=error))}, max_attempts=2, **self.FAST)
+        result, = poster.run([PostJob('a', 'content')])
+        self.assertIs(result.error, error)
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(poster.stats['failed'], 1)
+        self.assertEqual(poster.stats['throttled'], 0)
+
+    def test_login_exception_not_retried(self):
+        post_status = MagicMock(side_effect=LoginException('Login required.'))
+        result, = BatchPoster({'a': api(post_status)}, **self.FAST).run([PostJob('a', 'content')])
+        self.assertIsInstance(result.error, LoginException)
+        self.assertEqual(post_status.call_count, 1)
+
+    def test_only_unsent_errors_retried(self):
+        # Refused connection: the post never reached the server
+        try:
+            requests.post('http://127.0.0.1:1/', timeout=1)
+        except requests.ConnectionError as e:
+            refused = e
+        for error, calls in ((refused, 2), (CircuitOpenError('open'), 2), (requests.ConnectTimeout('connect'), 2),
+                             (requests.ReadTimeout('read'), 1), (requests.ConnectionError('reset'), 1),
+                             (ValueError('not json'), 1)):
+            post_status = MagicMock(side_effect=[error, {'ok': 1}])
+            result, = BatchPoster({'a': api(post_status)}, **self.FAST).run([PostJob('a', 'content')])
+            self.assertEqual(post_status.call_count, calls, error)
+            self.assertEqual(result.error is None, calls == 2)
+
+    def test_failures_not_counted_as_posts(self):
+        post_status = MagicMock(side_effect=LoginException('Login required.'))
+        poster = BatchPoster({'a': api(post_status), 'b': api()}, **self.FAST)
+        poster.run([PostJob('a', 'a1'), PostJob('b', 'b1')])
+        self.assertEqual(poster.stats['failed'], 1)
+        self.assertEqual(poster.stats['posts_per_minute'], 1)
+
+    def test_stats(self):
+        poster = BatchPoster({'a': api(), 'b': api()}, **self.FAST)
+        poster.submit(PostJob('a', 'a1'))
+        poster.submit(PostJob('a', 'a2'))
+        poster.submit(PostJob('b', 'b1'))
+        self.assertEqual(poster.stats['queue_depth'], 3)
+        poster.run()
+        stats = poster.stats
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['max_queue_depth'], 3)
+        self.assertEqual(stats['succeeded'], 3)
+        self.assertEqual(stats['posts_per_minute'], 3)
+
+    def test_unknown_account(self):
+        with self.assertRaises(ValueError):
+            BatchPoster({'a': api()}).submit(PostJob('b', 'content'))
@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from weibo_api.simple_captcha.sample_store import CaptchaLabel, CaptchaSampleStore
+
+
+class CaptchaSampleStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = CaptchaSampleStore(os.path.join(self.tmp.name, 'data'))
+        self.addCleanup(self.store.close)
+
+    def read(self, path):
+        with open(os.path.join(self.store.data_path, path), 'rb') as f:
+            return f.read()
+
+    def rows(self):
+        with sqlite3.connect(os.path.join(self.store.data_path, CaptchaSampleStore.INDEX_NAME)) as db:
+            return {row[0]: row[1:] for row in db.execute('SELECT id, label, path, wrong FROM samples')}
+
+    def test_add(self):
+        sample_id = self.store.add(b'png bytes', 'ab12c', 'PNG')
+        self.store.flush()
+        path = os.path.join(sample_id[:2], f'ab12c_{sample_id}.png')
+        self.assertEqual(self.read(path), b'png bytes')
+        self.assertEqual(self.rows(), {sample_id: ('ab12c', path, 0)})
+
+    def test_mark_wrong_by_id(self):
+        first = self.store.add(b'1', 'ab12c')
+        second = self.store.add(b'2', 'ab12c')
+        self.store.mark_wrong(first, 'ab12c')
+        self.store.flush()
+        path = os.path.join(first[:2], f'wrong_ab12c_{first}.png')
+        self.assertEqual(self.read(path), b'1')
+        self.assertEqual(self.rows()[first], ('ab12c', path, 1))
+        self.assertEqual(self.rows()[second][2], 0)
+
+    def test_mark_wrong_by_label(self):
+        self.store.add(b'1', 'xyz12')
+        first = self.store.add(b'2', 'ab12c')
+        second = self.store.add(b'3', 'ab12c')
+        self.store.mark_wrong(label='ab12c')
+        self.store.mark_wrong(label='ab12c')
+        self.store.flush()
+        rows = self.rows()
+        self.assertEqual([rows[first][2], rows[second][2]], [1, 1])
+        self.assertEqual(self.read(rows[second][1]), b'3')
+        self.assertEqual(sum(wrong for _, _, wrong in rows.values()), 2)
+
+    def test_unknown_sample(self):
+        self.store.add(b'1', 'ab12c')
+        with patch.object(self.store.logger, 'error') as error:
+            self.store.mark_wrong('missing', 'ab12c')
+            self.store.mark_wrong(label='zzzzz')
+            self.store.flush()
+        self.assertEqual(error.call_count, 2)
+        self.assertEqual([wrong for _, _, wrong in self.rows().values()], [0])
+
+    def test_closed(self):
+        self.store.add(b'1', 'ab12c')
+        self.store.close()
+        self.assertEqual(len(self.rows()), 1)
+        with self.assertRaises(RuntimeError):
+            self.store.add(b'2', 'ab12c')
+
+    def test_label(self):
+        label = CaptchaLabel('ab12c', 'id')
+        self.assertEqual(label, 'ab12c')
+        self.assertEqual(label.sample_id, 'id')
+        self.assertIsNone(CaptchaLabel('ab12c').sample_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
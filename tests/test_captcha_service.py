@@ -0,0 +1,146 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from weibo_api.simple_captcha.captcha_service import CaptchaBatcher, CaptchaClient, create_captcha_server
+from weibo_api.simple_captcha.sample_store import CaptchaLabel
+
+
+class FakeModel(object):
+    """Labels a captcha with its bytes, reversed. b'saved' is labeled with a sample id."""
+
+    def __init__(self):
+        self.batches = []
+        self.reported = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def predict_batch(self, ims_bytes, return_exceptions=False):
+        """b'fail' fails the whole batch, b'bad' only its own label."""
+        self.release.wait()
+        self.batches.append(len(ims_bytes))
+        if b'fail' in ims_bytes or (b'bad' in ims_bytes and not return_exceptions):
+            raise ValueError('broken image')
+        return [ValueError('bad image') if im_bytes == b'bad' else
+                CaptchaLabel(im_bytes[::-1].decode('ascii'), '42' if im_bytes == b'saved' else None)
+                for im_bytes in ims_bytes]
+
+    def report_wrong_result(self, predicted_label):
+        self.reported.append(predicted_label)
+
+
+class CaptchaBatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = FakeModel()
+        self.batcher = CaptchaBatcher(self.model, max_batch_size=4, max_wait=0.05)
+
+    def tearDown(self):
+        self.batcher.close()
+
+    def test_predict(self):
+        self.assertEqual(self.batcher.predict(b'abcd'), 'dcba')
+        self.assertEqual(self.batcher.stats['batch_sizes'], {1: 1})
+
+    def test_concurrent_requests_are_batched(self):
+        # Hold the first batch, so the remaining captchas queue up behind it.
+        self.model.release.clear()
+        first = self.batcher.submit(b'0')
+        futures = [self.batcher.submit(str(i).encode('ascii')) for i in range(1, 10)]
+        self.model.release.set()
+        self.assertEqual(first.result(), '0')
+        self.assertEqual([future.result() for future in futures], [str(i) for i in range(1, 10)])
+        self.assertEqual(sum(self.model.batches), 10)
+        self.assertLessEqual(max(self.model.batches), 4)
+        self.assertLess(len(self.model.batches), 10)
+        stats = self.batcher.stats
+        self.assertEqual(stats['captchas'], 10)
+        self.assertEqual(stats['batches'], len(self.model.batches))
+        self.assertGreater(stats['mean_batch_size'], 1)
+        self.assertIsNotNone(stats['latency_p99'])
+
+    def test_threads(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            labels = list(executor.map(self.batcher.predict, [b'ab'] * 32))
+        self.assertEqual(labels, ['ba'] * 32)
+        self.assertLess(self.batcher.stats['batches'], 32)
+
+    def test_failed_batch(self):
+        with self.assertRaises(ValueError):
+            self.batcher.predict(b'fail')
+        self.assertEqual(self.batcher.stats['errors'], 1)
+        self.assertEqual(self.batcher.predict(b'ok'), 'ko')
+
+    def test_bad_image_fails_alone(self):
+        self.model.release.clear()
+        futures = [self.batcher.submit(im_bytes) for im_bytes in (b'ab', b'bad', b'cd')]
+        self.model.release.set()
+        self.assertEqual(futures[0].result(5), 'ba')
+        with self.assertRaises(ValueError):
+            futures[1].result(5)
+        self.assertEqual(futures[2].result(5), 'dc')
+        self.assertEqual(self.batcher.stats['errors'], 1)
+
+    def test_lazy_model(self):
+        batcher = CaptchaBatcher(model_factory=FakeModel)
+        try:
+            self.assertEqual(batcher.predict(b'xy'), 'yx')
+            batcher.report_wrong_result('yx')
+            self.assertEqual(batcher.model.reported, ['yx'])
+        finally:
+            batcher.close()
+
+    def test_closed(self):
+        self.batcher.predict(b'a')
+        self.batcher.close()
+        with self.assertRaises(RuntimeError):
+            self.batcher.submit(b'a')
+
+
+class CaptchaServerTest(unittest.TestCase):
+
+    def serve(self, address):
+        model = FakeModel()
+        batcher = CaptchaBatcher(model, max_wait=0.02)
+        server = create_captcha_server(address, batcher)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(batcher.close)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return model, server
+
+    def check(self, model, address):
+        client = CaptchaClient(address)
+        try:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                labels = list(executor.map(client.predict, [b'abc', b'def'] * 4))
+            self.assertEqual(labels, ['cba', 'fed'] * 4)
+            client.report_wrong_result('cba')
+            self.assertEqual(model.reported, ['cba'])
+            self.assertIsNone(model.reported[0].sample_id)
+            label = client.predict(b'saved')
+            self.assertEqual((label, label.sample_id), ('devas', '42'))
+            client.report_wrong_result(label)
+            self.assertEqual((model.reported[1], model.reported[1].sample_id), ('devas', '42'))
+            with self.assertRaises(RuntimeError):
+                client.predict(b'fail')
+            self.assertEqual(client.predict(b'ok'), 'ko')
+        finally:
+            client.close()
+
+    def test_tcp(self):
+        model, server = self.serve(('127.0.0.1', 0))
+        self.check(model, server.server_address)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'Unix sockets')
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'captcha.sock')
+            model, _ = self.serve(path)
+            self.check(model, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from weibo_api.hashing import file_digests
+
+
+class HashingTest(unittest.TestCase):
+
+    def digests(self, content, chunk_bytes=None, block_size=7):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(content)
+        try:
+            return file_digests(f.name, chunk_bytes, block_size)
+        finally:
+            os.remove(f.name)
+
+    def test_file_md5(self):
+        content = os.urandom(100)
+        self.assertEqual(self.digests(content), (hashlib.md5(content).hexdigest(), None))
+
+    def test_chunk_md5s(self):
+        content = os.urandom(100)
+        for chunk_bytes in (10, 25, 33, 100, 150):
+            expected = [hashlib.md5(content[i:i + chunk_bytes]).hexdigest() for i in range(0, 100, chunk_bytes)]
+            self.assertEqual(self.digests(content, chunk_bytes), (hashlib.md5(content).hexdigest(), expected))
+
+    def test_empty_file(self):
+        empty = hashlib.md5(b'').hexdigest()
+        self.assertEqual(self.digests(b'', 10), (empty, [empty]))
+
+
+if __name__ == '__main__':
+    unittest.main()
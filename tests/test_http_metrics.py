@@ -0,0 +1,133 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.exceptions import ConnectionError
+
+from weibo_api.http_metrics import Histogram, HistogramRecorder, HttpMetrics, RequestEvent
+from weibo_api.requests_wrapper import RequestsWrapper
+from weibo_api.retry_policy import RetryPolicy
+from weibo_api.streaming import BufferReader
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status = 503 if self.path == '/unavailable' else 200
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body) + 2))
+        self.end_headers()
+        self.wfile.write(b'ok' + body)
+
+    do_GET = do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+def event(operation='op', total=0.1, attempt=1, status=200, error=None):
+    return RequestEvent(operation, 'GET', 'https://weibo.com/', attempt, status, total / 2, total, 10, 20, error)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for value in [0.004] * 90 + [1.5] * 10:
+            histogram.add(value)
+        # Upper bound of the first bucket
+        self.assertEqual(histogram.percentile(50), 0.005)
+        self.assertEqual(histogram.percentile(90), 0.005)
+        # Capped by the largest value
+        self.assertEqual(histogram.percentile(99), 1.5)
+        histogram.add(1000)
+        self.assertEqual(histogram.percentile(100), 1000)
+
+
+class HistogramRecorderTest(unittest.TestCase):
+
+    def test_summary(self):
+        recorder = HistogramRecorder()
+        recorder(event('cn.st', 0.01))
+        recorder(event('cn.st', 0.03, attempt=2, status=None, error='ConnectionError'))
+        recorder(event('upload_video.chunk', 2))
+        summary = recorder.summary()
+        self.assertEqual(summary['cn.st']['count'], 2)
+        self.assertAlmostEqual(summary['cn.st']['mean'], 0.02)
+        self.assertEqual(summary['cn.st']['statuses'], {200: 1})
+        self.assertEqual(summary['cn.st']['errors'], 1)
+        self.assertEqual(summary['cn.st']['retries'], 1)
+        self.assertEqual(summary['cn.st']['bytes_sent'], 20)
+        self.assertEqual([name for name, _ in recorder.slowest(1)], ['upload_video.chunk'])
+
+    def test_failing_listener(self):
+        received = []
+
+        def failing(e):
+            raise ValueError('broken exporter')
+
+        metrics = HttpMetrics([failing, received.append])
+        metrics.emit(event())
+        self.assertEqual(len(received), 1)
+
+
+class RequestsWrapperMetricsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.events = []
+        self.wrapper = RequestsWrapper()
+        self.wrapper.session = requests.Session()
+        self.wrapper.http_metrics = HttpMetrics([self.events.append])
+        self.wrapper.retry_policy = RetryPolicy(backoff_base=0.001)
+
+    def test_event(self):
+        self.wrapper.post(self.url + '/api/config', data=b'12345', operation='cn.st')
+        e, = self.events
+        self.assertEqual((e.operation, e.method, e.attempt, e.status, e.error), ('cn.st', 'POST', 1, 200, None))
+        self.assertEqual((e.bytes_sent, e.bytes_received), (5, 7))
+        self.assertGreater(e.total, 0)
+        self.assertLessEqual(e.ttfb, e.total)
+
+    def test_default_operation_and_form_size(self):
+        self.wrapper.post(self.url + '/api/statuses/update', data={'content': 'abc'})
+        e, = self.events
+        self.assertEqual(e.operation, f'127.0.0.1:{self.server.server_address[1]}/api/statuses/update')
+        self.assertEqual(e.bytes_sent, len('content=abc'))
+
+    def test_streamed_body_size(self):
+        self.wrapper.post(self.url + '/upload', data=BufferReader(b'x' * 1000), operation='upload_pic')
+        self.assertEqual(self.events[0].bytes_sent, 1000)
+
+    def test_retries_are_separate_events(self):
+        self.wrapper.get(self.url + '/unavailable', operation='cn.st')
+        self.assertEqual([(e.attempt, e.status) for e in self.events], [(1, 503), (2, 503), (3, 503)])
+
+    def test_error_event(self):
+        self.wrapper.retry_policy = None
+        with self.assertRaises(ConnectionError):
+            self.wrapper.get('http://127.0.0.1:1/', operation='cn.st')
+        e, = self.events
+        self.assertEqual((e.status, e.error), (None, 'ConnectionError'))
+
+    def test_disabled_without_listeners(self):
+        self.wrapper.http_metrics = HttpMetrics()
+        self.assertEqual(self.wrapper.get(self.url + '/', operation='cn.st').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
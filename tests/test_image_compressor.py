@@ -0,0 +1,71 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+from weibo_api.image_compressor import ImageCompressor
+
+
+def noise_image(width, height, image_format='PNG'):
+    pixels = np.random.RandomState(0).randint(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class ImageCompressorTest(unittest.TestCase):
+
+    def test_fits_limit_within_bounded_attempts(self):
+        source = noise_image(600, 400)
+        compressor = ImageCompressor(max_bytes=60000, max_attempts=6)
+        with patch.object(ImageCompressor, '_ImageCompressor__encode',
+                          wraps=ImageCompressor._ImageCompressor__encode) as encode:
+            data = compressor.compress(source)
+        self.assertLessEqual(len(data), 60000)
+        self.assertLessEqual(encode.call_count, 10)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertLess(image.width, 600)
+
+    def test_jpeg_draft_and_stream_source(self):
+        source = io.BytesIO(noise_image(800, 800, 'JPEG'))
+        source.seek(0)
+        data = ImageCompressor(max_bytes=50000).compress(source)
+        self.assertLessEqual(len(data), 50000)
+        self.assertEqual(source.tell(), 0)
+
+    def test_keeps_high_quality_when_possible(self):
+        source = noise_image(100, 100)
+        data = ImageCompressor(max_bytes=10 ** 7).compress(source)
+        self.assertEqual(data, ImageCompressor(max_bytes=10 ** 7, min_quality=93, max_attempts=1,
+                                               initial_quality=93).compress(source))
+
+    def test_cache(self):
+        source = noise_image(300, 300)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            compressor = ImageCompressor(max_bytes=30000, cache_dir=cache_dir)
+            data = compressor.compress(source)
+            self.assertIs(compressor.compress(source), data)
+            self.assertEqual(compressor.stats, {'hits': 1, 'misses': 1})
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            other = ImageCompressor(max_bytes=30000, cache_dir=cache_dir)
+            with patch.object(ImageCompressor, '_ImageCompressor__search') as search:
+                self.assertEqual(other.compress(source), data)
+            search.assert_not_called()
+
+    def test_cache_is_size_bounded(self):
+        compressor = ImageCompressor(max_bytes=30000, cache_bytes=30000)
+        first = noise_image(300, 300)
+        compressor.compress(first)
+        compressor.compress(noise_image(301, 301))
+        compressor.compress(first)
+        self.assertEqual(compressor.stats, {'hits': 0, 'misses': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+from weibo_api.weibo_login import WeiboLoginApi
+
+
+class LazyImportTest(unittest.TestCase):
+
+    def test_import_does_not_load_heavy_dependencies(self):
+        code = ('import sys\n'
+                'import weibo_api\n'
+                'from weibo_api.weibo_login import WeiboLoginApi\n'
+                "WeiboLoginApi(login_user='user', login_password='password')\n"
+                "print(','.join(m for m in ('mxnet', 'PIL', 'numpy') if m in sys.modules))\n")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '')
+
+    @patch('weibo_api.weibo_login.weibo_login.WeiboComCaptcha')
+    def test_captcha_loaded_on_first_use(self, captcha):
+        login = WeiboLoginApi(login_user='user', login_password='password', save_captcha=True)
+        captcha.assert_not_called()
+        self.assertIs(login.captcha_cracker, captcha.return_value)
+        self.assertIs(login.captcha_cracker, captcha.return_value)
+        captcha.assert_called_once_with(save_captcha=True)
+
+    def test_captcha_cracker_kwarg(self):
+        cracker = object()
+        login = WeiboLoginApi(login_user='user', login_password='password', captcha_cracker=cracker)
+        self.assertIs(login.captcha_cracker, cracker)
+
+
+if __name__ == '__main__':
+    unittest.main()
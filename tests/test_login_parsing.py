@@ -0,0 +1,41 @@
+import unittest
+
+from weibo_api.exceptions import LoginException
+from weibo_api.weibo_login import login_parsing
+
+PRELOGIN = (b'sinaSSOController.preloginCallBack({"retcode":0,"servertime":1,"pcid":"pcid","nonce":"1",'
+            b'"pubkey":"EB2A38568661887FA180BDDB5CABD5F21C7BFD59C090CB2D245A87AC2530628","rsakv":"1","showpin":0})')
+CROSS_DOMAIN = (b'<html><script>setCrossDomainUrlList({"retcode":0,"arrURL":["https://a.example/sso?t=1",'
+                b'"https://b.example/sso?t=2"]});\nlocation.replace(\'https://weibo.com/login?t=3\');</script></html>')
+
+
+class LoginParsingTest(unittest.TestCase):
+
+    def test_prelogin_data(self):
+        data = login_parsing.prelogin_data(PRELOGIN)
+        self.assertEqual(data['rsakv'], '1')
+        self.assertEqual(data['showpin'], 0)
+
+    def test_cross_domain(self):
+        self.assertEqual(login_parsing.cross_domain_urls(CROSS_DOMAIN),
+                         ['https://a.example/sso?t=1', 'https://b.example/sso?t=2'])
+        self.assertEqual(login_parsing.location_replace(CROSS_DOMAIN, quote="'"), 'https://weibo.com/login?t=3')
+
+    def test_location_replace(self):
+        page = b'<script>location.replace("https://login.sina.com.cn/crossdomain2.php?a=1&b=2");</script>'
+        self.assertEqual(login_parsing.location_replace(page), 'https://login.sina.com.cn/crossdomain2.php?a=1&b=2')
+
+    def test_verification_pages(self):
+        self.assertEqual(login_parsing.encrypted_mobile(b'<input value="abc=" class="W_radio">'), 'abc=')
+        page = 'phoneList: JSON.parse(\'[{"number":"1","maskMobile":"138****0000"}]\'),'.encode('utf-8')
+        self.assertEqual(login_parsing.phone_list(page), [{'number': '1', 'maskMobile': '138****0000'}])
+
+    def test_missing(self):
+        with self.assertRaises(LoginException):
+            login_parsing.prelogin_data(b'<html>busy</html>')
+        with self.assertRaises(LoginException):
+            login_parsing.location_replace(CROSS_DOMAIN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,291 @@
+import ast
+import json
+import os
+import struct
+import tempfile
+import unittest
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from weibo_api.simple_captcha.numpy_backend import NumpyCaptchaNet, conv2d, convert, max_pool2d, read_mxnet_params
+from weibo_api.simple_captcha.weibo_com_captcha import WeiboComCaptcha
+
+SYMBOL_PATH = os.path.join(WeiboComCaptcha.CURRENT_DIR, 'model/0.9269662921348315.net.all-symbol.json')
+PARAMS_PATH = os.path.join(WeiboComCaptcha.CURRENT_DIR, 'model/0.9269662921348315.net.all-0001.params')
+
+
+def mxnet_available():
+    try:
+        import mxnet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def naive_conv2d(x, weight, bias, stride, pad):
+    x = np.pad(x, ((0, 0), (0, 0), (pad[0], pad[0]), (pad[1], pad[1])), mode='constant')
+    n, _, h, w = x.shape
+    out_channels, _, kh, kw = weight.shape
+    out = np.zeros((n, out_channels, (h - kh) // stride[0] + 1, (w - kw) // stride[1] + 1), dtype=np.float64)
+    for i in range(out.shape[2]):
+        for j in range(out.shape[3]):
+            window = x[:, :, i * stride[0]:i * stride[0] + kh, j * stride[1]:j * stride[1] + kw]
+            out[:, :, i, j] = np.einsum('nchw,ochw->no', window, weight)
+    return out if bias is None else out + bias[:, None, None]
+
+
+def naive_max_pool2d(x, kernel, stride, pad):
+    x = np.pad(x, ((0, 0), (0, 0), (pad[0], pad[0]), (pad[1], pad[1])), mode='constant', constant_values=-np.inf)
+    n, c, h, w = x.shape
+    out = np.zeros((n, c, (h - kernel[0]) // stride[0] + 1, (w - kernel[1]) // stride[1] + 1), dtype=x.dtype)
+    for i in range(out.shape[2]):
+        for j in range(out.shape[3]):
+            out[:, :, i, j] = x[:, :, i * stride[0]:i * stride[0] + kernel[0],
+                                j * stride[1]:j * stride[1] + kernel[1]].max(axis=(2, 3))
+    return out
+
+
+def random_params(symbol, rng):
+    # Input sizes left to shape inference in the symbol (0): 64 channels, 3840 flattened features, 256 hidden units
+    inferred = {'hybridsequential1_conv': 64, 'hybridsequential2_dense0': 3840, 'concatlayer0_dense': 256}
+    params = {}
+    for node in symbol['nodes']:
+        if node['op'] == 'null' and node['name'] != 'data':
+            shape = list(ast.literal_eval(node['attrs']['__shape__']))
+            if len(shape) > 1 and shape[1] == 0:
+                shape[1] = next(size for key, size in inferred.items() if key in node['name'])
+            params[node['name']] = rng.standard_normal(shape).astype(np.float32) * 0.1
+            if node['name'].endswith('_var'):
+                params[node['name']] = np.abs(params[node['name']]) + 0.5
+    return params
+
+
+def write_mxnet_params(path, arrays):
+    """Write arrays in the mxnet NDArray list format, as nd.save does."""
+    type_flags = {np.dtype(np.float32): 0, np.dtype(np.float64): 1, np.dtype(np.int32): 4}
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<QQQ', 0x112, 0, len(arrays)))
+        for array in arrays.values():
+            f.write(struct.pack('<Iii', 0xF993FAC9, 0, array.ndim))
+            f.write(struct.pack(f'<{array.ndim}q', *array.shape))
+            f.write(struct.pack('<iii', 1, 0, type_flags[array.dtype]))
+            f.write(array.tobytes())
+        f.write(struct.pack('<Q', len(arrays)))
+        for name in arrays:
+            f.write(struct.pack('<Q', len(name)) + name.encode('utf-8'))
+
+
+class NumpyOpsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def test_conv2d_matches_naive(self):
+        x = self.rng.standard_normal((2, 3, 11, 14)).astype(np.float32)
+        weight = self.rng.standard_normal((4, 3, 3, 3)).astype(np.float32)
+        bias = self.rng.standard_normal(4).astype(np.float32)
+        for stride, pad in (((1, 1), (1, 1)), ((2, 2), (3, 3)), ((2, 1), (0, 0))):
+            np.testing.assert_allclose(conv2d(x, weight, bias, stride, pad), naive_conv2d(x, weight, bias, stride, pad),
+                                       rtol=1e-4, atol=1e-4)
+        self.assertEqual(conv2d(x, weight, None, (1, 1), (1, 1)).dtype, np.float32)
+
+    def test_max_pool2d_matches_naive(self):
+        x = self.rng.standard_normal((2, 3, 10, 25)).astype(np.float32)
+        for kernel, stride, pad in (((3, 3), (2, 2), (1, 1)), ((2, 2), (2, 2), (0, 0))):
+            np.testing.assert_array_equal(max_pool2d(x, kernel, stride, pad), naive_max_pool2d(x, kernel, stride, pad))
+
+    def test_batch_norm_folded_into_conv(self):
+        symbol = {'nodes': [{'op': 'null', 'name': 'data', 'inputs': []},
+                            {'op': 'null', 'name': 'w', 'inputs': []},
+                            {'op': 'Convolution', 'name': 'conv', 'attrs': {'kernel': '(3, 3)', 'no_bias': 'True',
+                                                                            'num_filter': '2', 'pad': '(1, 1)'},
+                             'inputs': [[0, 0, 0], [1, 0, 0]]},
+                            {'op': 'null', 'name': 'gamma', 'inputs': []},
+                            {'op': 'null', 'name': 'beta', 'inputs': []},
+                            {'op': 'null', 'name': 'mean', 'inputs': []},
+                            {'op': 'null', 'name': 'var', 'inputs': []},
+                            {'op': 'BatchNorm', 'name': 'bn', 'attrs': {'eps': '1e-05', 'fix_gamma': 'False'},
+                             'inputs': [[2, 0, 0], [3, 0, 0], [4, 0, 0], [5, 0, 1], [6, 0, 1]]},
+                            {'op': 'Activation', 'name': 'relu', 'attrs': {'act_type': 'relu'},
+                             'inputs': [[7, 0, 0]]}],
+                  'heads': [[8, 0, 0]]}
+        params = {'w': self.rng.standard_normal((2, 1, 3, 3)), 'gamma': np.array([0.5, 2.0]),
+                  'beta': np.array([0.1, -0.2]), 'mean': np.array([0.3, -1.0]), 'var': np.array([2.0, 0.5])}
+        x = self.rng.standard_normal((3, 1, 5, 6)).astype(np.float32)
+
+        conv = naive_conv2d(x, params['w'], None, (1, 1), (1, 1))
+        expected = (conv - params['mean'][:, None, None]) / np.sqrt(params['var'][:, None, None] + 1e-5)
+        expected = np.maximum(expected * params['gamma'][:, None, None] + params['beta'][:, None, None], 0)
+        np.testing.assert_allclose(NumpyCaptchaNet(symbol, params)(x), expected, rtol=1e-4, atol=1e-5)
+
+
+class NumpyCaptchaNetTest(unittest.TestCase):
+
+    def test_captcha_graph(self):
+        with open(SYMBOL_PATH) as f:
+            symbol = json.load(f)
+        net = NumpyCaptchaNet(symbol, random_params(symbol, np.random.RandomState(0)))
+        out = net(np.random.RandomState(1).standard_normal((3, 1, 40, 100)).astype(np.float32))
+        self.assertEqual(out.shape, (3, 5, 36))
+        self.assertEqual(out.dtype, np.float32)
+
+    def test_convert_and_load(self):
+        with open(SYMBOL_PATH) as f:
+            symbol = json.load(f)
+        params = random_params(symbol, np.random.RandomState(0))
+        prefixed = {('aux:' if name.endswith(('_mean', '_var')) else 'arg:') + name: array
+                    for name, array in params.items()}
+        data = np.random.RandomState(1).standard_normal((2, 1, 40, 100)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as directory:
+            params_path = os.path.join(directory, 'net-0001.params')
+            npz_path = os.path.join(directory, 'net.npz')
+            write_mxnet_params(params_path, prefixed)
+            convert(params_path, npz_path)
+            net = NumpyCaptchaNet.load(SYMBOL_PATH, npz_path)
+            np.testing.assert_allclose(net(data), NumpyCaptchaNet(symbol, params)(data), rtol=1e-6)
+
+    def test_read_mxnet_params(self):
+        arrays = {'arg:w': np.arange(6, dtype=np.float32).reshape(2, 3), 'aux:b': np.array([1.5, 2.5]),
+                  'arg:i': np.array([[7]], dtype=np.int32)}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'net-0001.params')
+            write_mxnet_params(path, arrays)
+            params = read_mxnet_params(path)
+        self.assertEqual(sorted(params), ['b', 'i', 'w'])
+        for name, array in arrays.items():
+            np.testing.assert_array_equal(params[name[4:]], array)
+            self.assertEqual(params[name[4:]].dtype, array.dtype)
+
+    def test_not_a_params_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bad.params')
+            with open(path, 'wb') as f:
+                f.write(b'\x00' * 24)
+            with self.assertRaises(ValueError):
+                read_mxnet_params(path)
+
+
+class WeiboComCaptchaNumpyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(SYMBOL_PATH) as f:
+            symbol = json.load(f)
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.npz_path = os.path.join(directory.name, 'net.npz')
+        np.savez(cls.npz_path, **random_params(symbol, np.random.RandomState(0)))
+        cls.captcha = WeiboComCaptcha(model_npz_path=cls.npz_path)
+
+    @staticmethod
+    def png(pixels, mode='L'):
+        buffer = BytesIO()
+        Image.fromarray(pixels, mode).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_predict_batch(self):
+        ims_bytes = [self.png(np.random.RandomState(seed).randint(0, 256, (40, 100), dtype=np.uint8))
+                     for seed in range(3)]
+        self.assertEqual(self.captcha.backend, 'numpy')
+        labels = self.captcha.predict_batch(ims_bytes)
+        self.assertEqual(len(labels), 3)
+        self.assertTrue(all(len(label) == 5 and set(label) <= set(self.captcha.index2ch.values())
+                            for label in labels))
+        self.assertEqual(self.captcha.predict(ims_bytes[1]), labels[1])
+
+    def test_undecodable_image(self):
+        good = self.png(np.zeros((40, 100), dtype=np.uint8))
+        truncated = good[:len(good) // 2]
+        with self.assertRaises(Exception):
+            self.captcha.predict_batch([good, truncated])
+        labels = self.captcha.predict_batch([b'not an image', good, truncated], return_exceptions=True)
+        self.assertIsInstance(labels[0], Exception)
+        self.assertEqual(labels[1], self.captcha.predict(good))
+        self.assertIsInstance(labels[2], Exception)
+        self.assertIsInstance(self.captcha.predict_batch([b'bad'], return_exceptions=True)[0], Exception)
+
+    def test_predict_batch_reuses_buffer(self):
+        ims_bytes = [self.png(np.random.RandomState(seed).randint(0, 256, (40, 100), dtype=np.uint8))
+                     for seed in range(4)]
+        captcha = WeiboComCaptcha(model_npz_path=self.npz_path)
+        inputs = []
+        net = captcha.net
+        captcha.net = lambda data: inputs.append(data) or net(data)
+
+        labels = captcha.predict_batch(ims_bytes)
+        self.assertEqual(captcha.predict_batch(ims_bytes[:2]), labels[:2])
+        self.assertEqual(captcha.predict_batch(ims_bytes), labels)
+        self.assertTrue(all(np.shares_memory(inputs[0], data) for data in inputs[1:]))
+
+    def test_save_captcha(self):
+        im_bytes = self.png(np.zeros((40, 100), dtype=np.uint8))
+        with tempfile.TemporaryDirectory() as directory:
+            captcha = WeiboComCaptcha(model_npz_path=self.npz_path, data_path=directory, save_captcha=True)
+            label = captcha.predict(im_bytes)
+            captcha.report_wrong_result(label)
+            captcha.sample_store.close()
+            path = os.path.join(directory, label.sample_id[:2], f'wrong_{label}_{label.sample_id}.png')
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), im_bytes)
+
+    def test_preprocess_matches_reference_normalization(self):
+        pixels = [np.random.RandomState(seed).randint(0, 256, (40, 100), dtype=np.uint8) for seed in range(3)]
+        ims = [Image.fromarray(p, 'L') for p in pixels]
+        data = self.captcha.preprocess(ims)
+
+        self.assertEqual(data.shape, (3, 1, 40, 100))
+        self.assertEqual(data.dtype, np.float32)
+        reference = (np.stack(pixels)[:, None].astype(np.float32) / 255. - 0.942532484060557) / 0.15926149044640417
+        np.testing.assert_allclose(data, reference, rtol=1e-6, atol=1e-6)
+
+    def test_preprocess_into_buffer(self):
+        buffer = np.zeros((4, 1, 40, 100), dtype=np.float32)
+        ims = [Image.fromarray(np.full((40, 100), 255, dtype=np.uint8), 'L'),
+               Image.fromarray(np.full((20, 50), 0, dtype=np.uint8), 'L'),
+               Image.fromarray(np.full((40, 100), 128, dtype=np.int32), 'I')]
+        data = self.captcha.preprocess(ims, out=buffer)
+
+        self.assertTrue(np.shares_memory(data, buffer))
+        self.assertEqual(data.shape, (3, 1, 40, 100))
+        np.testing.assert_allclose(data[:, 0, 0, 0], (np.array([255., 0., 128.]) / 255 - 0.942532484060557)
+                                   / 0.15926149044640417, rtol=1e-6)
+        self.assertTrue((buffer[3] == 0).all())
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            WeiboComCaptcha(backend='tensorflow')
+
+
+@unittest.skipUnless(mxnet_available() and os.path.exists(PARAMS_PATH), 'needs mxnet and the trained model weights')
+class MxnetParityTest(unittest.TestCase):
+    """The NumPy backend predicts the same labels as mxnet, with the trained weights."""
+
+    def test_same_labels(self):
+        with tempfile.TemporaryDirectory() as directory:
+            npz_path = os.path.join(directory, 'net.npz')
+            convert(PARAMS_PATH, npz_path)
+            numpy_captcha = WeiboComCaptcha(model_npz_path=npz_path, backend='numpy')
+            mxnet_captcha = WeiboComCaptcha(backend='mxnet')
+        ims_bytes = [WeiboComCaptchaNumpyTest.png(np.random.RandomState(seed).randint(0, 256, (40, 100),
+                                                                                         dtype=np.uint8))
+                     for seed in range(16)]
+        ims_bytes.append(WeiboComCaptchaNumpyTest.png(np.full((40, 100), 255, dtype=np.uint8)))
+
+        self.assertEqual(numpy_captcha.predict_batch(ims_bytes), mxnet_captcha.predict_batch(ims_bytes))
+        data = numpy_captcha.preprocess([Image.open(BytesIO(im_bytes)) for im_bytes in ims_bytes])
+        np.testing.assert_allclose(numpy_captcha.net(data), mxnet_captcha.net(data), rtol=1e-4, atol=1e-4)
+
+
+class MissingMxnetTest(unittest.TestCase):
+
+    @unittest.skipIf(mxnet_available(), 'mxnet is installed')
+    def test_clear_error(self):
+        with self.assertRaises(ImportError) as context:
+            WeiboComCaptcha(model_npz_path='missing.npz')
+        self.assertIn('weibo_api[mxnet]', str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
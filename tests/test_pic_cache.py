@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from weibo_api.pic_cache import FileCacheBackend, MemoryCacheBackend, PicIdCache, SqliteCacheBackend
+
+
+class PicIdCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.now = 1000
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def backends(self):
+        yield MemoryCacheBackend()
+        yield FileCacheBackend(os.path.join(self.tmp_dir.name, 'pic_cache.json'))
+        yield SqliteCacheBackend(os.path.join(self.tmp_dir.name, 'pic_cache.db'))
+
+    def cache(self, backend, **kwargs):
+        return PicIdCache(backend, clock=lambda: self.now, **kwargs)
+
+    def test_key(self):
+        for backend in self.backends():
+            cache = self.cache(backend)
+            cache.put('hash', 'weibo.cn', 'account', 'pic_id')
+            self.assertEqual(cache.get('hash', 'weibo.cn', 'account'), 'pic_id')
+            self.assertIsNone(cache.get('hash', 'weibo.com', 'account'))
+            self.assertIsNone(cache.get('hash', 'weibo.cn', 'another account'))
+            self.assertEqual(cache.stats, {'hits': 1, 'misses': 2})
+
+    def test_ttl(self):
+        for backend in self.backends():
+            cache = self.cache(backend, ttl=10)
+            cache.put('hash', 'weibo.cn', None, 'pic_id')
+            self.now += 9
+            self.assertEqual(cache.get('hash', 'weibo.cn', None), 'pic_id')
+            self.now += 1
+            self.assertIsNone(cache.get('hash', 'weibo.cn', None))
+            self.now -= 10
+
+    def test_lru_eviction(self):
+        for backend in self.backends():
+            cache = self.cache(backend, max_entries=2)
+            cache.put('first', 'weibo.cn', None, '1')
+            self.now += 1
+            cache.put('second', 'weibo.cn', None, '2')
+            self.now += 1
+            cache.get('first', 'weibo.cn', None)
+            self.now += 1
+            cache.put('third', 'weibo.cn', None, '3')
+            self.assertEqual(len(backend), 2)
+            self.assertIsNone(cache.get('second', 'weibo.cn', None))
+            self.assertEqual(cache.get('first', 'weibo.cn', None), '1')
+
+    def test_persistent_backends(self):
+        for backend_type, name in ((FileCacheBackend, 'pic_cache.json'), (SqliteCacheBackend, 'pic_cache.db')):
+            path = os.path.join(self.tmp_dir.name, name)
+            self.cache(backend_type(path)).put('hash', 'weibo.com', None, 'pid')
+            self.assertEqual(self.cache(backend_type(path)).get('hash', 'weibo.com', None), 'pid')
+
+
+if __name__ == '__main__':
+    unittest.main()
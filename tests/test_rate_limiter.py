@@ -0,0 +1,43 @@
+import unittest
+
+from weibo_api.rate_limiter import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.bucket = TokenBucket(rate=2, capacity=3, clock=lambda: self.now)
+
+    def test_burst_then_rate(self):
+        self.assertEqual([self.bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+        self.assertAlmostEqual(self.bucket.delay(), 0.5)
+        self.now = 0.5
+        self.assertTrue(self.bucket.try_acquire())
+        self.assertFalse(self.bucket.try_acquire())
+
+    def test_capacity(self):
+        self.now = 100
+        self.assertEqual(sum(self.bucket.try_acquire() for _ in range(10)), 3)
+
+    def test_rate_change_keeps_accrued_tokens(self):
+        for _ in range(3):
+            self.bucket.try_acquire()
+        self.now = 0.25
+        self.bucket.rate = 1
+        self.assertAlmostEqual(self.bucket.delay(), 0.5)
+
+    def test_acquire_sleeps(self):
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            self.now += seconds
+
+        for _ in range(4):
+            self.bucket.acquire(sleep)
+        self.assertEqual(sleeps, [0.5])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
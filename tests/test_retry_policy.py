@@ -0,0 +1,196 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import requests
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+
+from weibo_api.exceptions import CircuitOpenError
+from weibo_api.requests_wrapper import RequestsWrapper
+from weibo_api.retry_policy import CircuitBreaker, RetryPolicy
+
+
+def response(status_code):
+    rsp = MagicMock()
+    rsp.status_code = status_code
+    return rsp
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 to the first `failures` requests, then 200."""
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+    requests = 0
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        FlakyHandler.requests += 1
+        status = 503 if FlakyHandler.requests <= FlakyHandler.failures else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    do_GET = do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.sleeps = []
+        self.policy = RetryPolicy(max_attempts=3, budget=10, failure_threshold=5, clock=lambda: self.now,
+                                  sleep=self.sleep)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def test_retries_idempotent_call(self):
+        send = MagicMock(side_effect=[ConnectionError('reset'), response(503), response(200)])
+        rsp = self.policy.call(send, 'GET', 'https://m.weibo.cn/api/config')
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(len(self.sleeps), 2)
+        # Full jitter below the exponential bound
+        self.assertLessEqual(self.sleeps[0], 0.5)
+        self.assertLessEqual(self.sleeps[1], 1)
+        stats = self.policy.stats
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['endpoints'], {'m.weibo.cn/api/config': 2})
+        self.assertAlmostEqual(stats['retry_seconds'], sum(self.sleeps))
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff_base=1, backoff_max=4)
+        for attempt, bound in ((1, 1), (2, 2), (3, 4), (10, 4)):
+            self.assertTrue(all(0 <= policy.backoff(attempt) <= bound for _ in range(100)))
+
+    def test_post_not_retried_unless_idempotent(self):
+        send = MagicMock(side_effect=ConnectionError('reset'))
+        with self.assertRaises(ConnectionError):
+            self.policy.call(send, 'POST', 'https://m.weibo.cn/api/statuses/update')
+        self.assertEqual(send.call_count, 1)
+
+        send = MagicMock(side_effect=[ConnectionError('reset'), response(200)])
+        self.policy.call(send, 'POST', 'https://fileplatform.api.weibo.com/2/multimedia/upload.json',
+                         idempotent=True)
+        self.assertEqual(send.call_count, 2)
+
+    def test_streamed_body_not_retried(self):
+        send = MagicMock(return_value=response(502))
+        rsp = self.policy.call(send, 'POST', 'https://picupload.weibo.com/', idempotent=True, replayable=False)
+        self.assertEqual(rsp.status_code, 502)
+        self.assertEqual(send.call_count, 1)
+
+    def test_last_response_returned(self):
+        send = MagicMock(return_value=response(500))
+        self.assertEqual(self.policy.call(send, 'GET', 'https://weibo.com/').status_code, 500)
+        self.assertEqual(send.call_count, 3)
+
+    def test_endpoint_budget(self):
+        policy = RetryPolicy(max_attempts=5, budget=10, endpoint_budgets={'weibo.com/': 2}, clock=lambda: self.now,
+                             sleep=self.sleep)
+        send = MagicMock(return_value=response(503))
+        policy.call(send, 'GET', 'https://weibo.com/')
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(policy.stats['budget_exhausted'], 1)
+        self.assertEqual(policy.stats['retries'], 2)
+
+    def test_circuit_breaker_opens_per_host(self):
+        send = MagicMock(side_effect=ConnectionError('reset'))
+        with self.assertRaises(ConnectionError):
+            self.policy.call(send, 'GET', 'https://weibo.com/')
+        # The fifth consecutive failure opens the circuit, so the third attempt is not sent.
+        with self.assertRaises(CircuitOpenError):
+            self.policy.call(send, 'GET', 'https://weibo.com/')
+        self.assertEqual(send.call_count, 5)
+        with self.assertRaises(CircuitOpenError):
+            self.policy.call(send, 'GET', 'https://weibo.com/')
+        self.assertEqual(send.call_count, 5)
+        self.assertEqual(self.policy.stats['circuits']['weibo.com'], 'open')
+        self.assertEqual(self.policy.stats['circuit_open'], 2)
+
+        # Other hosts are not affected
+        self.policy.call(MagicMock(return_value=response(200)), 'GET', 'https://m.weibo.cn/')
+
+    def test_circuit_breaker_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: self.now)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.now = 30
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow())
+        # Only one trial call at a time
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.now = 60
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow())
+
+    def test_trial_released_on_other_errors(self):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=1, reset_timeout=30, clock=lambda: self.now,
+                             sleep=self.sleep)
+        with self.assertRaises(ConnectionError):
+            policy.call(MagicMock(side_effect=ConnectionError('reset')), 'GET', 'https://weibo.com/')
+        self.now = 30
+        with self.assertRaises(ChunkedEncodingError):
+            policy.call(MagicMock(side_effect=ChunkedEncodingError('truncated')), 'GET', 'https://weibo.com/')
+        # The failed trial reopened the circuit instead of leaving it stuck
+        self.assertEqual(policy.stats['circuits']['weibo.com'], 'open')
+        self.now = 60
+        self.assertEqual(policy.call(MagicMock(return_value=response(200)), 'GET', 'https://weibo.com/').status_code,
+                         200)
+        self.assertEqual(policy.stats['circuits']['weibo.com'], 'closed')
+
+
+class RequestsWrapperRetryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/upload.json'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FlakyHandler.failures = 1
+        FlakyHandler.requests = 0
+        self.wrapper = RequestsWrapper()
+        self.wrapper.session = requests.Session()
+        self.wrapper.retry_policy = RetryPolicy(backoff_base=0.001)
+
+    def test_get_retried(self):
+        self.assertEqual(self.wrapper.get(self.url).status_code, 200)
+        self.assertEqual(FlakyHandler.requests, 2)
+
+    def test_idempotent_post_retried(self):
+        self.assertEqual(self.wrapper.post(self.url, data=b'chunk', idempotent=True).status_code, 200)
+        self.assertEqual(FlakyHandler.requests, 2)
+
+    def test_post_not_retried(self):
+        self.assertEqual(self.wrapper.post(self.url, data=b'chunk').status_code, 503)
+        self.assertEqual(FlakyHandler.requests, 1)
+
+    def test_stream_not_retried(self):
+        self.assertEqual(self.wrapper.post(self.url, data=iter([b'chunk']), idempotent=True).status_code, 503)
+        self.assertEqual(FlakyHandler.requests, 1)
+
+    def test_retries_disabled(self):
+        self.wrapper.retry_policy = None
+        self.assertEqual(self.wrapper.get(self.url).status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
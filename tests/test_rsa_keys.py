@@ -0,0 +1,43 @@
+import unittest
+
+import rsa
+
+from weibo_api.weibo_login.rsa_keys import RsaKeyCache, _cryptography_available
+
+
+class RsaKeyCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.public_key, cls.private_key = rsa.newkeys(512)
+        cls.pubkey = format(cls.public_key.n, 'x')
+
+    def check_backend(self, backend):
+        cache = RsaKeyCache(backend=backend)
+        for _ in range(3):
+            encrypted = cache.encrypt('kv1', self.pubkey, b'1\t2\npassword')
+            self.assertEqual(rsa.decrypt(encrypted, self.private_key), b'1\t2\npassword')
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_rsa(self):
+        self.check_backend('rsa')
+
+    @unittest.skipUnless(_cryptography_available(), 'cryptography is not installed')
+    def test_cryptography(self):
+        self.check_backend('cryptography')
+
+    def test_rotated_key(self):
+        cache = RsaKeyCache(backend='rsa')
+        other_public_key, other_private_key = rsa.newkeys(512)
+        cache.encrypt('kv1', self.pubkey, b'secret')
+        encrypted = cache.encrypt('kv1', format(other_public_key.n, 'x'), b'secret')
+        self.assertEqual(rsa.decrypt(encrypted, other_private_key), b'secret')
+        self.assertEqual(cache.misses, 2)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            RsaKeyCache(backend='openssl')
+
+
+if __name__ == '__main__':
+    unittest.main()
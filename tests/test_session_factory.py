@@ -0,0 +1,58 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from weibo_api.session_factory import SessionFactory, PoolStatsAdapter
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.send_header('Set-Cookie', f'path={self.path.strip("/")}')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionFactoryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_host_pool_sizes(self):
+        session = SessionFactory(pool_maxsize=3, host_pool_sizes={'m.weibo.cn': 7}).create()
+        self.assertEqual(session.get_adapter('https://m.weibo.cn/api/config')._pool_maxsize, 7)
+        self.assertEqual(session.get_adapter('https://m.weibo.cn.example.com/')._pool_maxsize, 3)
+        self.assertEqual(session.get_adapter('https://picupload.weibo.com/')._pool_maxsize, 10)
+        self.assertIsInstance(session.get_adapter('http://weibo.com/'), PoolStatsAdapter)
+
+    def test_sessions_are_isolated(self):
+        factory = SessionFactory()
+        first, second = factory.create(), factory.create()
+        first.get(self.url + '/first')
+        self.assertEqual(first.cookies.get('path'), 'first')
+        self.assertIsNone(second.cookies.get('path'))
+
+    def test_connection_reuse_stats(self):
+        session = SessionFactory().create()
+        for _ in range(3):
+            session.get(self.url + '/')
+        stats = SessionFactory.stats(session)
+        self.assertEqual(stats, {'http://': {'requests': 3, 'connections': 1, 'reused': 2}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import threading
+import time
+import unittest
+
+from weibo_api.exceptions import LoginException
+from weibo_api.session_pool import SessionPool
+
+
+class FakeClient(object):
+
+    def __init__(self, account, logged_in):
+        self.account = account
+        self.logged_in = logged_in
+        self.checks = 0
+
+    def is_login(self):
+        self.checks += 1
+        if isinstance(self.logged_in, Exception):
+            raise self.logged_in
+        return self.logged_in
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logged_in = {'a': True, 'b': True, 'c': False}
+        self.loaded = []
+        self.clock = FakeClock()
+
+    def factory(self, account, session_file):
+        self.loaded.append(account)
+        if session_file == 'missing':
+            raise ValueError('session is None.')
+        return FakeClient(account, self.logged_in[account])
+
+    def pool(self, accounts=('a', 'b', 'c'), **kwargs):
+        kwargs.setdefault('clock', self.clock)
+        pool = SessionPool({account: f'{account}.json' for account in accounts}, client_factory=self.factory,
+                           max_age=100, refresh_after=50, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_lazy_loading(self):
+        pool = self.pool()
+        self.assertEqual(self.loaded, [])
+        self.assertEqual(pool.states, {'a': 'unloaded', 'b': 'unloaded', 'c': 'unloaded'})
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+        self.assertEqual(pool.warm_up(['a']), ['a'])
+        self.assertEqual(self.loaded, ['a'])
+
+    def test_warm_up_and_acquire(self):
+        stale = []
+        pool = self.pool(on_stale=stale.append)
+        self.assertEqual(pool.warm_up(), ['a', 'b'])
+        self.assertEqual(pool.states, {'a': 'warm', 'b': 'warm', 'c': 'stale'})
+        # Least recently acquired first
+        self.assertEqual([pool.acquire().account for _ in range(4)], ['a', 'b', 'a', 'b'])
+        self.assertEqual(pool.acquire('b').account, 'b')
+        with self.assertRaises(LoginException):
+            pool.acquire('c')
+        for _ in range(100):
+            if stale:
+                break
+            time.sleep(0.01)
+        self.assertEqual(stale, ['c'])
+        stats = pool.stats
+        self.assertEqual((stats['warm'], stats['stale'], stats['acquired'], stats['checks']), (2, 1, 5, 3))
+
+    def test_sessions_expire(self):
+        pool = self.pool(accounts=('a',))
+        client = pool.acquire('a', timeout=1)
+        self.assertEqual(client.checks, 1)
+        self.clock.now = 60
+        # Aging, but still warm; warm_up only renews expired sessions
+        self.assertEqual(pool.warm_up(), ['a'])
+        self.assertEqual(client.checks, 1)
+        self.clock.now = 100
+        self.assertEqual(pool.states, {'a': 'expired'})
+        with self.assertRaises(RuntimeError):
+            pool.acquire('a')
+        self.assertEqual(pool.warm_up(), ['a'])
+        self.assertEqual(client.checks, 2)
+
+    def test_failed_checks_back_off(self):
+        self.logged_in['a'] = ConnectionError('down')
+        pool = self.pool(accounts=('a',), backoff_base=10)
+        self.assertEqual(pool.warm_up(), [])
+        self.assertEqual(pool.states, {'a': 'error'})
+        self.assertEqual(pool.warm_up(), [])
+        self.assertEqual(pool.stats['checks'], 1)
+        self.clock.now = 10
+        self.assertEqual(pool.warm_up(), [])
+        self.assertEqual(pool.stats['check_failures'], 2)
+
+    def test_missing_session_file_is_stale(self):
+        pool = SessionPool({'a': 'missing'}, client_factory=self.factory)
+        self.addCleanup(pool.close)
+        self.assertEqual(pool.warm_up(), [])
+        self.assertEqual(pool.states, {'a': 'stale'})
+
+    def test_mark_stale_and_reload(self):
+        pool = self.pool(accounts=('a',))
+        pool.warm_up()
+        pool.mark_stale('a', LoginException('Login required.'))
+        with self.assertRaises(LoginException):
+            pool.acquire('a', timeout=1)
+        pool.reload('a')
+        self.assertEqual(pool.states, {'a': 'unloaded'})
+        self.assertEqual(pool.acquire('a', timeout=1).account, 'a')
+        self.assertEqual(self.loaded, ['a', 'a'])
+
+    def test_background_checks(self):
+        self.clock = time.monotonic
+        with self.pool(check_interval=0.01) as pool:
+            client = pool.acquire(timeout=5)
+            self.assertIn(client.account, ('a', 'b'))
+            for _ in range(100):
+                if pool.states == {'a': 'warm', 'b': 'warm', 'c': 'stale'}:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(pool.states, {'a': 'warm', 'b': 'warm', 'c': 'stale'})
+
+    def test_check_concurrency(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def health_check(client):
+            with lock:
+                running.append(client)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(client)
+            return True
+
+        self.logged_in.update({name: True for name in 'defgh'})
+        pool = self.pool(accounts='abdefgh', health_check=health_check, check_concurrency=2)
+        self.assertEqual(len(pool.warm_up()), 7)
+        self.assertEqual(max(peak), 2)
+
+    def test_closed(self):
+        pool = self.pool()
+        pool.close()
+        with self.assertRaises(RuntimeError):
+            pool.start()
+        with self.assertRaises(RuntimeError):
+            pool.warm_up()
+
+
+if __name__ == '__main__':
+    unittest.main()
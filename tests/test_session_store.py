@@ -0,0 +1,103 @@
+import json
+import os
+import pickle
+import stat
+import tempfile
+import unittest
+
+import requests
+
+from weibo_api import WeiboCnApi
+from weibo_api.session_store import SessionStore
+from weibo_api.weibo_login import WeiboLoginApi
+
+
+def requests_session():
+    session = requests.Session()
+    session.cookies.set('SUB', 'cn-sub', domain='.weibo.cn', path='/', secure=True, rest={'HttpOnly': None})
+    session.cookies.set('SUB', 'com-sub', domain='.weibo.com', path='/', expires=2000)
+    session.cookies.set('SSOLoginState', '1', domain='.weibo.com', path='/', expires=500)
+    return session
+
+
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'session.json')
+        self.now = 1000
+        self.store = SessionStore(clock=lambda: self.now)
+
+    def cookies(self, path=None):
+        return {(cookie.domain, cookie.name): cookie for cookie in self.store.load_cookies(path or self.path)}
+
+    def test_save_and_load(self):
+        self.assertTrue(self.store.save(self.path, requests_session()))
+        with open(self.path) as f:
+            data = json.load(f)
+        self.assertEqual((data['version'], data['saved_at']), (1, 1000))
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(os.listdir(self.tmp.name), ['session.json'])
+
+        session = self.store.load(self.path, requests.Session())
+        self.assertEqual(session.cookies.get('SUB', domain='.weibo.cn'), 'cn-sub')
+        cookies = self.cookies()
+        self.assertEqual(sorted(cookies), [('.weibo.cn', 'SUB'), ('.weibo.com', 'SUB')])
+        self.assertTrue(cookies['.weibo.cn', 'SUB'].secure)
+        self.assertTrue(cookies['.weibo.cn', 'SUB'].has_nonstandard_attr('HttpOnly'))
+        self.assertTrue(cookies['.weibo.cn', 'SUB'].domain_initial_dot)
+        self.assertEqual(cookies['.weibo.com', 'SUB'].expires, 2000)
+
+    def test_expired_cookies_dropped_on_load(self):
+        self.store.save(self.path, requests_session())
+        self.now = 3000
+        self.assertEqual(sorted(self.cookies()), [('.weibo.cn', 'SUB')])
+
+    def test_unchanged_session_not_rewritten(self):
+        session = requests_session()
+        self.assertTrue(self.store.save(self.path, session))
+        self.now = 1100
+        self.assertFalse(self.store.save(self.path, session))
+        session.cookies.set('SUB', 'new-sub', domain='.weibo.cn', path='/')
+        self.assertTrue(self.store.save(self.path, session))
+        self.assertEqual(self.cookies()['.weibo.cn', 'SUB'].value, 'new-sub')
+
+    def test_update_merges(self):
+        self.store.save(self.path, requests_session())
+        update = requests.Session()
+        update.cookies.set('SUB', 'new-sub', domain='.weibo.com', path='/')
+        update.cookies.set('_T_WM', 't', domain='.weibo.cn', path='/')
+        self.assertTrue(self.store.update(self.path, update))
+        self.assertFalse(self.store.update(self.path, update))
+        self.assertEqual({key: cookie.value for key, cookie in self.cookies().items()},
+                         {('.weibo.cn', 'SUB'): 'cn-sub', ('.weibo.com', 'SUB'): 'new-sub',
+                          ('.weibo.cn', '_T_WM'): 't'})
+
+    def test_pickle_migration(self):
+        path = os.path.join(self.tmp.name, 'session.pkl')
+        with open(path, 'wb') as f:
+            pickle.dump(requests_session(), f)
+        with self.assertRaises(ValueError):
+            SessionStore(migrate_pickle=False).load_cookies(path)
+
+        self.assertEqual(sorted(self.cookies(path)), [('.weibo.cn', 'SUB'), ('.weibo.com', 'SUB')])
+        with open(path) as f:
+            self.assertEqual(len(json.load(f)['cookies']), 2)
+        self.assertEqual(len(SessionStore(migrate_pickle=False, clock=lambda: self.now).load_cookies(path)), 2)
+
+    def test_missing_file(self):
+        self.assertIsNone(self.store.load_cookies(self.path))
+        self.assertIsNone(self.store.load(self.path, requests.Session()))
+
+    def test_clients(self):
+        self.store.save(self.path, requests_session())
+        weibo = WeiboCnApi(weibo_session_file=self.path, session_store=self.store)
+        self.assertEqual(weibo.session.cookies.get('SUB', domain='.weibo.cn'), 'cn-sub')
+        login = WeiboLoginApi(login_user='user', login_password='password', weibo_session_file=self.path,
+                              session_store=self.store)
+        self.assertEqual(login.session.cookies.get('SUB', domain='.weibo.com'), 'com-sub')
+
+
+if __name__ == '__main__':
+    unittest.main()
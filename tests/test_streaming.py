@@ -0,0 +1,72 @@
+import base64
+import io
+import os
+import tempfile
+import unittest
+from urllib.parse import urlencode
+
+from weibo_api.streaming import Base64FormBody, BufferReader, SizedReader, as_stream, stream_len
+
+
+class StreamingTest(unittest.TestCase):
+
+    def test_buffer_reader(self):
+        reader = BufferReader(memoryview(b'abcdef'))
+        self.assertEqual(reader.len, 6)
+        self.assertEqual(reader.read(4), b'abcd')
+        self.assertEqual(reader.len, 2)
+        self.assertEqual(reader.read(), b'ef')
+        self.assertEqual(reader.read(1), b'')
+
+    def test_as_stream(self):
+        self.assertIsInstance(as_stream(b'abc'), BufferReader)
+        self.assertIsInstance(as_stream(bytearray(b'abc')), BufferReader)
+
+        bytes_io = io.BytesIO(b'abcdef')
+        bytes_io.read(2)
+        stream = as_stream(bytes_io)
+        self.assertIsInstance(stream, BufferReader)
+        self.assertEqual(stream.read(), b'cdef')
+
+        with tempfile.TemporaryFile() as f:
+            self.assertIs(as_stream(f), f)
+
+        buffered = io.BufferedReader(io.BytesIO(b'abcdef'))
+        self.assertIsInstance(as_stream(buffered), SizedReader)
+
+        with self.assertRaises(TypeError):
+            as_stream(iter([b'abc']))
+
+    def test_stream_len(self):
+        self.assertEqual(stream_len(memoryview(b'abcdef')[2:]), 4)
+        bytes_io = io.BytesIO(b'abcdef')
+        bytes_io.read(1)
+        self.assertEqual(stream_len(bytes_io), 5)
+        with tempfile.TemporaryFile() as f:
+            f.write(b'abcdef')
+            f.seek(3)
+            self.assertEqual(stream_len(f), 3)
+        self.assertEqual(stream_len(io.BufferedReader(io.BytesIO(b'abcdef'))), 6)
+
+    def test_base64_form_body(self):
+        for size in (0, 1, 2, 3, 100, 1000):
+            content = os.urandom(size)
+            expected = urlencode({'b64_data': base64.b64encode(content)}).encode('ascii')
+            body = Base64FormBody('b64_data', io.BytesIO(content), block_size=12)
+            self.assertEqual(body.len, len(expected))
+            chunks = []
+            while True:
+                chunk = body.read(7)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            self.assertEqual(b''.join(chunks), expected)
+            self.assertEqual(body.len, 0)
+
+    def test_base64_form_body_block_size(self):
+        with self.assertRaises(ValueError):
+            Base64FormBody('b64_data', io.BytesIO(b''), block_size=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from weibo_api.token_cache import TokenCache
+
+
+class TokenCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.fetch = MagicMock(side_effect=lambda: f'token{self.fetch.call_count}')
+        self.cache = TokenCache(self.fetch, ttl=10, clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.assertEqual(self.cache.get(), 'token1')
+        self.now = 9
+        self.assertEqual(self.cache.get(), 'token1')
+        self.now = 10
+        self.assertEqual(self.cache.get(), 'token2')
+        self.assertEqual(self.cache.stats, {'hits': 1, 'misses': 2})
+
+    def test_invalidate(self):
+        self.cache.get()
+        self.cache.invalidate('another token')
+        self.assertEqual(self.cache.get(), 'token1')
+        self.cache.invalidate('token1')
+        self.assertEqual(self.cache.get(), 'token2')
+
+    def test_failed_fetch_is_not_cached(self):
+        self.fetch.side_effect = [RuntimeError('login required'), 'token']
+        with self.assertRaises(RuntimeError):
+            self.cache.get()
+        self.assertEqual(self.cache.get(), 'token')
+
+    def test_concurrent_refresh_once(self):
+        def slow_fetch():
+            time.sleep(0.05)
+            return 'token'
+
+        fetch = MagicMock(side_effect=slow_fetch)
+        cache = TokenCache(fetch)
+        threads = [threading.Thread(target=cache.get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(cache.stats, {'hits': 7, 'misses': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
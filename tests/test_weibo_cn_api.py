@@ -1,8 +1,12 @@
+import io
 import json
 import unittest
 from unittest.mock import MagicMock, PropertyMock, patch, mock_open
 
+from requests_toolbelt import MultipartEncoder
+
 from weibo_api import WeiboCnApi
+from weibo_api.pic_cache import PicIdCache
 from weibo_api.weibo_cn_api.weibo_cn_api_constants import *
 
 
@@ -88,6 +92,50 @@ class WeiboCnApiTest(unittest.TestCase):
 
         self.assertEqual(response, 'pic_id')
 
+    def test_get_pic_id_from_buffer(self):
+        weibo = WeiboCnApi(**self.config)
+        for pic in (b'raw image bytes', memoryview(b'raw image bytes'), io.BytesIO(b'raw image bytes')):
+            self.assertEqual(weibo.get_pic_id(pic), 'pic_id')
+            encoder = WeiboCnApi.post.call_args[1]['data']
+            self.assertIsInstance(encoder, MultipartEncoder)
+            self.assertIn(b'raw image bytes', encoder.to_string())
+
+    def test_get_pic_id_recompresses_large_pic(self):
+        compressor = MagicMock()
+        compressor.compress.return_value = b'small jpeg'
+        weibo = WeiboCnApi(image_compressor=compressor, **self.config)
+        pic = bytearray(PIC_SIZE_LIMIT)
+        self.assertEqual(weibo.get_pic_id(pic), 'pic_id')
+        compressor.compress.assert_called_once_with(pic)
+        self.assertIn(b'small jpeg', WeiboCnApi.post.call_args[1]['data'].to_string())
+
+    def test_get_pic_id_cached(self):
+        with self.assertRaises(ValueError):
+            WeiboCnApi(pic_cache=PicIdCache(), **self.config)
+        weibo = WeiboCnApi(pic_cache=PicIdCache(), account='a', **self.config)
+        self.assertEqual(weibo.get_pic_id(b'pic'), 'pic_id')
+        calls = WeiboCnApi.post.call_count
+        self.assertEqual(weibo.get_pic_id(memoryview(b'pic')), 'pic_id')
+        self.assertEqual(WeiboCnApi.post.call_count, calls)
+        self.assertEqual(weibo.pic_cache.stats, {'hits': 1, 'misses': 1})
+
+    def test_get_pic_ids(self):
+        def mock_response(arg, **kwargs):
+            response = self.mock_response(arg, **kwargs)
+            if arg == UPLOAD_PIC_URL:
+                body = kwargs['data'].to_string()
+                if b'broken' in body:
+                    raise IOError('connection reset')
+                response.json.return_value = {'pic_id': body.rsplit(b'\r\n', 3)[-3].decode()}
+            return response
+
+        WeiboCnApi.post = WeiboCnApi.get = MagicMock(side_effect=mock_response)
+        weibo = WeiboCnApi(**self.config)
+        result = weibo.get_pic_ids([b'id1', b'broken', b'id3', b'id4'], max_workers=3)
+        self.assertEqual(result.pic_ids, ['id1', 'id3', 'id4'])
+        self.assertEqual(list(result.errors), [1])
+        self.assertIsInstance(result.errors[1], IOError)
+
     def test_post_status(self):
         weibo = WeiboCnApi(**self.config)
         response = weibo.post_status('content', 'img')
@@ -98,6 +146,47 @@ class WeiboCnApiTest(unittest.TestCase):
         response = weibo.repost('repost_id', 'content')
         self.assertEqual(response, {"ok": 1, "data": {}})
 
+    def test_st_is_cached(self):
+        weibo = WeiboCnApi(**self.config)
+        weibo.post_status('content', ['img'])
+        weibo.repost('repost_id', 'content')
+        st_calls = [c for c in WeiboCnApi.get.call_args_list if c[0][0] == ST_URL]
+        self.assertEqual(len(st_calls), 1)
+        self.assertEqual(weibo.st_cache.stats, {'hits': 1, 'misses': 1})
+        self.assertEqual(WeiboCnApi.post.call_args[1]['data']['st'], 'a32bc4')
+        self.assertEqual(WeiboCnApi.post.call_args[1]['headers']['X-XSRF-TOKEN'], 'a32bc4')
+
+    def test_st_expired(self):
+        responses = iter(['{"ok":0,"errno":"100006","msg":"expired"}', '{"ok":1,"data":{}}'])
+
+        def mock_response(arg, **kwargs):
+            if arg == POST_STATUS_URL:
+                response = MagicMock()
+                response.json.return_value = json.loads(next(responses))
+                return response
+            return self.mock_response(arg, **kwargs)
+
+        WeiboCnApi.post = WeiboCnApi.get = MagicMock(side_effect=mock_response)
+        weibo = WeiboCnApi(**self.config)
+        response = weibo.post_status('content')
+        self.assertEqual(response, {"ok": 1, "data": {}})
+        self.assertEqual(weibo.st_cache.stats, {'hits': 0, 'misses': 2})
+
+    def test_is_login(self):
+        weibo = WeiboCnApi(**self.config)
+        self.assertTrue(weibo.is_login())
+        # The fresh st is used by the next post
+        weibo.post_status('content')
+        self.assertEqual(weibo.st_cache.stats, {'hits': 1, 'misses': 1})
+
+        def logged_out(arg, **kwargs):
+            response = MagicMock()
+            response.json.return_value = {"data": {"login": False}, "ok": 1}
+            return response
+
+        WeiboCnApi.get = MagicMock(side_effect=logged_out)
+        self.assertFalse(weibo.is_login())
+
 
 if __name__ == '__main__':
     unittest.main()
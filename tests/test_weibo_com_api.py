@@ -1,8 +1,16 @@
 import json
+import os
+import tempfile
+import threading
 import unittest
 from unittest.mock import MagicMock, patch, mock_open
 
+import requests
+
 from weibo_api import WeiboComApi
+from weibo_api.hashing import file_digests
+from weibo_api.pic_cache import PicIdCache
+from weibo_api.weibo_com_api.upload_manifest import UploadManifest
 from weibo_api.weibo_com_api.weibo_com_api_constants import *
 
 
@@ -73,16 +81,180 @@ class WeiboComApiTest(unittest.TestCase):
         mock_getsize.return_value = 1
 
         weibo = WeiboComApi(**self.config)
-        with patch(self.PATH + '.open', mock_open(read_data=b'abc')) as m:
+        with patch(self.PATH + '.open', mock_open(read_data=b'abc')), \
+                patch('weibo_api.hashing.open', mock_open(read_data=b'abc')):
             fid = weibo.upload_video('video.mp4')
             self.assertEqual(fid, '1')
 
+    @patch(PATH + '.time.sleep')
+    def test_upload_video_concurrent(self, mock_sleep):
+        received = {}
+        lock = threading.Lock()
+
+        def mock_response(arg, **kwargs):
+            response = MagicMock()
+            if arg == MULTIMEDIA_INIT_URL:
+                response.json.return_value = {'fileToken': 'token', 'length': 1}
+                return response
+            start_location = kwargs['params']['startloc']
+            with lock:
+                attempts = received.setdefault(start_location, [])
+                attempts.append(kwargs['data'])
+                if start_location == 1024 and len(attempts) == 1:
+                    response.json.return_value = {'succ': False}
+                elif len(received) == 3:
+                    response.json.return_value = {'fid': 'fid'}
+                else:
+                    response.json.return_value = {'succ': True}
+            return response
+
+        WeiboComApi.post = MagicMock(side_effect=mock_response)
+        content = os.urandom(2500)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(content)
+        try:
+            weibo = WeiboComApi(upload_concurrency=2, **self.config)
+            self.assertEqual(weibo.upload_video(f.name), 'fid')
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual(sorted(received), [0, 1024, 2048])
+        self.assertEqual(len(received[1024]), 2)
+        self.assertEqual(b''.join(received[loc][-1] for loc in sorted(received)), content)
+        mock_sleep.assert_called_once()
+        chunk_calls = [c for c in WeiboComApi.post.call_args_list if c.args[0] == MULTIMEDIA_UPLOAD_DATA_URL]
+        self.assertTrue(all(c.kwargs['idempotent'] for c in chunk_calls))
+
+    def test_upload_video_transport_error_not_resent(self):
+        # Transport errors are retried by the retry_policy inside post(), not again by upload_video.
+        sent = []
+
+        def mock_response(arg, **kwargs):
+            response = MagicMock()
+            if arg == MULTIMEDIA_INIT_URL:
+                response.json.return_value = {'fileToken': 'token', 'length': 1}
+                return response
+            sent.append(kwargs['params']['startloc'])
+            raise requests.ConnectionError('connection reset')
+
+        WeiboComApi.post = MagicMock(side_effect=mock_response)
+        weibo = WeiboComApi(chunk_retries=3, **self.config)
+        with patch(self.PATH + '.getsize', return_value=10), \
+                patch('weibo_api.hashing.open', mock_open(read_data=b'abc')), \
+                patch(self.PATH + '.open', mock_open(read_data=b'abc')):
+            with self.assertRaises(requests.ConnectionError):
+                weibo.upload_video('video.mp4')
+        self.assertEqual(sent, [0])
+
+    def test_upload_video_resume(self):
+        sent = []
+        fail = {2048}
+
+        def mock_response(arg, **kwargs):
+            response = MagicMock()
+            if arg == MULTIMEDIA_INIT_URL:
+                sent.append('init')
+                response.json.return_value = {'fileToken': 'token', 'length': 1}
+                return response
+            start_location = kwargs['params']['startloc']
+            sent.append(start_location)
+            if start_location in fail:
+                response.json.return_value = {'succ': False}
+            else:
+                response.json.return_value = {'fid': 'fid'} if start_location == 3072 else {'succ': True}
+            return response
+
+        WeiboComApi.post = MagicMock(side_effect=mock_response)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'video.mp4')
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(3500))
+            manifest_dir = os.path.join(tmp_dir, 'manifests')
+            weibo = WeiboComApi(upload_manifest_dir=manifest_dir, chunk_retries=0, **self.config)
+
+            with self.assertRaises(RuntimeError):
+                weibo.upload_video(filename)
+            self.assertEqual(sent, ['init', 0, 1024, 2048])
+
+            sent.clear()
+            fail.clear()
+            self.assertEqual(weibo.upload_video(filename), 'fid')
+            self.assertEqual(sent, [2048, 3072])
+            self.assertEqual(os.listdir(manifest_dir), [])
+
+    def test_upload_video_resumed_timeout_keeps_manifest(self):
+        sent = []
+
+        def mock_response(arg, **kwargs):
+            sent.append(kwargs['params']['startloc'])
+            raise requests.Timeout('read timed out')
+
+        WeiboComApi.post = MagicMock(side_effect=mock_response)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'video.mp4')
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(2500))
+            manifest_dir = os.path.join(tmp_dir, 'manifests')
+            md5, _ = file_digests(filename)
+            UploadManifest.load(manifest_dir, filename, md5).start('token', 1024)
+            weibo = WeiboComApi(upload_manifest_dir=manifest_dir, chunk_retries=0, **self.config)
+
+            with self.assertRaises(requests.Timeout):
+                weibo.upload_video(filename)
+            self.assertTrue(sent)
+            self.assertEqual(len(os.listdir(manifest_dir)), 1)
+            self.assertTrue(UploadManifest.load(manifest_dir, filename, md5).resumable)
+
+    def test_upload_video_dead_resumed_token(self):
+        sent = []
+
+        def mock_response(arg, **kwargs):
+            response = MagicMock()
+            if arg == MULTIMEDIA_INIT_URL:
+                sent.append('init')
+                response.json.return_value = {'fileToken': 'token', 'length': 1}
+                return response
+            sent.append(kwargs['params']['startloc'])
+            if kwargs['params']['filetoken'] != 'token':
+                response.json.return_value = {'error': 'invalid filetoken'}
+            else:
+                response.json.return_value = {'fid': 'fid'} if kwargs['params']['startloc'] == 2048 else {'succ': True}
+            return response
+
+        WeiboComApi.post = MagicMock(side_effect=mock_response)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'video.mp4')
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(2500))
+            manifest_dir = os.path.join(tmp_dir, 'manifests')
+            md5, _ = file_digests(filename)
+            UploadManifest.load(manifest_dir, filename, md5).start('expired', 1024)
+            weibo = WeiboComApi(upload_manifest_dir=manifest_dir, chunk_retries=0, **self.config)
+
+            with self.assertRaises(RuntimeError):
+                weibo.upload_video(filename)
+            self.assertNotIn('init', sent)
+            self.assertEqual(os.listdir(manifest_dir), [])
+
+            self.assertEqual(weibo.upload_video(filename), 'fid')
+            self.assertEqual(sent[-4:], ['init', 0, 1024, 2048])
+
     def test_upload_pic(self):
         weibo = WeiboComApi(**self.config)
-        with patch(self.PATH + '.open', mock_open(read_data=b'edf')) as m:
+        with patch(self.PATH + '.open', mock_open(read_data=b'edf')):
             pid = weibo.upload_pic('pic.png')
             self.assertEqual(pid, 'pid')
 
+    def test_upload_pic_cached(self):
+        with self.assertRaises(ValueError):
+            WeiboComApi(pic_cache=PicIdCache(), **self.config)
+        weibo = WeiboComApi(pic_cache=PicIdCache(), account='a', **self.config)
+        with patch(self.PATH + '.open', mock_open(read_data=b'edf')), \
+                patch('weibo_api.hashing.open', mock_open(read_data=b'edf')):
+            self.assertEqual(weibo.upload_pic('pic.png'), 'pid')
+            self.assertEqual(weibo.upload_pic('pic.png'), 'pid')
+        self.assertEqual(WeiboComApi.post.call_count, 1)
+
     def test_post_weibo(self):
         weibo = WeiboComApi(**self.config)
         response = weibo.post_status('caption', 'vid', 'pid')
@@ -0,0 +1,296 @@
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import Future, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from weibo_api.exceptions import LoginException, VerificationTimeout
+from weibo_api.retry_policy import RetryPolicy
+from weibo_api.weibo_login import ConsoleProvider, LoginFlow, PendingVerifications, VerificationRequest, WeiboLoginApi
+
+
+class CrossDomainHandler(BaseHTTPRequestHandler):
+    """Sets the cookie named by the path after a delay; /logout deletes the cookie 'old'."""
+
+    protocol_version = 'HTTP/1.1'
+    delay = 0.2
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        name = self.path.strip('/')
+        if name == 'logout':
+            self.send_header('Set-Cookie', 'old=; Max-Age=0; Path=/')
+        else:
+            self.send_header('Set-Cookie', f'{name}={self.server.server_address[1]}; Path=/')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class CrossDomainLoginTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [ThreadingHTTPServer(('127.0.0.1', 0), CrossDomainHandler) for _ in range(4)]
+        for server in cls.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.urls = [f'http://127.0.0.1:{server.server_address[1]}' for server in cls.servers]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        self.login = WeiboLoginApi(login_user='user', login_password='password', retry_policy=None)
+        self.login.session.cookies.set('old', 'value', domain='127.0.0.1', path='/')
+        self.fan_out = self.login._WeiboLoginApi__cross_domain_fan_out
+
+    def test_domains_are_visited_concurrently(self):
+        start = time.perf_counter()
+        self.fan_out([f'{url}/c{i}' for i, url in enumerate(self.urls)], 'test.cross_domain_url')
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 2 * CrossDomainHandler.delay)
+        cookies = {cookie.name: cookie.value for cookie in self.login.session.cookies}
+        self.assertEqual(cookies, dict({f'c{i}': url.rsplit(':', 1)[1] for i, url in enumerate(self.urls)},
+                                       old='value'))
+        self.assertEqual(set(self.login.cross_domain_timings), {url[len('http://'):] for url in self.urls})
+        self.assertTrue(all(t >= CrossDomainHandler.delay for t in self.login.cross_domain_timings.values()))
+
+    def test_sequential(self):
+        self.login.cross_domain_concurrency = 1
+        start = time.perf_counter()
+        self.fan_out([f'{url}/c{i}' for i, url in enumerate(self.urls[:2])], 'test.cross_domain_url')
+        self.assertGreaterEqual(time.perf_counter() - start, 2 * CrossDomainHandler.delay)
+        self.assertEqual({cookie.name for cookie in self.login.session.cookies}, {'old', 'c0', 'c1'})
+
+    def test_removed_cookies_are_merged(self):
+        self.fan_out([f'{self.urls[0]}/logout', f'{self.urls[1]}/new'], 'test.cross_domain_url')
+        self.assertEqual({cookie.name for cookie in self.login.session.cookies}, {'new'})
+
+    def test_errors(self):
+        closed = ThreadingHTTPServer(('127.0.0.1', 0), CrossDomainHandler)
+        closed_url = f'http://127.0.0.1:{closed.server_address[1]}/down'
+        closed.server_close()
+
+        self.fan_out([closed_url, f'{self.urls[0]}/c0'], 'test.cross_domain_url', ignore_errors=True)
+        self.assertIn('c0', {cookie.name for cookie in self.login.session.cookies})
+        with self.assertRaises(Exception):
+            self.fan_out([closed_url, f'{self.urls[1]}/c1'], 'test.cross_domain_url')
+        self.assertIn('c1', {cookie.name for cookie in self.login.session.cookies})
+
+    def test_timeout(self):
+        self.login.cross_domain_timeout = 0.05
+        with self.assertRaises(Exception):
+            self.fan_out([f'{self.urls[0]}/slow'], 'test.cross_domain_url')
+
+
+class FakeResponse(object):
+
+    def __init__(self, data=None, text=''):
+        self.data = data
+        self.text = text
+        self.content = text.encode('utf-8')
+
+    def json(self):
+        return self.data
+
+
+class LoginFlowTest(unittest.TestCase):
+    """weibo.cn login with sms verification, against canned responses."""
+
+    PHONES = json.dumps([{'number': '1', 'maskMobile': '138****0000'}])
+
+    def setUp(self):
+        self.requests = []
+        self.login = WeiboLoginApi(login_user='user', login_password='password', verification_type='sms')
+        self.login.get = self.fake_request
+        self.login.post = self.fake_request
+
+    def fake_request(self, url, **kwargs):
+        self.requests.append(kwargs['operation'])
+        if url == 'https://passport.sina.cn/sso/login':
+            return FakeResponse({'retcode': 50050011, 'data': {'errurl': 'https://passport.weibo.cn/verify'}})
+        if url == 'https://passport.weibo.cn/verify':
+            return FakeResponse(text=f"phoneList: JSON.parse('{self.PHONES}'),")
+        if url.endswith('/ajsend'):
+            return FakeResponse({'retcode': 100000})
+        if url.endswith('/ajcheck'):
+            if kwargs['params']['code'] != '123456':
+                return FakeResponse({'retcode': 1})
+            return FakeResponse({'retcode': 100000, 'data': {'url': 'https://weibo.cn/verified'}})
+        return FakeResponse()
+
+    def test_suspend_and_resume(self):
+        flow = self.login.weibo_cn_login_flow()
+        request = flow.start()
+
+        self.assertEqual(request.account, 'user')
+        self.assertEqual((request.site, request.channel, request.kind), ('weibo.cn', 'sms', 'code'))
+        self.assertIs(flow.pending, request)
+        self.assertEqual(self.requests[-1], 'weibo_cn_login.send_code')
+
+        self.assertIsNone(flow.resume('123456'))
+        self.assertTrue(flow.done)
+        self.assertIsNone(flow.error)
+        self.assertEqual(self.requests[-1], 'weibo_cn_login.verified')
+        with self.assertRaises(RuntimeError):
+            flow.resume('123456')
+
+    def test_many_pending_flows(self):
+        flows = [self.login.weibo_cn_login_flow() for _ in range(100)]
+        with patch('threading.Thread.start') as start:
+            for flow in flows:
+                flow.start()
+        start.assert_not_called()
+        self.assertTrue(all(flow.pending is not None for flow in flows))
+        for flow in reversed(flows):
+            flow.resume('123456')
+        self.assertTrue(all(flow.done and flow.error is None for flow in flows))
+
+    def test_wrong_code(self):
+        flow = self.login.weibo_cn_login_flow()
+        flow.start()
+        with self.assertRaises(LoginException):
+            flow.resume('000000')
+        self.assertTrue(flow.done)
+        self.assertIsInstance(flow.error, LoginException)
+
+    def test_run_with_provider(self):
+        self.login.verification_provider = lambda request: '123456'
+        self.login.weibo_cn_login()
+        self.assertEqual(self.requests[-1], 'weibo_cn_login.verified')
+
+    def test_run_timeout(self):
+        self.login.verification_provider = lambda request: Future()
+        self.login.verification_timeout = 0.01
+        with self.assertRaises(VerificationTimeout):
+            self.login.weibo_cn_login()
+        self.assertEqual(self.requests[-1], 'weibo_cn_login.send_code')
+
+    def test_pending_verifications(self):
+        provider = PendingVerifications()
+        self.login.verification_provider = provider
+        login = threading.Thread(target=self.login.weibo_cn_login)
+        login.start()
+        while not provider.requests():
+            time.sleep(0.01)
+        self.assertEqual(provider.requests()[0].account, 'user')
+        self.assertFalse(provider.supply('other', '123456'))
+        self.assertTrue(provider.supply('user', '123456'))
+        login.join(5)
+        self.assertEqual(self.requests[-1], 'weibo_cn_login.verified')
+        self.assertEqual(provider.requests(), [])
+
+
+class VerificationRetryTest(unittest.TestCase):
+    """Requests that send or check a verification code are not retried."""
+
+    def setUp(self):
+        self.sent = []
+        self.login = WeiboLoginApi(login_user='user', login_password='password', verification_type='sms',
+                                   retry_policy=RetryPolicy(sleep=lambda seconds: None))
+        self.login.session = MagicMock()
+        self.login.session.get.side_effect = self.send
+        self.login.session.post.side_effect = self.send
+
+    def send(self, url, **kwargs):
+        self.sent.append(url)
+        if url == 'https://passport.sina.cn/sso/login':
+            return self.response(200, {'retcode': 50050011, 'data': {'errurl': 'https://passport.weibo.cn/verify'}})
+        if url == 'https://passport.weibo.cn/verify':
+            return self.response(200, text=f"phoneList: JSON.parse('{LoginFlowTest.PHONES}'),")
+        return self.response(503, {'retcode': 1})
+
+    @staticmethod
+    def response(status_code, data=None, text=''):
+        rsp = requests.models.Response()
+        rsp.status_code = status_code
+        rsp._content = json.dumps(data).encode('utf-8') if data is not None else text.encode('utf-8')
+        return rsp
+
+    def test_send_code_not_retried(self):
+        with self.assertRaises(LoginException):
+            self.login.weibo_cn_login_flow().start()
+        self.assertEqual(self.sent.count('https://passport.weibo.cn/verify'), 1)
+        self.assertEqual(self.sent.count('https://passport.weibo.cn/signin/secondverify/ajsend'), 1)
+
+
+class ConsoleProviderTest(unittest.TestCase):
+
+    def test_answer_after_timeout(self):
+        typed = threading.Event()
+        errors = []
+
+        def slow_input(prompt):
+            typed.wait(5)
+            return '123456'
+
+        def ask(provider, request):
+            future = provider(request)
+            try:
+                future.result(0.01)
+            except TimeoutError:
+                self.assertTrue(future.cancel())
+            return future
+
+        request = VerificationRequest('user', 'weibo.cn', 'sms', 'code', 'Code: ')
+        hook, threading.excepthook = threading.excepthook, lambda args: errors.append(args.exc_value)
+        try:
+            with patch('builtins.input', slow_input):
+                future = ask(ConsoleProvider(), request)
+                typed.set()
+                for thread in threading.enumerate():
+                    if thread.name == 'verification-input':
+                        thread.join(5)
+        finally:
+            threading.excepthook = hook
+        self.assertTrue(future.cancelled())
+        self.assertEqual(errors, [])
+
+    def test_answer(self):
+        with patch('builtins.input', side_effect=['maybe', 'confirm']):
+            request = VerificationRequest('user', 'weibo.com', 'private_msg', 'confirm', 'Confirm: ')
+            self.assertIs(ConsoleProvider()(request).result(5), True)
+
+
+class LoginFlowStepsTest(unittest.TestCase):
+
+    @staticmethod
+    def steps():
+        confirmed = yield 'confirm'
+        if not confirmed:
+            raise LoginException('User canceled the login.')
+
+    def test_confirm(self):
+        flow = LoginFlow(self.steps())
+        self.assertEqual(flow.start(), 'confirm')
+        self.assertIsNone(flow.resume(True))
+        self.assertTrue(flow.done)
+
+    def test_cancel(self):
+        flow = LoginFlow(self.steps())
+        flow.start()
+        with self.assertRaises(LoginException):
+            flow.resume(False)
+
+    def test_fail(self):
+        flow = LoginFlow(self.steps())
+        flow.start()
+        with self.assertRaises(VerificationTimeout):
+            flow.fail(VerificationTimeout('expired'))
+        self.assertIsInstance(flow.error, VerificationTimeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import logging
+import unittest
+
+import requests
+
+from weibo_api.wire_trace import WireTrace, WIRE_TRACE_FULL, WIRE_TRACE_HEADERS, WIRE_TRACE_OFF
+
+
+def make_response(request_body=b'', response_body=b'{"ok":1}'):
+    request = requests.Request('POST', 'https://m.weibo.cn/api/statuses/update?a=1', data=request_body).prepare()
+    rsp = requests.Response()
+    rsp.request = request
+    rsp.status_code = 200
+    rsp.reason = 'OK'
+    rsp.headers['Content-Type'] = 'application/json'
+    rsp._content = response_body
+    return rsp
+
+
+class WireTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('wire_trace_test')
+
+    def test_full_truncates_bodies(self):
+        trace = WireTrace(WIRE_TRACE_FULL, max_body_bytes=4)
+        dumped = trace.format(make_response(request_body=b'x' * 100))
+        self.assertIn('< POST /api/statuses/update?a=1 HTTP/1.1', dumped)
+        self.assertIn('< Host: m.weibo.cn', dumped)
+        self.assertIn('< xxxx... << truncated, 100 bytes in total >>', dumped)
+        self.assertIn('> {"ok... << truncated, 8 bytes in total >>', dumped)
+
+    def test_headers_only(self):
+        trace = WireTrace(WIRE_TRACE_HEADERS)
+        dumped = trace.format(make_response(request_body=b'secret'))
+        self.assertIn('> Content-Type: application/json', dumped)
+        self.assertNotIn('secret', dumped)
+        self.assertNotIn('"ok"', dumped)
+
+    def test_streamed_body_is_not_read(self):
+        class Stream(object):
+            len = 10
+
+            def read(self, *args):
+                raise AssertionError('Streamed body must not be read.')
+
+        rsp = make_response()
+        rsp.request.body = Stream()
+        self.assertIn('<< streamed body of 10 bytes >>', WireTrace().format(rsp))
+
+    def test_no_work_when_off_or_not_debug(self):
+        rsp = make_response()
+        with self.assertLogs(self.logger, level=logging.DEBUG) as logs:
+            WireTrace(WIRE_TRACE_OFF).log(self.logger, rsp)
+            self.logger.debug('sentinel')
+        self.assertEqual(len(logs.records), 1)
+
+        self.logger.setLevel(logging.INFO)
+        try:
+            trace = WireTrace()
+            trace.format = None  # would raise if called
+            trace.log(self.logger, rsp)
+        finally:
+            self.logger.setLevel(logging.NOTSET)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            WireTrace('verbose')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,7 @@
+try:
+    import aiohttp
+except ImportError:
+    raise ImportError('weibo_api.aio requires aiohttp. Install it with `pip install weibo_api[aio]`.')
+
+from .async_weibo_cn_api import AsyncWeiboCnApi
+from .async_weibo_com_api import AsyncWeiboComApi
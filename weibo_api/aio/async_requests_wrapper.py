@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from email.utils import formatdate
+from http.cookies import Morsel
+
+import aiohttp
+
+from ..http_metrics import RequestEvent, body_size, default_operation
+from ..requests_wrapper import RequestsWrapper
+from ..session_store import SessionStore
+
+
+def load_session_cookies(session_file, session_store=None):
+    """Cookies of a session file, as written by WeiboLoginApi."""
+    return (session_store or SessionStore()).load_cookies(session_file)
+
+
+def to_cookie_jar(cookies):
+    """
+    aiohttp CookieJar holding the cookies of a requests session (or any http.cookiejar.CookieJar), keeping their
+    domain, path, expiry and secure flag. Has to be called inside the running event loop.
+    """
+    cookies = getattr(cookies, 'cookies', cookies)
+    # Cookie values are sent as they were received, like requests does.
+    jar = aiohttp.CookieJar(quote_cookie=False)
+    jar.update_cookies([(cookie.name, to_morsel(cookie)) for cookie in cookies])
+    return jar
+
+
+def to_morsel(cookie):
+    morsel = Morsel()
+    value = cookie.value if cookie.value is not None else ''
+    morsel.set(cookie.name, value, value)
+    morsel['domain'] = cookie.domain
+    morsel['path'] = cookie.path or '/'
+    if cookie.expires:
+        morsel['expires'] = formatdate(cookie.expires, usegmt=True)
+    if cookie.secure:
+        morsel['secure'] = True
+    return morsel
+
+
+class AsyncRequestsWrapper(object):
+    """
+    aiohttp counterpart of RequestsWrapper. The ClientSession is created on the first request, inside the running
+    event loop, and closed by close() or by leaving `async with`.
+
+    Subclasses call _init_session with their kwargs: an aiohttp `session`, or `cookies` (a requests session or cookie
+    jar), or a session file in `weibo_session_file`, read with `session_store`.
+    """
+
+    session = None
+    logger = logging.getLogger(__name__)
+    # The same listeners as the blocking clients.
+    http_metrics = RequestsWrapper.http_metrics
+
+    def _init_session(self, kwargs):
+        self.timeout = kwargs.get('timeout', 60)
+        self.connection_limit = kwargs.get('connection_limit', 10)
+        self.session = kwargs.get('session', None)
+        self.__owns_session = False
+        self.cookies = kwargs.get('cookies', None)
+        if self.session is None and self.cookies is None:
+            session_file = kwargs.get('weibo_session_file', None)
+            self.cookies = load_session_cookies(session_file, kwargs.get('session_store', None))
+            if self.cookies is not None:
+                self.logger.info(f'Loaded cookies from {session_file}')
+        if self.session is None and self.cookies is None:
+            raise ValueError('session is None. Please provide either a session directly, or a valid session file.')
+
+    def client_timeout(self, timeout=None):
+        # Per connect and per read, like the timeout of requests.
+        timeout = timeout or self.timeout
+        return aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def request(self, method, url, operation=None, **kwargs):
+        """
+        Send a request and read the whole response, so it can be used after the connection is released.
+
+        :param operation: logical name of the call reported to http_metrics, e.g. 'cn.st'
+        """
+        kwargs.setdefault('timeout', self.client_timeout())
+        start = time.perf_counter()
+        ttfb = None
+        try:
+            async with self.__client_session().request(method, url, **kwargs) as rsp:
+                ttfb = time.perf_counter() - start
+                body = await rsp.read()
+        except Exception as e:
+            self.__emit(method, url, operation, kwargs, None, ttfb, start, 0, type(e).__name__)
+            raise
+        self.__emit(method, url, operation, kwargs, rsp.status, ttfb, start, rsp.content_length or len(body), None)
+        self.logger.debug(f'{method} {rsp.url} {rsp.status}')
+        return rsp
+
+    def __emit(self, method, url, operation, kwargs, status, ttfb, start, bytes_received, error):
+        if self.http_metrics.enabled:
+            total = time.perf_counter() - start
+            self.http_metrics.emit(RequestEvent(operation or default_operation(url), method, url, 1, status, ttfb,
+                                                total, body_size(kwargs.get('data')), bytes_received, error))
+
+    def __client_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(cookie_jar=to_cookie_jar(self.cookies),
+                                                 connector=aiohttp.TCPConnector(limit=self.connection_limit))
+            self.__owns_session = True
+        return self.session
+
+    async def close(self):
+        """Close the ClientSession, unless it was passed in by the caller."""
+        if self.session is not None and self.__owns_session:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
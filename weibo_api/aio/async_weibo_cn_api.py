@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+from .async_requests_wrapper import AsyncRequestsWrapper
+from ..hashing import stream_digest
+from ..streaming import stream_len
+from ..token_cache import AsyncTokenCache
+from ..weibo_cn_api import WeiboCnApi
+from ..weibo_cn_api.weibo_cn_api_constants import *
+from ..weibo_cn_api.weibo_cn_api_requests import *
+
+
+class AsyncWeiboCnApi(AsyncRequestsWrapper):
+    """asyncio m.weibo.cn API"""
+
+    # Shared with WeiboCnApi, so a picture recompressed by either client is not recompressed again.
+    image_compressor = WeiboCnApi.image_compressor
+
+    def __init__(self, **kwargs):
+        self.logger = logging.getLogger(__name__)
+
+        self._init_session(kwargs)
+        self.image_compressor = kwargs.get('image_compressor', self.image_compressor)
+        self.pic_cache = kwargs.get('pic_cache', None)
+        self.account = kwargs.get('account', kwargs.get('weibo_session_file', None))
+        if self.pic_cache is not None and not self.account:
+            # Cached picture ids are only valid for the account that uploaded them.
+            raise ValueError('pic_cache needs the account (or weibo_session_file) of the session.')
+        self.st_cache = AsyncTokenCache(self.__fetch_st, ttl=kwargs.get('st_ttl', 300))
+
+    async def post_status(self, content, pic_ids=None):
+        rsp_data = await self.__post_form(POST_STATUS_URL, post_status_form(content, pic_ids), 'cn.post_status')
+        check_post_status(rsp_data, content)
+        self.logger.info(f'Weibo {content} is posted.')
+        return rsp_data
+
+    async def repost(self, repost_id, content):
+        rsp_data = await self.__post_form(REPOST_URL, repost_form(repost_id, content), 'cn.repost')
+        check_repost(rsp_data, repost_id, content)
+        self.logger.info(f'Weibo {repost_id}:{content} is reposted.')
+        return rsp_data
+
+    async def get_pic_id(self, pic_file):
+        """
+        Upload a picture and return its pic_id.
+
+        :param pic_file: a file path, a binary file object, or a bytes-like object (bytes, bytearray, memoryview).
+        """
+        loop = asyncio.get_running_loop()
+        content_hash = None
+        if self.pic_cache is not None:
+            content_hash = await loop.run_in_executor(None, stream_digest, pic_file)
+            pic_id = self.pic_cache.get(content_hash, 'weibo.cn', self.account)
+            if pic_id is not None:
+                self.logger.debug(f'Pic {pic_id} found in cache.')
+                return pic_id
+
+        if isinstance(pic_file, (str, os.PathLike)):
+            pic_size = os.stat(pic_file).st_size
+            with open(pic_file, 'rb') as f:
+                pic_id = await self.__upload_pic(f, os.fspath(pic_file), pic_size)
+        else:
+            pic_id = await self.__upload_pic(pic_file, getattr(pic_file, 'name', None) or 'pic', stream_len(pic_file))
+
+        if self.pic_cache is not None:
+            self.pic_cache.put(content_hash, 'weibo.cn', self.account, pic_id)
+        return pic_id
+
+    async def __upload_pic(self, pic, pic_name, pic_size):
+        if pic_size >= PIC_SIZE_LIMIT:
+            data = await asyncio.get_running_loop().run_in_executor(None, self.image_compressor.compress, pic)
+            return await self.__upload_pic_multipart(data, os.path.splitext(pic_name)[0] + '.jpg')
+        else:
+            return await self.__upload_pic_multipart(pic, pic_name)
+
+    async def __upload_pic_multipart(self, pic, pic_name):
+        if isinstance(pic, (bytearray, memoryview)):
+            pic = bytes(pic)
+        start = pic.tell() if hasattr(pic, 'tell') else None
+
+        async def upload(st):
+            if start is not None:
+                pic.seek(start)
+            form = aiohttp.FormData([('type', 'json'), ('st', st)])
+            form.add_field('pic', pic, filename='pic', content_type=guess_content_type(pic_name))
+            # File objects are read in blocks while the body is sent.
+            body = form()
+            rsp = await self.post(UPLOAD_PIC_URL, headers=xsrf_headers(st, body.content_type), data=body,
+                                  operation='cn.upload_pic')
+            return await rsp.json(content_type=None)
+
+        pic_id = parse_pic_id(await self.__with_st(upload), pic_name)
+        self.logger.debug(f'Pic {pic_id} is uploaded.')
+        return pic_id
+
+    async def __post_form(self, url, data, operation):
+        async def post(st):
+            rsp = await self.post(url, headers=form_headers(st), data=dict(data, st=st), operation=operation)
+            return await rsp.json(content_type=None)
+
+        return await self.__with_st(post)
+
+    async def __with_st(self, send):
+        st = await self.st_cache.get()
+        rsp_data = await send(st)
+        if is_st_expired(rsp_data):
+            self.logger.info('st token expired, refreshing.')
+            self.st_cache.invalidate(st)
+            rsp_data = await send(await self.st_cache.get())
+        return rsp_data
+
+    async def __fetch_st(self):
+        rsp = await self.get(ST_URL, headers=COMMON_HEADERS, operation='cn.st')
+        return parse_st(await rsp.json(content_type=None))
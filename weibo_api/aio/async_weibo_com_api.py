@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from os.path import getsize
+
+from .async_requests_wrapper import AsyncRequestsWrapper
+from ..exceptions import LoginException, UploadTokenError
+from ..hashing import file_digests, stream_digest
+from ..streaming import Base64FormBody
+from ..weibo_com_api.upload_manifest import UploadManifest
+from ..weibo_com_api.weibo_com_api_constants import *
+from ..weibo_com_api.weibo_com_api_requests import *
+
+
+class AsyncWeiboComApi(AsyncRequestsWrapper):
+    """asyncio weibo.com API for video upload"""
+
+    def __init__(self, **kwargs):
+        self.logger = logging.getLogger(__name__)
+
+        self._init_session(kwargs)
+        self.upload_concurrency = kwargs.get('upload_concurrency', 1)
+        self.chunk_retries = kwargs.get('chunk_retries', 3)
+        self.upload_manifest_dir = kwargs.get('upload_manifest_dir', None)
+        self.pic_cache = kwargs.get('pic_cache', None)
+        self.account = kwargs.get('account', kwargs.get('weibo_session_file', None))
+        if self.pic_cache is not None and not self.account:
+            # Cached picture ids are only valid for the account that uploaded them.
+            raise ValueError('pic_cache needs the account (or weibo_session_file) of the session.')
+        self.upload_manifest_ttl = kwargs.get('upload_manifest_ttl', 24 * 3600)
+        self.__chunk_bytes_hint = kwargs.get('chunk_bytes_hint', None)
+
+    async def __upload_init(self, filename, md5):
+        rsp = await self.post(MULTIMEDIA_INIT_URL, params=upload_init_params(filename, getsize(filename), md5),
+                              operation='upload_video.init')
+        return check_upload_init(await rsp.json(content_type=None), await rsp.text())
+
+    async def upload_video(self, filename, concurrency=None):
+        """
+        Upload a video and return its fid. Same protocol as WeiboComApi.upload_video: up to `concurrency` chunks are
+        in flight at a time, and the last chunk is sent once every other chunk has been acknowledged.
+        """
+        loop = asyncio.get_running_loop()
+        md5, chunk_md5s = await loop.run_in_executor(None, file_digests, filename, self.__chunk_bytes_hint)
+        manifest = None
+        if self.upload_manifest_dir:
+            manifest = UploadManifest.load(self.upload_manifest_dir, filename, md5, self.upload_manifest_ttl)
+
+        if manifest is not None and manifest.resumable:
+            file_token, chunk_bytes = manifest.file_token, manifest.chunk_bytes
+        else:
+            init_info = await self.__upload_init(filename, md5)
+            file_token = init_info['fileToken']
+            chunk_bytes = init_info['length'] * 1024
+            if manifest is not None:
+                manifest.start(file_token, chunk_bytes)
+        if chunk_bytes != self.__chunk_bytes_hint:
+            chunk_md5s = None
+            self.__chunk_bytes_hint = chunk_bytes
+        start_locations = list(range(0, max(getsize(filename), 1), chunk_bytes))
+        section_checks = dict(zip(start_locations, chunk_md5s or []))
+
+        results = {}
+        semaphore = asyncio.Semaphore(concurrency or self.upload_concurrency)
+
+        async def upload(start_location):
+            async with semaphore:
+                results[start_location] = await self.__upload_chunk(filename, file_token, start_location, chunk_bytes,
+                                                                    section_checks.get(start_location))
+            if manifest is not None:
+                manifest.ack(start_location)
+
+        tasks = []
+        for start_location in start_locations[:-1]:
+            if manifest is not None and start_location in manifest.acked:
+                results[start_location] = True
+            else:
+                tasks.append(asyncio.ensure_future(upload(start_location)))
+        try:
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            results[start_locations[-1]] = await self.__upload_chunk(
+                filename, file_token, start_locations[-1], chunk_bytes, section_checks.get(start_locations[-1]))
+        except UploadTokenError:
+            # Other errors keep the manifest, so the next attempt resumes.
+            if manifest is not None:
+                self.logger.warning(f'File token of {filename} was rejected, starting over next time.')
+                manifest.delete()
+            raise
+
+        for start_location in start_locations:
+            if results[start_location] is not True:
+                if manifest is not None:
+                    manifest.delete()
+                return results[start_location]
+        raise RuntimeError(f'No fid returned after uploading all chunks of {filename}.')
+
+    async def __upload_chunk(self, filename, file_token, start_location, chunk_bytes, section_check=None):
+        chunk = await asyncio.get_running_loop().run_in_executor(None, self.__read_chunk, filename, start_location,
+                                                                 chunk_bytes)
+        for attempt in range(self.chunk_retries + 1):
+            try:
+                flag = await self.__upload_data(file_token, start_location, chunk, section_check)
+                if flag is not None:
+                    return flag
+                self.logger.warning(f'Chunk {start_location} of {filename} was not acknowledged '
+                                    f'(attempt {attempt + 1}).')
+            except UploadTokenError:
+                raise
+            except Exception as e:
+                if attempt == self.chunk_retries:
+                    raise
+                self.logger.warning(f'Error uploading chunk {start_location} of {filename} '
+                                    f'(attempt {attempt + 1}): {e}')
+            if attempt < self.chunk_retries:
+                await asyncio.sleep(min(0.5 * 2 ** attempt, 10))
+        raise RuntimeError(f'Unable to upload chunk {start_location} of {filename} '
+                           f'after {self.chunk_retries + 1} attempts.')
+
+    @staticmethod
+    def __read_chunk(filename, start_location, chunk_bytes):
+        with open(filename, 'rb') as f:
+            f.seek(start_location)
+            return f.read(chunk_bytes)
+
+    async def __upload_data(self, file_token, start_location, chunk, section_check=None):
+        params = upload_data_params(file_token, start_location, chunk, section_check)
+        rsp = await self.post(MULTIMEDIA_UPLOAD_DATA_URL, params=params, data=chunk,
+                              timeout=self.client_timeout(10 * self.timeout), operation='upload_video.chunk')
+        return parse_upload_data(await rsp.json(content_type=None))
+
+    async def upload_pic(self, filename):
+        loop = asyncio.get_running_loop()
+        content_hash = None
+        if self.pic_cache is not None:
+            content_hash = await loop.run_in_executor(None, stream_digest, filename)
+            pid = self.pic_cache.get(content_hash, 'weibo.com', self.account)
+            if pid is not None:
+                self.logger.debug(f'Pic {pid} found in cache.')
+                return pid
+
+        with open(filename, 'rb') as f:
+            body = await loop.run_in_executor(None, Base64FormBody, 'b64_data', f)
+
+            async def blocks():
+                # Encoded off the event loop, one block at a time.
+                while True:
+                    block = await loop.run_in_executor(None, body.read, body.block_size)
+                    if not block:
+                        break
+                    yield block
+
+            headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Content-Length': str(body.len)}
+            rsp = await self.post(MULTIMEDIA_UPLOAD_PIC_URL, params=upload_pic_params(), data=blocks(),
+                                  headers=headers, operation='upload_pic')
+            pid = parse_pid(str(rsp.url))
+
+        if self.pic_cache is not None:
+            self.pic_cache.put(content_hash, 'weibo.com', self.account, pid)
+        return pid
+
+    async def post_status(self, caption, video_id, pic_id, tags=None):
+        data = post_status_form(caption, video_id, pic_id, tags)
+        rsp = await self.post(POST_WEIBO_URL, data=data, params=post_status_params(), headers=COMMON_HEADERS,
+                              operation='com.post_status')
+
+        try:
+            rsp_data = await rsp.json(content_type=None)
+        except:
+            raise LoginException(f'Error posting video {caption}. Response: {await rsp.text()}')
+
+        if rsp_data['code'] == '100000':
+            self.logger.info(f'Weibo {caption} is posted.')
+        else:
+            self.logger.error(f'Error posting weibo {caption}. Response: {rsp_data}')
+        return rsp_data
@@ -1,2 +1,25 @@
 class LoginException(Exception):
     pass
+
+
+class VerificationTimeout(LoginException):
+    """A login gave up waiting for a secondary verification code or confirmation."""
+    pass
+
+
+class WeiboApiError(RuntimeError):
+    """A request was answered, but not with success. `rsp_data` holds the decoded response."""
+
+    def __init__(self, message, rsp_data=None):
+        super().__init__(message)
+        self.rsp_data = rsp_data
+
+
+class UploadTokenError(WeiboApiError):
+    """The file token of a chunked upload was rejected, e.g. because it expired. The upload has to start over."""
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    """A request was not sent, because its host failed too often recently."""
+    pass
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_digests(filename, chunk_bytes=None, block_size=BLOCK_SIZE):
+    """
+    MD5 of a whole file, plus the MD5 of each `chunk_bytes` sized chunk if chunk_bytes is given, in a single pass.
+
+    The file is read in blocks of at most block_size bytes, so memory use does not depend on the file size. Blocks
+    never straddle a chunk boundary. An empty file has a single empty chunk.
+
+    :return: (file md5 hex digest, list of chunk md5 hex digests or None)
+    """
+    file_md5 = hashlib.md5()
+    chunk_md5s = None
+    if chunk_bytes:
+        chunk_md5s = []
+        chunk_md5 = hashlib.md5()
+        chunk_left = chunk_bytes
+
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(min(block_size, chunk_left) if chunk_bytes else block_size)
+            if not block:
+                break
+            file_md5.update(block)
+            if chunk_bytes:
+                chunk_md5.update(block)
+                chunk_left -= len(block)
+                if chunk_left == 0:
+                    chunk_md5s.append(chunk_md5.hexdigest())
+                    chunk_md5 = hashlib.md5()
+                    chunk_left = chunk_bytes
+
+    if chunk_bytes and (chunk_left != chunk_bytes or not chunk_md5s):
+        chunk_md5s.append(chunk_md5.hexdigest())
+    return file_md5.hexdigest(), chunk_md5s
+
+
+def stream_digest(data, algorithm='sha1', block_size=BLOCK_SIZE):
+    """
+    Hex digest of a file path, a bytes-like object or a seekable binary stream. Streams are read from their current
+    position in blocks and rewound afterwards.
+    """
+    digest = hashlib.new(algorithm)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(data)
+    elif isinstance(data, (str, os.PathLike)):
+        with open(data, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    else:
+        start = data.tell()
+        for block in iter(lambda: data.read(block_size), b''):
+            digest.update(block)
+        data.seek(start)
+    return digest.hexdigest()
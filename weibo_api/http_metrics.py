@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import logging
+import threading
+from collections import namedtuple
+from urllib.parse import urlparse
+
+# One HTTP request attempt.
+#   operation: logical name, e.g. 'weibo_com_login.prelogin', 'upload_video.chunk' or 'cn.st'
+#   attempt: 1 for the first attempt, higher for retries
+#   status: HTTP status code, None if no response was received
+#   ttfb: seconds until the response headers were parsed, None without a response
+#   total: seconds until the whole response was read, or the request failed
+#   bytes_sent: size of the request body, None if unknown
+#   bytes_received: size of the response body as sent (before decompression if the length is known)
+#   error: exception class name if the request failed
+RequestEvent = namedtuple('RequestEvent', ['operation', 'method', 'url', 'attempt', 'status', 'ttfb', 'total',
+                                           'bytes_sent', 'bytes_received', 'error'])
+
+
+def default_operation(url):
+    parsed = urlparse(url)
+    return f'{parsed.netloc}{parsed.path}'
+
+
+def body_size(body):
+    """Size of a request body, None if it cannot be found without consuming it."""
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    length = getattr(body, 'len', None)
+    if isinstance(length, int):
+        return length
+    return None
+
+
+def response_size(rsp):
+    length = rsp.headers.get('Content-Length')
+    if length is not None and length.isdigit():
+        return int(length)
+    return len(rsp.content)
+
+
+class HttpMetrics(object):
+    """
+    Fan-out point for RequestEvents. Listeners are callables taking a RequestEvent, e.g. a HistogramRecorder or an
+    exporter to a monitoring system. A failing listener is logged and does not affect the request.
+    """
+
+    def __init__(self, listeners=()):
+        self.logger = logging.getLogger(__name__)
+        self.listeners = list(listeners)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+        return listener
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    @property
+    def enabled(self):
+        return bool(self.listeners)
+
+    def emit(self, event):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                self.logger.warning(f'Metrics listener {listener} failed: {e}')
+
+
+class Histogram(object):
+    """Latency histogram with exponentially growing buckets; percentiles are bucket upper bounds."""
+
+    # 5ms to about 82s
+    BOUNDS = tuple(0.005 * 2 ** i for i in range(15))
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+
+class HistogramRecorder(object):
+    """In-process metrics backend: per operation latency histograms, status counts and byte totals."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__operations = {}
+
+    def __call__(self, event):
+        with self.__lock:
+            operation = self.__operations.get(event.operation)
+            if operation is None:
+                operation = {'total': Histogram(), 'ttfb': Histogram(), 'statuses': {}, 'errors': 0, 'retries': 0,
+                             'bytes_sent': 0, 'bytes_received': 0}
+                self.__operations[event.operation] = operation
+            operation['total'].add(event.total)
+            if event.ttfb is not None:
+                operation['ttfb'].add(event.ttfb)
+            if event.status is not None:
+                operation['statuses'][event.status] = operation['statuses'].get(event.status, 0) + 1
+            if event.error is not None:
+                operation['errors'] += 1
+            if event.attempt > 1:
+                operation['retries'] += 1
+            operation['bytes_sent'] += event.bytes_sent or 0
+            operation['bytes_received'] += event.bytes_received or 0
+
+    def summary(self):
+        """Per operation: request count, mean, p50, p90, p99 and max seconds, statuses, errors, retries, bytes."""
+        with self.__lock:
+            return {name: {'count': operation['total'].count,
+                           'mean': operation['total'].sum / operation['total'].count,
+                           'p50': operation['total'].percentile(50),
+                           'p90': operation['total'].percentile(90),
+                           'p99': operation['total'].percentile(99),
+                           'max': operation['total'].max,
+                           'ttfb_p50': operation['ttfb'].percentile(50),
+                           'statuses': dict(operation['statuses']),
+                           'errors': operation['errors'],
+                           'retries': operation['retries'],
+                           'bytes_sent': operation['bytes_sent'],
+                           'bytes_received': operation['bytes_received']}
+                    for name, operation in self.__operations.items()}
+
+    def slowest(self, n=5):
+        """The n operations with the highest p90 latency."""
+        return sorted(self.summary().items(), key=lambda item: item[1]['p90'], reverse=True)[:n]
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from .hashing import stream_digest
+
+
+class ImageCompressor(object):
+    """
+    Re-encodes pictures as JPEG no larger than max_bytes, with as little quality loss as a bounded search allows.
+
+    The search starts at initial_quality and bisects the JPEG quality within [min_quality, max_quality]. If even
+    min_quality is too large, the picture is downscaled by the estimated factor and the search restarts. At most
+    max_attempts encodes are spent on the search; after that the picture is shrunk at min_quality until it fits.
+    JPEG sources are decoded at reduced resolution (PIL draft mode) when downscaling.
+
+    Results are kept in a size-bounded in-memory LRU cache and, if cache_dir is set, on disk, keyed by the SHA-1 of
+    the source and max_bytes.
+    """
+
+    # Stop bisecting once the quality interval is this narrow.
+    QUALITY_TOLERANCE = 5
+
+    def __init__(self, max_bytes=5000000, min_quality=40, max_quality=95, initial_quality=85, max_attempts=6,
+                 cache_bytes=64 * 1024 * 1024, cache_dir=None):
+        self.logger = logging.getLogger(__name__)
+        self.max_bytes = max_bytes
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.initial_quality = initial_quality
+        self.max_attempts = max_attempts
+        self.cache_bytes = cache_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.__cache = OrderedDict()
+        self.__cached_bytes = 0
+        self.__lock = threading.Lock()
+
+    def compress(self, source):
+        """
+        :param source: a file path, a bytes-like object or a seekable binary stream
+        :return: JPEG bytes no larger than max_bytes
+        """
+        key = f'{stream_digest(source)}-{self.max_bytes}'
+        data = self.__cache_get(key)
+        if data is not None:
+            return data
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = BytesIO(source)
+        start = None if isinstance(source, (str, os.PathLike)) else source.tell()
+        data, attempts = self.__search(source, start)
+        if start is not None:
+            source.seek(start)
+        self.logger.debug(f'Compressed picture to {len(data)} bytes in {attempts} encodes.')
+        self.__cache_put(key, data)
+        return data
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def __search(self, source, start):
+        scale = 1.0
+        image = self.__decode(source, start, scale)
+        quality = self.initial_quality
+        fits = too_big = None  # highest quality known to fit, lowest quality known to be too big
+        best = None
+        attempts = 0
+        while attempts < self.max_attempts:
+            data = self.__encode(image, quality)
+            attempts += 1
+            if len(data) <= self.max_bytes:
+                best, fits = data, quality
+            elif quality <= self.min_quality or (fits is None and len(data) > 2 * self.max_bytes):
+                # Lowering the quality alone is unlikely to be enough; downscale and search again.
+                scale *= self.__scale_factor(len(data))
+                image = self.__decode(source, start, scale)
+                fits = too_big = None
+                quality = self.initial_quality
+                continue
+            else:
+                too_big = quality
+
+            if best is not None and (too_big or self.max_quality + 1) - fits <= self.QUALITY_TOLERANCE:
+                break
+            low = self.min_quality if fits is None else fits
+            high = self.max_quality if too_big is None else too_big - 1
+            quality = (low + high + 1) // 2
+
+        while best is None:
+            # Search budget is spent; shrink at the lowest quality until it fits.
+            data = self.__encode(image, self.min_quality)
+            attempts += 1
+            if len(data) <= self.max_bytes:
+                best = data
+            else:
+                scale *= self.__scale_factor(len(data))
+                image = self.__decode(source, start, scale)
+        return best, attempts
+
+    def __scale_factor(self, size):
+        # JPEG size is roughly proportional to the pixel count; aim a little below the limit.
+        return min(math.sqrt(self.max_bytes / size) * 0.95, 0.95)
+
+    @staticmethod
+    def __decode(source, start, scale):
+        # Imported here, so importing weibo_api does not load PIL.
+        from PIL import Image
+
+        if start is not None:
+            source.seek(start)
+        image = Image.open(source)
+        size = (max(int(image.width * scale), 1), max(int(image.height * scale), 1))
+        if scale < 1 and image.format == 'JPEG':
+            # Let the JPEG decoder skip detail that is thrown away anyway (1/2, 1/4 or 1/8 scale DCT).
+            image.draft('RGB', size)
+        image = image.convert('RGB')
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+        return image
+
+    @staticmethod
+    def __encode(image, quality):
+        with BytesIO() as buffer:
+            image.save(buffer, 'JPEG', quality=quality, optimize=True)
+            return buffer.getvalue()
+
+    def __cache_get(self, key):
+        with self.__lock:
+            data = self.__cache.get(key)
+            if data is not None:
+                self.__cache.move_to_end(key)
+                self.hits += 1
+                return data
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, key + '.jpg')
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                with self.__lock:
+                    self.hits += 1
+                self.__cache_put(key, data, persist=False)
+                return data
+        with self.__lock:
+            self.misses += 1
+        return None
+
+    def __cache_put(self, key, data, persist=True):
+        with self.__lock:
+            if key not in self.__cache and len(data) <= self.cache_bytes:
+                self.__cache[key] = data
+                self.__cached_bytes += len(data)
+                while self.__cached_bytes > self.cache_bytes:
+                    _, evicted = self.__cache.popitem(last=False)
+                    self.__cached_bytes -= len(evicted)
+        if persist and self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = os.path.join(self.cache_dir, key + '.jpg')
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCacheBackend(object):
+    """In-process LRU storage."""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, expires_at, now, max_entries):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class FileCacheBackend(MemoryCacheBackend):
+    """
+    LRU storage persisted to a local JSON file. The file is rewritten atomically on every insert; recency updates
+    from lookups are persisted along with the next insert.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = OrderedDict((key, tuple(entry)) for key, entry in json.load(f))
+
+    def set(self, key, value, expires_at, now, max_entries):
+        super().set(key, value, expires_at, now, max_entries)
+        with self.lock:
+            data = json.dumps(list(self.entries.items()))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class SqliteCacheBackend(object):
+    """LRU storage in a SQLite database, which can be shared by several processes."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS pic_cache '
+                                    '(key TEXT PRIMARY KEY, value TEXT, expires_at REAL, last_used REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS pic_cache_last_used ON pic_cache (last_used)')
+
+    def get(self, key, now):
+        with self.lock:
+            row = self.connection.execute('SELECT value, expires_at FROM pic_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self.connection.execute('DELETE FROM pic_cache WHERE key = ?', (key,))
+                return None
+            self.connection.execute('UPDATE pic_cache SET last_used = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def set(self, key, value, expires_at, now, max_entries):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO pic_cache VALUES (?, ?, ?, ?)',
+                                    (key, value, expires_at, now))
+            self.connection.execute('DELETE FROM pic_cache WHERE key IN '
+                                    '(SELECT key FROM pic_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                                    (max_entries,))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM pic_cache').fetchone()[0]
+
+
+class PicIdCache(object):
+    """
+    Maps (content hash, api, account) to the pic_id/pid returned by an upload, so identical pictures are only
+    uploaded once per account. Entries expire after `ttl` seconds; the least recently used entries are evicted beyond
+    `max_entries`.
+    """
+
+    def __init__(self, backend=None, ttl=7 * 24 * 3600, max_entries=10000, clock=time.time):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, content_hash, api, account):
+        pic_id = self.backend.get(self.__key(content_hash, api, account), self.clock())
+        if pic_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return pic_id
+
+    def put(self, content_hash, api, account, pic_id):
+        now = self.clock()
+        self.backend.set(self.__key(content_hash, api, account), pic_id, now + self.ttl, now, self.max_entries)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    @staticmethod
+    def __key(content_hash, api, account):
+        return f'{api}:{account or ""}:{content_hash}'
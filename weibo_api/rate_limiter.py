@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket: tokens accrue at `rate` per second up to `capacity`, so after an idle period up to
+    `capacity` calls go through at once and the sustained rate is `rate`.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        if rate <= 0 or capacity < 1:
+            raise ValueError(f'rate has to be positive and capacity at least 1. rate: {rate}, capacity: {capacity}')
+        self.capacity = capacity
+        self.clock = clock
+        self.__rate = rate
+        self.__tokens = capacity
+        self.__updated = clock()
+        self.__lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.__rate
+
+    @rate.setter
+    def rate(self, rate):
+        with self.__lock:
+            # Tokens accrued so far count at the old rate.
+            self.__refill()
+            self.__rate = rate
+
+    def delay(self):
+        """Seconds until a token is available, 0 if one is available now."""
+        with self.__lock:
+            self.__refill()
+            return max(0, (1 - self.__tokens) / self.__rate)
+
+    def try_acquire(self):
+        """Take a token if one is available now."""
+        with self.__lock:
+            self.__refill()
+            if self.__tokens < 1:
+                return False
+            self.__tokens -= 1
+            return True
+
+    def acquire(self, sleep=time.sleep):
+        """Wait for a token and take it."""
+        while not self.try_acquire():
+            sleep(self.delay())
+
+    def __refill(self):
+        now = self.clock()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.__rate)
+        self.__updated = now
@@ -1,41 +1,74 @@
 # -*- coding: utf-8 -*-
 
+import itertools
 import logging
+import time
 
-import requests
-from requests_toolbelt.utils import dump
+from .http_metrics import HttpMetrics, RequestEvent, body_size, default_operation, response_size
+from .retry_policy import RetryPolicy
+from .session_factory import SessionFactory
+from .wire_trace import WireTrace
 
 
 class RequestsWrapper(object):
-    session = requests.session()
+    # Set per instance by the subclasses, so accounts never share cookies or connection pools.
+    session = None
     logger = logging.getLogger(__name__)
+    wire_trace = WireTrace()
+    # Shared by default, so every client sees the same per-host circuit breakers. None disables retries.
+    retry_policy = RetryPolicy()
+    # Shared by default, so one listener sees the requests of every client.
+    http_metrics = HttpMetrics()
 
-    def get(self, *args, **kwargs):
-        rsp = self.session.get(*args, **kwargs)
-        data = dump.dump_all(rsp)
-        try:
-            # python 2
-            # self.logger.debug(unicode(bytes(data), errors='ignore'))
-            # python 3
-            # py3 uses system default EOL (end of line) character
-            # In windows, it is \r\n, and the dumped data has characters '\r\n', and it will
-            # automatically changed to \r\r\n when writing to the file.
-            # So we need call an additional replace to fix the problem.
-            data_str = str(bytes(data), encoding='utf-8', errors='ignore').replace('\r\n', '\n')
-            self.logger.debug(data_str)
-        except:
-            self.logger.debug(data)
+    def get(self, *args, session=None, **kwargs):
+        return self.__send((session or self.session).get, 'GET', *args, **kwargs)
+
+    def post(self, *args, session=None, **kwargs):
+        return self.__send((session or self.session).post, 'POST', *args, **kwargs)
+
+    def __send(self, send, method, url, *args, idempotent=None, operation=None, **kwargs):
+        """
+        :param session: requests session to send with instead of self.session
+        :param idempotent: True if a non-idempotent method (POST) is safe to repeat, e.g. for an upload chunk
+        :param operation: logical name of the call reported to http_metrics, e.g. 'cn.st'
+        """
+        if self.http_metrics.enabled:
+            attempts = itertools.count(1)
+            operation = operation or default_operation(url)
+            attempt = lambda: self.__measured(send, method, url, operation, next(attempts), args, kwargs)
+        else:
+            attempt = lambda: send(url, *args, **kwargs)
+
+        if self.retry_policy is None:
+            rsp = attempt()
+        else:
+            replayable = self.__replayable(kwargs.get('data')) and not kwargs.get('files')
+            rsp = self.retry_policy.call(attempt, method, url, idempotent, replayable)
+        self.wire_trace.log(self.logger, rsp)
         return rsp
 
-    def post(self, *args, **kwargs):
-        rsp = self.session.post(*args, **kwargs)
-        data = dump.dump_all(rsp)
+    def __measured(self, send, method, url, operation, attempt, args, kwargs):
+        # Measured up front, as streamed bodies are consumed (and their len drops to 0) while they are sent.
+        bytes_sent = body_size(kwargs.get('data'))
+        start = time.perf_counter()
         try:
-            # python 2
-            # self.logger.debug(unicode(bytes(data), errors='ignore'))
-            # python 3
-            data_str = str(bytes(data), encoding='utf-8', errors='ignore').replace('\r\n', '\n')
-            self.logger.debug(data_str)
-        except:
-            self.logger.debug(data)
+            rsp = send(url, *args, **kwargs)
+        except Exception as e:
+            self.http_metrics.emit(RequestEvent(operation, method, url, attempt, None, None,
+                                                time.perf_counter() - start, bytes_sent, 0, type(e).__name__))
+            raise
+        total = time.perf_counter() - start
+        body = (rsp.history[0] if rsp.history else rsp).request.body
+        if isinstance(body, (bytes, str)):
+            bytes_sent = len(body)
+        self.http_metrics.emit(RequestEvent(operation, method, url, attempt, rsp.status_code,
+                                            rsp.elapsed.total_seconds(), total, bytes_sent, response_size(rsp), None))
         return rsp
+
+    @staticmethod
+    def __replayable(data):
+        # Streams and iterators are consumed by the first attempt.
+        return data is None or isinstance(data, (bytes, bytearray, str, dict, list, tuple))
+
+    def connection_stats(self):
+        return SessionFactory.stats(self.session)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from requests.exceptions import ConnectionError, Timeout
+
+from .exceptions import CircuitOpenError
+from .rate_limiter import TokenBucket
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+
+class CircuitBreaker(object):
+    """
+    Fails calls to a host fast after `failure_threshold` consecutive failures. After `reset_timeout` seconds one
+    trial call is let through: success closes the circuit again, failure keeps it open for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.__lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if self.clock() >= self.opened_at + self.reset_timeout else 'open'
+
+    def allow(self):
+        with self.__lock:
+            if self.opened_at is None:
+                return True
+            if self.__trial or self.clock() < self.opened_at + self.reset_timeout:
+                return False
+            self.__trial = True
+            return True
+
+    def record_success(self):
+        with self.__lock:
+            self.failures = 0
+            self.opened_at = None
+            self.__trial = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.failures += 1
+            if self.__trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self.__trial = False
+
+
+class RetryPolicy(object):
+    """
+    Retries requests that failed with a connection error, a timeout or a RETRY_STATUSES response.
+
+    Only calls that are safe to repeat are retried: idempotent methods, and POSTs the caller marks with
+    `idempotent=True` (e.g. an upload chunk re-sent to the same startloc). Streamed bodies are never retried, since
+    they cannot be replayed.
+
+    Retries wait an exponential backoff with full jitter. Each endpoint (host and path) has a budget of `budget`
+    retries per `budget_window` seconds, overridable per endpoint with endpoint_budgets, so a failing endpoint is not
+    hammered. Every host has a CircuitBreaker; calls to an open circuit raise CircuitOpenError without being sent.
+    """
+
+    def __init__(self, max_attempts=3, backoff_base=0.5, backoff_max=10, budget=20, budget_window=60,
+                 endpoint_budgets=None, failure_threshold=5, reset_timeout=30, retry_statuses=RETRY_STATUSES,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.logger = logging.getLogger(__name__)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget
+        self.budget_window = budget_window
+        self.endpoint_budgets = endpoint_budgets or {}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry_statuses = retry_statuses
+        self.clock = clock
+        self.sleep = sleep
+        self.__lock = threading.Lock()
+        self.__breakers = {}
+        self.__budgets = {}
+        self.__stats = {'retries': 0, 'retry_seconds': 0.0, 'budget_exhausted': 0, 'circuit_open': 0,
+                        'endpoints': {}}
+
+    def call(self, send, method, url, idempotent=None, replayable=True):
+        """
+        :param send: function sending the request once and returning the response
+        :param idempotent: whether the call is safe to repeat, by default whether the method is idempotent
+        :param replayable: False if the body cannot be sent twice
+        """
+        parsed = urlparse(url)
+        endpoint = f'{parsed.netloc}{parsed.path}'
+        breaker = self.breaker(parsed.netloc)
+        retryable = replayable and (method.upper() in IDEMPOTENT_METHODS if idempotent is None else idempotent)
+        first_failure = None
+        attempt = 1
+        while True:
+            if not breaker.allow():
+                with self.__lock:
+                    self.__stats['circuit_open'] += 1
+                raise CircuitOpenError(f'Circuit for {parsed.netloc} is open, not sending {method} {endpoint}.')
+            try:
+                rsp = send()
+            except (ConnectionError, Timeout) as e:
+                breaker.record_failure()
+                if not self.__retry(retryable, attempt, endpoint):
+                    self.__record_retry_time(first_failure)
+                    raise
+                self.logger.warning(f'{method} {endpoint} failed (attempt {attempt}), retrying: {e}')
+            except BaseException:
+                # Any other error (e.g. ChunkedEncodingError, KeyboardInterrupt) still ends a half-open trial.
+                breaker.record_failure()
+                self.__record_retry_time(first_failure)
+                raise
+            else:
+                if rsp.status_code not in self.retry_statuses:
+                    breaker.record_success()
+                    self.__record_retry_time(first_failure)
+                    return rsp
+                breaker.record_failure()
+                if not self.__retry(retryable, attempt, endpoint):
+                    self.__record_retry_time(first_failure)
+                    return rsp
+                self.logger.warning(f'{method} {endpoint} returned {rsp.status_code} (attempt {attempt}), retrying.')
+                rsp.close()
+            if first_failure is None:
+                first_failure = self.clock()
+            self.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def backoff(self, attempt):
+        """Seconds to wait after failed attempt number `attempt`: exponential, with full jitter."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def breaker(self, host):
+        with self.__lock:
+            breaker = self.__breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout, self.clock)
+                self.__breakers[host] = breaker
+            return breaker
+
+    @property
+    def stats(self):
+        with self.__lock:
+            stats = dict(self.__stats, endpoints=dict(self.__stats['endpoints']))
+            stats['circuits'] = {host: breaker.state for host, breaker in self.__breakers.items()}
+            return stats
+
+    def __retry(self, retryable, attempt, endpoint):
+        if not retryable or attempt >= self.max_attempts:
+            return False
+        with self.__lock:
+            budget = self.__budgets.get(endpoint)
+            size = self.endpoint_budgets.get(endpoint, self.budget)
+            if budget is None and size > 0:
+                budget = TokenBucket(size / self.budget_window, size, self.clock)
+                self.__budgets[endpoint] = budget
+            if budget is None or not budget.try_acquire():
+                self.__stats['budget_exhausted'] += 1
+                self.logger.warning(f'Retry budget of {endpoint} is exhausted.')
+                return False
+            self.__stats['retries'] += 1
+            self.__stats['endpoints'][endpoint] = self.__stats['endpoints'].get(endpoint, 0) + 1
+            return True
+
+    def __record_retry_time(self, first_failure):
+        if first_failure is not None:
+            with self.__lock:
+                self.__stats['retry_seconds'] += self.clock() - first_failure
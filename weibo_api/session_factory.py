@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connection pool size per host. Upload hosts get larger pools since chunks and pictures may be sent concurrently.
+DEFAULT_HOST_POOL_SIZES = {
+    'm.weibo.cn': 10,
+    'fileplatform.api.weibo.com': 10,
+    'picupload.weibo.com': 10,
+    'login.sina.com.cn': 2,
+}
+
+
+class PoolStatsAdapter(HTTPAdapter):
+    """HTTPAdapter that reports how many requests were served over reused connections."""
+
+    def stats(self):
+        num_requests = num_connections = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+        return {
+            'requests': num_requests,
+            'connections': num_connections,
+            'reused': max(num_requests - num_connections, 0),
+        }
+
+
+class SessionFactory(object):
+    """
+    Builds isolated requests sessions, one per account, with connection pools sized per host.
+
+    host_pool_sizes maps a host name to its pool size and is merged over DEFAULT_HOST_POOL_SIZES. Other hosts use
+    pool_maxsize.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, host_pool_sizes=None, pool_block=False, max_retries=0):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.host_pool_sizes = dict(DEFAULT_HOST_POOL_SIZES)
+        self.host_pool_sizes.update(host_pool_sizes or {})
+
+    def create(self):
+        session = requests.Session()
+        self.mount(session)
+        return session
+
+    def mount(self, session):
+        """(Re)mount pooled adapters on an existing session, e.g. one loaded from a session file."""
+        for scheme in ('https://', 'http://'):
+            session.mount(scheme, self.__adapter(self.pool_maxsize))
+            for host, pool_size in self.host_pool_sizes.items():
+                # The trailing slash keeps the prefix from matching other hosts, e.g. m.weibo.cn.example.com
+                session.mount(f'{scheme}{host}/', self.__adapter(pool_size))
+        return session
+
+    def __adapter(self, pool_maxsize):
+        return PoolStatsAdapter(pool_connections=self.pool_connections, pool_maxsize=pool_maxsize,
+                                pool_block=self.pool_block, max_retries=self.max_retries)
+
+    @staticmethod
+    def stats(session):
+        """Connection reuse statistics keyed by adapter prefix. Adapters that were never used are skipped."""
+        stats = {}
+        for prefix, adapter in session.adapters.items():
+            if isinstance(adapter, PoolStatsAdapter):
+                adapter_stats = adapter.stats()
+                if adapter_stats['requests']:
+                    stats[prefix] = adapter_stats
+        return stats
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import LoginException
+
+# Session states:
+#   unloaded: never checked; the client is created on the first check
+#   warm: logged in at the last check, no older than max_age
+#   stale: not logged in, or the session file is missing or invalid; needs a new login, then reload()
+#   error: the last check failed (e.g. network error); checked again after a backoff
+#   expired: warm, but last checked more than max_age ago (only reported, by states)
+UNLOADED, WARM, STALE, ERROR, EXPIRED = 'unloaded', 'warm', 'stale', 'error', 'expired'
+
+
+def default_client_factory(account, session_file):
+    from .weibo_cn_api import WeiboCnApi
+
+    return WeiboCnApi(weibo_session_file=session_file, account=account)
+
+
+class _Session(object):
+
+    def __init__(self, session_file):
+        self.session_file = session_file
+        self.client = None
+        self.state = UNLOADED
+        self.checking = False
+        self.checked_at = None
+        self.retry_at = 0
+        self.failures = 0
+        self.last_acquired = 0
+        self.error = None
+
+
+class SessionPool(object):
+    """
+    Clients for many accounts, handed out only when their session was recently validated.
+
+    Session files are loaded lazily, by their first health check. Checks run in the background (see start()), at
+    most check_concurrency at a time: unloaded sessions are checked right away, warm ones again once they are
+    refresh_after seconds old, and failed checks after an exponential backoff. A session is warm for max_age seconds
+    after a successful check. Sessions that are not logged in become stale and are passed to on_stale(account), e.g.
+    to log in again; after that, reload(account) puts the account back into rotation.
+
+    :param accounts: mapping from account name to its session file
+    :param client_factory: builds the client of an account from (account, session_file), a WeiboCnApi by default
+    :param health_check: returns whether a client is logged in, client.is_login() by default. Should be cheap;
+        WeiboCnApi.is_login also refreshes the st token, so a warm client posts without fetching one.
+    """
+
+    def __init__(self, accounts, **kwargs):
+        self.logger = logging.getLogger(__name__)
+
+        self.client_factory = kwargs.get('client_factory', default_client_factory)
+        self.health_check = kwargs.get('health_check', lambda client: client.is_login())
+        self.on_stale = kwargs.get('on_stale', None)
+        self.max_age = kwargs.get('max_age', 600)
+        self.refresh_after = kwargs.get('refresh_after', self.max_age / 2)
+        self.check_concurrency = kwargs.get('check_concurrency', 4)
+        self.check_interval = kwargs.get('check_interval', 5)
+        self.backoff_base = kwargs.get('backoff_base', 30)
+        self.backoff_max = kwargs.get('backoff_max', 600)
+        self.clock = kwargs.get('clock', time.monotonic)
+
+        self.__condition = threading.Condition()
+        self.__sessions = {account: _Session(session_file) for account, session_file in accounts.items()}
+        self.__executor = None
+        self.__worker = None
+        self.__closed = False
+        self.__stats = {'checks': 0, 'check_failures': 0, 'stale': 0, 'acquired': 0, 'acquire_misses': 0}
+
+    def add(self, account, session_file):
+        with self.__condition:
+            self.__sessions[account] = _Session(session_file)
+            self.__condition.notify_all()
+
+    def start(self):
+        """Run health checks in the background until close()."""
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError('SessionPool is closed.')
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__run, name='session-pool', daemon=True)
+                self.__worker.start()
+        return self
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            worker, self.__worker = self.__worker, None
+            executor, self.__executor = self.__executor, None
+            self.__condition.notify_all()
+        if worker is not None:
+            worker.join()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def warm_up(self, accounts=None):
+        """Check the given (by default all) unloaded, errored or aging sessions now. Returns the warm accounts."""
+        with self.__condition:
+            names = list(self.__sessions) if accounts is None else list(accounts)
+            due = [name for name in names if self.__due(self.__sessions[name], self.clock(), force=True)]
+            futures = [self.__schedule(name) for name in due]
+        for future in futures:
+            future.result()
+        with self.__condition:
+            return [name for name in names if self.__is_warm(self.__sessions[name], self.clock())]
+
+    def acquire(self, account=None, timeout=0):
+        """
+        A warm client: of `account`, or else of the warm account acquired least recently. Waits up to `timeout`
+        seconds for one to become warm, checking an unloaded or errored account right away.
+
+        :raise LoginException: if the session of `account` is stale
+        :raise RuntimeError: if no session became warm in time
+        """
+        deadline = self.clock() + timeout
+        with self.__condition:
+            while True:
+                now = self.clock()
+                name = self.__warm_account(account, now)
+                if name is not None:
+                    session = self.__sessions[name]
+                    self.__stats['acquired'] += 1
+                    session.last_acquired = self.__stats['acquired']
+                    return session.client
+                if account is not None and self.__sessions[account].state == STALE:
+                    self.__stats['acquire_misses'] += 1
+                    raise LoginException(f'Session of {account} is stale, log in again.')
+                for name in ([account] if account is not None else list(self.__sessions)):
+                    if self.__due(self.__sessions[name], now, force=True) and timeout > 0:
+                        self.__schedule(name)
+                if now >= deadline:
+                    self.__stats['acquire_misses'] += 1
+                    raise RuntimeError(f'No warm session{" of " + account if account else ""} available.')
+                self.__condition.wait(deadline - now)
+
+    def mark_stale(self, account, error=None):
+        """Report a session that turned out not to be logged in, e.g. after a LoginException."""
+        with self.__condition:
+            self.__set_stale(account, self.__sessions[account], error)
+
+    def reload(self, account, session_file=None):
+        """Load the session file of `account` again, e.g. after a new login, and check it."""
+        with self.__condition:
+            session = self.__sessions[account]
+            self.__sessions[account] = _Session(session_file or session.session_file)
+            self.__condition.notify_all()
+
+    @property
+    def states(self):
+        with self.__condition:
+            now = self.clock()
+            return {name: EXPIRED if session.state == WARM and not self.__is_warm(session, now) else session.state
+                    for name, session in self.__sessions.items()}
+
+    @property
+    def stats(self):
+        states = self.states
+        with self.__condition:
+            stats = dict(self.__stats, checking=sum(session.checking for session in self.__sessions.values()))
+        for state in (UNLOADED, WARM, STALE, ERROR, EXPIRED):
+            stats[state] = sum(1 for value in states.values() if value == state)
+        return stats
+
+    def __run(self):
+        with self.__condition:
+            while not self.__closed:
+                now = self.clock()
+                for name, session in self.__sessions.items():
+                    if self.__due(session, now):
+                        self.__schedule(name)
+                self.__condition.wait(self.check_interval)
+
+    def __due(self, session, now, force=False):
+        if session.checking or session.state == STALE:
+            return False
+        if session.state == ERROR:
+            return now >= session.retry_at
+        if session.state == UNLOADED:
+            return True
+        # Warm sessions are refreshed before they expire; forced checks renew any that already expired.
+        return now - session.checked_at >= (self.max_age if force else self.refresh_after)
+
+    def __schedule(self, name):
+        if self.__closed:
+            raise RuntimeError('SessionPool is closed.')
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.check_concurrency,
+                                                 thread_name_prefix='session-check')
+        session = self.__sessions[name]
+        session.checking = True
+        return self.__executor.submit(self.__check, name, session)
+
+    def __check(self, name, session):
+        try:
+            if session.client is None:
+                session.client = self.client_factory(name, session.session_file)
+            ok = self.health_check(session.client)
+            error = None if ok else LoginException('Not logged in.')
+        except (LoginException, ValueError) as e:
+            # ValueError: the session file is missing or invalid
+            ok, error = False, e
+        except Exception as e:
+            self.logger.warning(f'Health check of {name} failed: {e}')
+            with self.__condition:
+                session.checking = False
+                session.failures += 1
+                session.state = ERROR
+                session.error = e
+                session.retry_at = self.clock() + min(self.backoff_base * 2 ** (session.failures - 1),
+                                                      self.backoff_max)
+                self.__stats['checks'] += 1
+                self.__stats['check_failures'] += 1
+                self.__condition.notify_all()
+            return
+        with self.__condition:
+            session.checking = False
+            self.__stats['checks'] += 1
+            if self.__sessions.get(name) is not session:
+                return  # reloaded meanwhile
+            if ok:
+                session.state = WARM
+                session.checked_at = self.clock()
+                session.failures = 0
+                session.error = None
+            else:
+                self.__set_stale(name, session, error)
+            self.__condition.notify_all()
+
+    def __set_stale(self, name, session, error):
+        if session.state == STALE:
+            return
+        self.logger.warning(f'Session of {name} is stale: {error}')
+        session.state = STALE
+        session.error = error
+        self.__stats['stale'] += 1
+        self.__condition.notify_all()
+        if self.on_stale is not None:
+            # Run outside the lock, as it may log in and call reload().
+            threading.Thread(target=self.on_stale, args=(name,), daemon=True).start()
+
+    def __is_warm(self, session, now):
+        return session.state == WARM and now - session.checked_at < self.max_age
+
+    def __warm_account(self, account, now):
+        if account is not None:
+            return account if self.__is_warm(self.__sessions[account], now) else None
+        warm = [(session.last_acquired, name) for name, session in self.__sessions.items()
+                if self.__is_warm(session, now)]
+        return min(warm)[1] if warm else None
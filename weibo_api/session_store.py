@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from http.cookiejar import Cookie
+
+from requests.cookies import RequestsCookieJar
+
+FORMAT_VERSION = 1
+# Cookie attributes kept in session files; the *_specified flags are derived from them.
+COOKIE_FIELDS = ('version', 'name', 'value', 'port', 'domain', 'path', 'secure', 'expires', 'discard', 'rest')
+
+
+def cookie_to_dict(cookie):
+    data = {field: getattr(cookie, field) for field in COOKIE_FIELDS if field != 'rest'}
+    data['rest'] = dict(cookie._rest)
+    return data
+
+
+def cookie_from_dict(data):
+    # Built directly rather than with requests' create_cookie, which is several times slower.
+    domain = data['domain']
+    path = data.get('path', '/')
+    port = data.get('port')
+    return Cookie(data.get('version', 0), data['name'], data['value'], port, bool(port), domain, bool(domain),
+                  domain.startswith('.'), path, bool(path), data.get('secure', False), data.get('expires'),
+                  data.get('discard', True), None, None, data.get('rest', {'HttpOnly': None}))
+
+
+def cookie_key(cookie):
+    return cookie.domain, cookie.path, cookie.name
+
+
+class SessionStore(object):
+    """
+    Reads and writes session files: the cookies of a requests session as JSON, with their expiry. Expired cookies are
+    dropped on load and save.
+
+    Files are replaced atomically and are only rewritten when the cookies changed. update() merges cookies into a
+    file instead of replacing it, e.g. for a client that only refreshed some of them.
+
+    Session files of older versions are pickled requests sessions. With migrate_pickle, they are still loaded and
+    rewritten as JSON; unpickling runs arbitrary code, so only enable it for files you trust.
+    """
+
+    def __init__(self, migrate_pickle=True, clock=time.time):
+        self.logger = logging.getLogger(__name__)
+        self.migrate_pickle = migrate_pickle
+        self.clock = clock
+        self.__lock = threading.RLock()
+
+    def load_cookies(self, path):
+        """RequestsCookieJar of a session file, None if there is no file."""
+        return self.__read(path, RequestsCookieJar())
+
+    def load(self, path, session):
+        """Fill `session` with the cookies of a session file. Returns the session, or None if there is no file."""
+        if self.__read(path, session.cookies) is None:
+            return None
+        return session
+
+    def __read(self, path, cookies):
+        if not path or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            content = f.read()
+        loaded = self.__from_json(content) if content.lstrip()[:1] == b'{' else self.__migrate(path, content)
+        for cookie in loaded:
+            if not self.__expired(cookie):
+                cookies.set_cookie(cookie)
+        return cookies
+
+    def save(self, path, session):
+        """Replace a session file with the cookies of a session (or cookie jar). Returns whether it was written."""
+        cookies = getattr(session, 'cookies', session)
+        with self.__lock:
+            return self.__write(path, [cookie for cookie in cookies if not self.__expired(cookie)])
+
+    def update(self, path, session):
+        """Merge the cookies of a session (or cookie jar) into a session file. Returns whether it was written."""
+        cookies = getattr(session, 'cookies', session)
+        with self.__lock:
+            merged = {cookie_key(cookie): cookie for cookie in (self.load_cookies(path) or [])}
+            merged.update((cookie_key(cookie), cookie) for cookie in cookies)
+            return self.__write(path, [cookie for cookie in merged.values() if not self.__expired(cookie)])
+
+    def __expired(self, cookie):
+        return cookie.expires is not None and cookie.expires <= self.clock()
+
+    def __write(self, path, cookies):
+        cookies = sorted((cookie_to_dict(cookie) for cookie in cookies),
+                         key=lambda cookie: (cookie['domain'], cookie['path'], cookie['name']))
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            if content.lstrip()[:1] == b'{' and json.loads(content.decode('utf-8')).get('cookies') == cookies:
+                return False
+        data = {'version': FORMAT_VERSION, 'saved_at': self.clock(), 'cookies': cookies}
+        directory = os.path.dirname(os.path.abspath(path))
+        # mkstemp creates the file readable by the owner only, as it holds login cookies.
+        fd, tmp_path = tempfile.mkstemp(prefix='.session-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.logger.info(f'Dumped session file to {path}')
+        return True
+
+    @staticmethod
+    def __from_json(content):
+        data = json.loads(content.decode('utf-8'))
+        if data.get('version') != FORMAT_VERSION:
+            raise ValueError(f'Unsupported session file version {data.get("version")}.')
+        return [cookie_from_dict(cookie) for cookie in data['cookies']]
+
+    def __migrate(self, path, content):
+        if not self.migrate_pickle:
+            raise ValueError(f'{path} is a pickled session file, and migrate_pickle is disabled.')
+        self.logger.info(f'Migrating pickled session file {path} to JSON')
+        loaded = pickle.loads(content)
+        cookies = list(getattr(loaded, 'cookies', loaded))
+        try:
+            with self.__lock:
+                self.__write(path, [cookie for cookie in cookies if not self.__expired(cookie)])
+        except OSError as e:
+            self.logger.warning(f'Could not rewrite {path} as JSON: {e}')
+        return cookies
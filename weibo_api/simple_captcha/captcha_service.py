@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+from ..http_metrics import Histogram
+from .sample_store import CaptchaLabel
+
+# Frames are a 4-byte big-endian length followed by the payload. Request payloads start with an opcode, response
+# payloads with a status. Labels travel with the id of their saved sample, if any, after a space.
+_FRAME_HEADER = struct.Struct('>I')
+_OP_PREDICT = b'P'
+_OP_REPORT = b'R'
+_STATUS_OK = b'0'
+_STATUS_ERROR = b'1'
+
+
+class CaptchaBatcher(object):
+    """
+    Shares one captcha model between threads and groups concurrent predictions into micro-batches: a batch is run
+    once it holds max_batch_size captchas, or max_wait seconds after its first captcha arrived, with one forward pass
+    through the model's predict_batch.
+
+    Has the interface of WeiboComCaptcha, so one instance can be passed as captcha_cracker to many WeiboLoginApi
+    instances. The model is built by `model_factory` (WeiboComCaptcha by default) on the first batch, and needs
+    predict_batch(ims_bytes, return_exceptions=True) like WeiboComCaptcha.predict_batch.
+    """
+
+    def __init__(self, model=None, model_factory=None, max_batch_size=16, max_wait=0.01):
+        self.logger = logging.getLogger(__name__)
+        self.model_factory = model_factory
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.__model = model
+        self.__model_lock = threading.Lock()
+        self.__requests = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__worker = None
+        self.__closed = False
+        self.__latency = Histogram()
+        self.__queue_wait = Histogram()
+        self.__batch_sizes = {}
+        self.__errors = 0
+
+    @property
+    def model(self):
+        with self.__model_lock:
+            if self.__model is None:
+                if self.model_factory is None:
+                    from .weibo_com_captcha import WeiboComCaptcha
+                    self.model_factory = WeiboComCaptcha
+                self.__model = self.model_factory()
+            return self.__model
+
+    def predict(self, im_bytes, timeout=None):
+        return self.submit(im_bytes).result(timeout)
+
+    def submit(self, im_bytes):
+        """Queue a captcha; returns a Future resolving to its label."""
+        future = Future()
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError('CaptchaBatcher is closed.')
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__run, name='captcha-batcher', daemon=True)
+                self.__worker.start()
+            self.__requests.put((im_bytes, future, time.perf_counter()))
+        return future
+
+    def report_wrong_result(self, predicted_label):
+        self.model.report_wrong_result(predicted_label)
+
+    def close(self):
+        """Stop the worker once the queued captchas are done."""
+        with self.__lock:
+            self.__closed = True
+            worker = self.__worker
+            if worker is not None:
+                self.__requests.put(None)
+        if worker is not None:
+            worker.join()
+
+    @property
+    def stats(self):
+        with self.__lock:
+            return {'batches': sum(self.__batch_sizes.values()),
+                    'captchas': self.__latency.count,
+                    'batch_sizes': dict(sorted(self.__batch_sizes.items())),
+                    'mean_batch_size': (self.__latency.count / sum(self.__batch_sizes.values())
+                                        if self.__batch_sizes else None),
+                    'latency_p50': self.__latency.percentile(50),
+                    'latency_p99': self.__latency.percentile(99),
+                    'queue_wait_p50': self.__queue_wait.percentile(50),
+                    'errors': self.__errors}
+
+    def __run(self):
+        while True:
+            request = self.__requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = request[2] + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self.__requests.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            self.__run_batch(batch)
+            if stop:
+                return
+
+    def __run_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            labels = self.model.predict_batch([im_bytes for im_bytes, _, _ in batch], return_exceptions=True)
+        except Exception as e:
+            self.logger.error(f'Captcha batch of {len(batch)} failed: {e}')
+            with self.__lock:
+                self.__errors += len(batch)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+        with self.__lock:
+            self.__batch_sizes[len(batch)] = self.__batch_sizes.get(len(batch), 0) + 1
+            for _, _, queued in batch:
+                self.__latency.add(finished - queued)
+                self.__queue_wait.add(started - queued)
+            # An undecodable captcha only fails its own prediction
+            self.__errors += sum(isinstance(label, Exception) for label in labels)
+        for (_, future, _), label in zip(batch, labels):
+            if isinstance(label, Exception):
+                future.set_exception(label)
+            else:
+                future.set_result(label)
+
+
+class _TcpCaptchaServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixCaptchaServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def create_captcha_server(address, batcher):
+    """
+    Server sharing a CaptchaBatcher with other processes over a local socket: a Unix socket if `address` is a path,
+    TCP if it is a (host, port) tuple. Requests from all connections are batched together. Run it with
+    serve_forever(); CaptchaClient is the matching client.
+    """
+    server_class = _UnixCaptchaServer if isinstance(address, str) else _TcpCaptchaServer
+    server = server_class(address, _CaptchaRequestHandler)
+    server.batcher = batcher
+    return server
+
+
+class _CaptchaRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            payload = _read_frame(self.request)
+            if payload is None:
+                return
+            op, data = payload[:1], payload[1:]
+            try:
+                if op == _OP_PREDICT:
+                    result = _encode_label(self.server.batcher.predict(data))
+                elif op == _OP_REPORT:
+                    self.server.batcher.report_wrong_result(_decode_label(data))
+                    result = b''
+                else:
+                    raise ValueError(f'Unknown captcha service operation {op}.')
+                _write_frame(self.request, _STATUS_OK + result)
+            except Exception as e:
+                _write_frame(self.request, _STATUS_ERROR + str(e).encode('utf-8'))
+
+
+class CaptchaClient(object):
+    """
+    Client of a captcha server with the interface of WeiboComCaptcha. Every thread keeps its own connection, so
+    concurrent predictions from one process are batched by the server, too.
+    """
+
+    def __init__(self, address, timeout=10):
+        self.address = address
+        self.timeout = timeout
+        self.__local = threading.local()
+        self.__sockets = []
+        self.__lock = threading.Lock()
+
+    def predict(self, im_bytes):
+        return _decode_label(self.__call(_OP_PREDICT + bytes(im_bytes)))
+
+    def report_wrong_result(self, predicted_label):
+        self.__call(_OP_REPORT + _encode_label(predicted_label))
+
+    def close(self):
+        with self.__lock:
+            for sock in self.__sockets:
+                sock.close()
+            self.__sockets = []
+        self.__local = threading.local()
+
+    def __call(self, payload):
+        for attempt in range(2):
+            sock = getattr(self.__local, 'socket', None)
+            reused = sock is not None
+            if not reused:
+                sock = self.__local.socket = self.__connect()
+            try:
+                _write_frame(sock, payload)
+                response = _read_frame(sock)
+                if response is None:
+                    raise ConnectionError('Captcha server closed the connection.')
+                break
+            except OSError:
+                self.__discard(sock)
+                # A kept-alive connection may have been closed by the server; retry once on a fresh one.
+                if not reused or attempt:
+                    raise
+        if response[:1] != _STATUS_OK:
+            raise RuntimeError(f'Captcha server error: {response[1:].decode("utf-8")}')
+        return response[1:]
+
+    def __connect(self):
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        with self.__lock:
+            self.__sockets.append(sock)
+        return sock
+
+    def __discard(self, sock):
+        sock.close()
+        self.__local.socket = None
+        with self.__lock:
+            if sock in self.__sockets:
+                self.__sockets.remove(sock)
+
+
+def _encode_label(label):
+    sample_id = getattr(label, 'sample_id', None)
+    return (str(label) if sample_id is None else f'{label} {sample_id}').encode('utf-8')
+
+
+def _decode_label(data):
+    label, _, sample_id = data.decode('utf-8').partition(' ')
+    return CaptchaLabel(label, sample_id or None)
+
+
+def _write_frame(sock, payload):
+    sock.sendall(_FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def _read_frame(sock):
+    header = _read_exactly(sock, _FRAME_HEADER.size)
+    if header is None:
+        return None
+    payload = _read_exactly(sock, _FRAME_HEADER.unpack(header)[0])
+    if payload is None:
+        raise ConnectionError('Connection closed in the middle of a frame.')
+    return payload
+
+
+def _read_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        block = sock.recv(size - len(data))
+        if not block:
+            return None
+        data += block
+    return bytes(data)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve weibo.com captcha recognition on a local socket.')
+    parser.add_argument('--unix-socket', help='path of a Unix socket to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='localhost TCP port, if no Unix socket is given')
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait', type=float, default=0.01, help='seconds to wait for a batch to fill up')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    batcher = CaptchaBatcher(max_batch_size=args.max_batch_size, max_wait=args.max_wait)
+    server = create_captcha_server(args.unix_socket or ('127.0.0.1', args.port), batcher)
+    logging.info(f'Serving captcha recognition on {server.server_address}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
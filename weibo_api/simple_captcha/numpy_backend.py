@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs the exported captcha network with NumPy alone, so captchas can be solved without mxnet.
+
+The network is read from the exported symbol JSON and executed node by node. Weights come from a compact .npz made
+once from the exported .params file:
+
+    python -m weibo_api.simple_captcha.numpy_backend model/0.9269662921348315.net.all-0001.params \
+        model/0.9269662921348315.net.all.npz
+
+Batch normalization uses the running statistics, as in inference mode, and is folded into the preceding
+convolution where possible. Dropout is a no-op at inference.
+"""
+
+import ast
+import json
+import struct
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# mxnet NDArray list file format (src/ndarray/ndarray.cc)
+_LIST_MAGIC = 0x112
+_NDARRAY_V2_MAGIC = 0xF993FAC9
+_NDARRAY_V3_MAGIC = 0xF993FACA
+_DTYPES = {0: np.float32, 1: np.float64, 2: np.float16, 3: np.uint8, 4: np.int32, 5: np.int8, 6: np.int64}
+
+
+def read_mxnet_params(path):
+    """
+    Arrays of an mxnet .params file (as written by nd.save or HybridBlock.export), keyed by parameter name without
+    the arg:/aux: prefix. Only dense arrays are supported.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+
+    def read(fmt):
+        nonlocal offset
+        values = struct.unpack_from(fmt, data, offset)
+        offset += struct.calcsize(fmt)
+        return values
+
+    magic, _ = read('<QQ')
+    if magic != _LIST_MAGIC:
+        raise ValueError(f'{path} is not an mxnet NDArray file.')
+    arrays = []
+    for _ in range(read('<Q')[0]):
+        array_magic, storage_type = read('<Ii')
+        if array_magic not in (_NDARRAY_V2_MAGIC, _NDARRAY_V3_MAGIC) or storage_type != 0:
+            raise ValueError(f'Unsupported NDArray format in {path} (magic {array_magic:#x}, storage {storage_type}).')
+        ndim = read('<i')[0]
+        shape = read(f'<{ndim}q') if ndim > 0 else ()
+        read('<ii')  # context: device type and id
+        dtype = np.dtype(_DTYPES[read('<i')[0]])
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays.append(np.frombuffer(data, dtype, int(np.prod(shape)), offset).reshape(shape).copy())
+        offset += size
+    names = []
+    for _ in range(read('<Q')[0]):
+        length = read('<Q')[0]
+        names.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return {name.split(':', 1)[-1]: array for name, array in zip(names, arrays)}
+
+
+def convert(params_path, npz_path):
+    """Convert an mxnet .params file to a .npz loadable by NumpyCaptchaNet."""
+    np.savez(npz_path, **read_mxnet_params(params_path))
+
+
+def windows2d(x, kernel, stride):
+    """Read-only (N, C, OH, OW, KH, KW) view of the kernel windows of an NCHW array."""
+    n, c, h, w = x.shape
+    out_h, out_w = (h - kernel[0]) // stride[0] + 1, (w - kernel[1]) // stride[1] + 1
+    sn, sc, sh, sw = x.strides
+    # as_strided rather than sliding_window_view, which needs NumPy 1.20 (mxnet 1.5 pins an older one)
+    return as_strided(x, (n, c, out_h, out_w) + tuple(kernel), (sn, sc, sh * stride[0], sw * stride[1], sh, sw),
+                      writeable=False)
+
+
+def conv2d(x, weight, bias, stride, pad):
+    """NCHW convolution as a single matrix product over the (strided) sliding windows."""
+    if pad != (0, 0):
+        # mode is only optional since NumPy 1.17
+        x = np.pad(x, ((0, 0), (0, 0), (pad[0], pad[0]), (pad[1], pad[1])), mode='constant')
+    # (N, C, OH, OW, KH, KW) x (O, C, KH, KW) -> (N, OH, OW, O)
+    out = np.tensordot(windows2d(x, weight.shape[2:], stride), weight, axes=([1, 4, 5], [1, 2, 3]))
+    if bias is not None:
+        out += bias
+    return np.ascontiguousarray(out.transpose(0, 3, 1, 2))
+
+
+def max_pool2d(x, kernel, stride, pad):
+    """Max pooling with the 'valid' (floor) convention; padding never wins."""
+    if pad != (0, 0):
+        x = np.pad(x, ((0, 0), (0, 0), (pad[0], pad[0]), (pad[1], pad[1])), mode='constant',
+                   constant_values=-np.inf)
+    return windows2d(x, kernel, stride).max(axis=(4, 5))
+
+
+class NumpyCaptchaNet(object):
+    """
+    Forward pass of an exported mxnet symbol with NumPy. Supports the operators the captcha network uses:
+    Convolution, BatchNorm, Activation (relu), Pooling (max), elemwise_add, Flatten, FullyConnected, Dropout and
+    stack. Called with an (N, C, H, W) float32 batch like the mxnet network, and returns a NumPy array.
+    """
+
+    def __init__(self, symbol, params):
+        self.nodes = symbol['nodes']
+        self.head = symbol['heads'][0][0]
+        self.params = {name: np.asarray(array, dtype=np.float32) for name, array in params.items()}
+        self.__consumers = [0] * len(self.nodes)
+        for node in self.nodes:
+            for i, _, _ in node['inputs']:
+                self.__consumers[i] += 1
+        self.__folded = {}
+        self.__fold_batch_norms()
+
+    @classmethod
+    def load(cls, symbol_path, npz_path):
+        with open(symbol_path, 'r') as f:
+            symbol = json.load(f)
+        with np.load(npz_path) as params:
+            return cls(symbol, dict(params))
+
+    def __call__(self, data):
+        values = [None] * len(self.nodes)
+        for i, node in enumerate(self.nodes):
+            if node['op'] == 'null':
+                values[i] = data if node['name'] == 'data' else self.params.get(node['name'])
+            elif i in self.__folded:
+                # BatchNorm merged into its convolution
+                values[i] = values[node['inputs'][0][0]]
+            else:
+                values[i] = self.__run(i, node, [values[j] for j, _, _ in node['inputs']])
+        return values[self.head]
+
+    def __run(self, i, node, inputs):
+        op = node['op']
+        attrs = node.get('attrs', {})
+        if op == 'Convolution':
+            weight, bias = self.__folded_conv.get(i, (inputs[1], None if self.__no_bias(attrs) else inputs[2]))
+            return conv2d(inputs[0], weight, bias, self.__tuple(attrs.get('stride', '(1, 1)')),
+                          self.__tuple(attrs.get('pad', '(0, 0)')))
+        if op == 'BatchNorm':
+            scale, shift = self.__batch_norm(attrs, *inputs[1:])
+            return inputs[0] * scale[:, None, None] + shift[:, None, None]
+        if op == 'Activation':
+            if attrs['act_type'] != 'relu':
+                raise ValueError(f'Unsupported activation {attrs["act_type"]}.')
+            return np.maximum(inputs[0], 0)
+        if op == 'Pooling':
+            if attrs.get('pool_type') != 'max' or attrs.get('pooling_convention', 'valid') != 'valid' \
+                    or attrs.get('global_pool', 'False') == 'True':
+                raise ValueError(f'Unsupported pooling {attrs}.')
+            return max_pool2d(inputs[0], self.__tuple(attrs['kernel']), self.__tuple(attrs.get('stride', '(1, 1)')),
+                              self.__tuple(attrs.get('pad', '(0, 0)')))
+        if op == 'elemwise_add':
+            return inputs[0] + inputs[1]
+        if op == 'Flatten':
+            return inputs[0].reshape(inputs[0].shape[0], -1)
+        if op == 'FullyConnected':
+            x = inputs[0].reshape(inputs[0].shape[0], -1)
+            out = x @ inputs[1].T
+            return out if self.__no_bias(attrs) else out + inputs[2]
+        if op == 'Dropout':
+            return inputs[0]
+        if op == 'stack':
+            return np.stack(inputs, axis=int(attrs.get('axis', '0')))
+        raise ValueError(f'Unsupported operator {op} ({node["name"]}).')
+
+    def __fold_batch_norms(self):
+        """Merge every BatchNorm whose input is a convolution used by nothing else into that convolution."""
+        self.__folded_conv = {}
+        for i, node in enumerate(self.nodes):
+            if node['op'] != 'BatchNorm':
+                continue
+            conv_index = node['inputs'][0][0]
+            conv = self.nodes[conv_index]
+            if conv['op'] != 'Convolution' or self.__consumers[conv_index] != 1:
+                continue
+            param_names = [self.nodes[j]['name'] for j, _, _ in node['inputs'][1:]]
+            conv_params = [self.nodes[j]['name'] for j, _, _ in conv['inputs'][1:]]
+            if any(name not in self.params for name in param_names + conv_params):
+                continue
+            scale, shift = self.__batch_norm(node.get('attrs', {}), *(self.params[name] for name in param_names))
+            weight = self.params[conv_params[0]] * scale[:, None, None, None]
+            bias = shift
+            if not self.__no_bias(conv.get('attrs', {})):
+                bias = bias + self.params[conv_params[1]] * scale
+            self.__folded_conv[conv_index] = (weight.astype(np.float32), bias.astype(np.float32))
+            self.__folded[i] = conv_index
+
+    @staticmethod
+    def __batch_norm(attrs, gamma, beta, mean, var):
+        if attrs.get('fix_gamma', 'True') == 'True':
+            gamma = np.ones_like(gamma)
+        scale = gamma / np.sqrt(var + float(attrs.get('eps', '1e-3')))
+        return scale.astype(np.float32), (beta - mean * scale).astype(np.float32)
+
+    @staticmethod
+    def __no_bias(attrs):
+        return attrs.get('no_bias', 'False') == 'True'
+
+    @staticmethod
+    def __tuple(value):
+        return tuple(ast.literal_eval(value))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert exported captcha model weights to .npz.')
+    parser.add_argument('params', help='mxnet .params file')
+    parser.add_argument('npz', help='output .npz file')
+    args = parser.parse_args()
+    convert(args.params, args.npz)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class CaptchaLabel(str):
+    """A predicted captcha label, carrying the id of its saved sample."""
+
+    def __new__(cls, label, sample_id=None):
+        obj = super().__new__(cls, label)
+        obj.sample_id = sample_id
+        return obj
+
+
+class CaptchaSampleStore(object):
+    """
+    Saves captcha images with their predicted labels, to collect training data.
+
+    Samples are stored as <data_path>/<shard>/<label>_<sample id>.<ext>, where the shard is the first two characters
+    of the id, and indexed in <data_path>/index.sqlite. A wrong prediction is relabeled by renaming its file to
+    wrong_<label>_<sample id>.<ext>, found through the index without listing the directory. Writes and relabels run
+    in order on a background thread.
+    """
+
+    INDEX_NAME = 'index.sqlite'
+
+    def __init__(self, data_path):
+        self.logger = logging.getLogger(__name__)
+        self.data_path = data_path
+        self.__tasks = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__worker = None
+        self.__closed = False
+
+    def add(self, im_bytes, label, ext='png'):
+        """Queue a sample for saving; returns its id."""
+        sample_id = uuid.uuid4().hex
+        self.__put((self.__save, (sample_id, label, ext.lower(), im_bytes, time.time())))
+        return sample_id
+
+    def mark_wrong(self, sample_id=None, label=None):
+        """Queue relabeling a sample as wrong, by id, or else the latest sample predicted as `label`."""
+        self.__put((self.__mark_wrong, (sample_id, label)))
+
+    def flush(self):
+        """Wait until the queued writes are done."""
+        if self.__worker is not None:
+            self.__tasks.join()
+
+    def close(self):
+        with self.__lock:
+            self.__closed = True
+            worker = self.__worker
+            if worker is not None:
+                self.__tasks.put(None)
+        if worker is not None:
+            worker.join()
+
+    def __put(self, task):
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError('CaptchaSampleStore is closed.')
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__run, name='captcha-sample-store', daemon=True)
+                self.__worker.start()
+                atexit.register(self.close)
+            self.__tasks.put(task)
+
+    def __run(self):
+        os.makedirs(self.data_path, exist_ok=True)
+        # Only used by this thread
+        db = sqlite3.connect(os.path.join(self.data_path, self.INDEX_NAME))
+        db.execute('CREATE TABLE IF NOT EXISTS samples (id TEXT PRIMARY KEY, label TEXT NOT NULL, '
+                   'path TEXT NOT NULL, wrong INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL)')
+        db.execute('CREATE INDEX IF NOT EXISTS samples_label ON samples (label, created)')
+        try:
+            while True:
+                task = self.__tasks.get()
+                try:
+                    if task is None:
+                        return
+                    function, args = task
+                    function(db, *args)
+                    db.commit()
+                except Exception as e:
+                    self.logger.error(f'Captcha sample store failed: {e}')
+                finally:
+                    self.__tasks.task_done()
+        finally:
+            db.close()
+
+    def __save(self, db, sample_id, label, ext, im_bytes, created):
+        path = os.path.join(sample_id[:2], f'{label}_{sample_id}.{ext}')
+        os.makedirs(os.path.join(self.data_path, sample_id[:2]), exist_ok=True)
+        with open(os.path.join(self.data_path, path), 'wb') as f:
+            f.write(im_bytes)
+        db.execute('INSERT INTO samples (id, label, path, created) VALUES (?, ?, ?, ?)',
+                   (sample_id, label, path, created))
+
+    def __mark_wrong(self, db, sample_id, label):
+        if sample_id is not None:
+            row = db.execute('SELECT id, path FROM samples WHERE id = ? AND wrong = 0', (sample_id,)).fetchone()
+        else:
+            row = db.execute('SELECT id, path FROM samples WHERE label = ? AND wrong = 0 ORDER BY created DESC '
+                             'LIMIT 1', (label,)).fetchone()
+        if row is None:
+            self.logger.error('Image file not found!')
+            return
+        sample_id, path = row
+        wrong_path = os.path.join(os.path.dirname(path), 'wrong_' + os.path.basename(path))
+        os.rename(os.path.join(self.data_path, path), os.path.join(self.data_path, wrong_path))
+        db.execute('UPDATE samples SET wrong = 1, path = ? WHERE id = ?', (wrong_path, sample_id))
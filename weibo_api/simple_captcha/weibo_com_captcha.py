@@ -3,65 +3,147 @@
 import logging
 import os
 import pickle
-import time
+import threading
 from io import BytesIO
 
-import mxnet as mx
-import numpy as np
-from PIL import Image
-from mxnet import gluon, nd
+from .sample_store import CaptchaLabel, CaptchaSampleStore
 
 
 class WeiboComCaptcha(object):
-    """Weibo.com captcha recognition."""
+    """
+    Weibo.com captcha recognition.
+
+    The network runs on NumPy alone (numpy_backend) when the converted weights in model_npz_path exist, on mxnet
+    otherwise; pass backend='numpy' or 'mxnet' to choose explicitly. mxnet, numpy and PIL are imported on first use, so
+    importing this module (and weibo_api.weibo_login) is cheap.
+    """
 
     CURRENT_DIR = os.path.dirname(__file__)
     INPUT_SHAPE = (100, 40)
+    # Normalization of the training set: (pixel / 255 - MEAN) / STD, i.e. pixel * SCALE - SHIFT
+    MEAN = 0.942532484060557
+    STD = 0.15926149044640417
+    SCALE = 1 / (255 * STD)
+    SHIFT = MEAN / STD
 
     def __init__(self, index_path='model/index.pkl',
                  model_symbol_path='model/0.9269662921348315.net.all-symbol.json',
                  model_params_path='model/0.9269662921348315.net.all-0001.params',
-                 data_path='./data', save_captcha=False):
+                 model_npz_path='model/0.9269662921348315.net.all.npz',
+                 data_path='./data', save_captcha=False, backend='auto'):
         self.data_path = os.path.join(data_path)
         self.save_captcha = save_captcha
-        if save_captcha and not os.path.exists(self.data_path):
-            os.makedirs(self.data_path)
+        self.sample_store = CaptchaSampleStore(self.data_path) if save_captcha else None
         self.index2ch, self.ch2index = self.read_index(os.path.join(self.CURRENT_DIR, index_path))
-        self.net = self.read_model(os.path.join(self.CURRENT_DIR, model_symbol_path),
-                                   os.path.join(self.CURRENT_DIR, model_params_path))
+        model_npz_path = os.path.join(self.CURRENT_DIR, model_npz_path)
+        if backend == 'auto':
+            backend = 'numpy' if os.path.exists(model_npz_path) else 'mxnet'
+        if backend == 'numpy':
+            self.net = self.read_numpy_model(os.path.join(self.CURRENT_DIR, model_symbol_path), model_npz_path)
+        elif backend == 'mxnet':
+            self.net = self.read_model(os.path.join(self.CURRENT_DIR, model_symbol_path),
+                                       os.path.join(self.CURRENT_DIR, model_params_path))
+        else:
+            raise ValueError(f'Unknown captcha backend {backend}.')
+        self.backend = backend
+        # Input batch reused by predict_batch, grown to the largest batch seen
+        self.__buffer = None
+        self.__buffer_lock = threading.Lock()
 
     def predict(self, im_bytes):
-        im = raw_im = Image.open(BytesIO(im_bytes))
-        if self.INPUT_SHAPE != raw_im.size:
-            logging.error('Invalid image shape %s!', str(raw_im.size))
-            im = raw_im.resize(self.INPUT_SHAPE)
-        data = np.asarray(im, dtype=np.float32)
-        data = data.reshape(-1, 1, self.INPUT_SHAPE[1], self.INPUT_SHAPE[0])
-        out = self.net(self.transform(nd.array(data).as_in_context(mx.cpu())))
-        predictions = nd.argmax(out, axis=2)
-        predicted_label = ''.join([self.index2ch[i] for i in predictions[0].asnumpy()])
-        if self.save_captcha:
-            self.save_im(raw_im, predicted_label)
-        return predicted_label
+        return self.predict_batch([im_bytes])[0]
+
+    def predict_batch(self, ims_bytes, return_exceptions=False):
+        """
+        Recognize several captchas with one forward pass. With save_captcha, the labels are CaptchaLabels carrying
+        the id of the saved sample.
+
+        Images that cannot be decoded raise their error, or with return_exceptions, get it in place of their label
+        while the other images are still recognized.
+        """
+        raw_ims = [self.__decode(im_bytes) for im_bytes in ims_bytes]
+        if not return_exceptions:
+            for raw_im in raw_ims:
+                if isinstance(raw_im, Exception):
+                    raise raw_im
+        decoded = [(im_bytes, raw_im) for im_bytes, raw_im in zip(ims_bytes, raw_ims)
+                   if not isinstance(raw_im, Exception)]
+        labels = iter([])
+        if decoded:
+            predictions = self.__predict([raw_im for _, raw_im in decoded])
+            labels = (''.join([self.index2ch[i] for i in prediction]) for prediction in predictions)
+            if self.save_captcha:
+                labels = (CaptchaLabel(label, self.sample_store.add(im_bytes, label, raw_im.format or 'png'))
+                          for (im_bytes, raw_im), label in zip(decoded, labels))
+        return [raw_im if isinstance(raw_im, Exception) else next(labels) for raw_im in raw_ims]
+
+    def __predict(self, ims):
+        import numpy as np
+
+        with self.__buffer_lock:
+            size = len(ims) * self.INPUT_SHAPE[0] * self.INPUT_SHAPE[1]
+            if self.__buffer is None or self.__buffer.size < size:
+                self.__buffer = np.empty(size, dtype=np.float32)
+            return np.argmax(self.net(self.preprocess(ims, out=self.__buffer)), axis=2)
+
+    @staticmethod
+    def __decode(im_bytes):
+        from PIL import Image
 
-    def save_im(self, im, label):
-        im_name = label + '_' + str(int(time.time())) + '.png'
-        im.save(os.path.join(self.data_path, im_name))
+        try:
+            im = Image.open(BytesIO(im_bytes))
+            im.load()  # Image.open is lazy; truncated images only fail here
+            return im
+        except Exception as e:
+            return e
+
+    def preprocess(self, ims, out=None):
+        """
+        Network input for a batch of PIL images: a normalized (N, 1, 40, 100) float32 array. Pixels are scaled
+        and shifted in place, in `out` if given (a contiguous float32 array at least that large, reusable across
+        batches).
+        """
+        import numpy as np
+
+        shape = (len(ims), 1, self.INPUT_SHAPE[1], self.INPUT_SHAPE[0])
+        if out is None:
+            data = np.empty(shape, dtype=np.float32)
+        else:
+            data = out.reshape(-1)[:int(np.prod(shape))].reshape(shape)
+        for i, im in enumerate(ims):
+            if self.INPUT_SHAPE != im.size:
+                logging.error('Invalid image shape %s!', str(im.size))
+                im = im.resize(self.INPUT_SHAPE)
+            # Scaled straight from the decoded pixels into the batch, then shifted in place
+            np.multiply(np.asarray(im), np.float32(self.SCALE), out=data[i, 0], casting='unsafe')
+            data[i, 0] -= np.float32(self.SHIFT)
+        return data
 
     def report_wrong_result(self, predicted_label):
+        """Relabel the saved sample of a label returned by predict, or else the latest sample with that label."""
         if self.save_captcha:
-            files = os.listdir(self.data_path)
-            for file_name in files:
-                if predicted_label in file_name:
-                    old_file = os.path.join(self.data_path, file_name)
-                    new_file = os.path.join(self.data_path, 'wrong_' + file_name)
-                    os.rename(old_file, new_file)
-                    return
-            logging.error('Image file not found!')
+            self.sample_store.mark_wrong(getattr(predicted_label, 'sample_id', None), str(predicted_label))
 
     @staticmethod
     def read_model(model_symbol_path, model_params_path):
-        return gluon.nn.SymbolBlock.imports(model_symbol_path, ['data'], model_params_path)
+        """mxnet network, wrapped to take and return NumPy arrays."""
+        try:
+            import mxnet as mx
+            from mxnet import gluon, nd
+        except ImportError:
+            raise ImportError(
+                'Solving captchas needs mxnet or the converted model weights (model/*.npz). Install mxnet with '
+                '`pip install weibo_api[mxnet]`, or convert the weights once with `python -m '
+                f'weibo_api.simple_captcha.numpy_backend {model_params_path} <model_npz_path>`.')
+
+        net = gluon.nn.SymbolBlock.imports(model_symbol_path, ['data'], model_params_path)
+        return lambda data: net(nd.array(data, ctx=mx.cpu())).asnumpy()
+
+    @staticmethod
+    def read_numpy_model(model_symbol_path, model_npz_path):
+        from .numpy_backend import NumpyCaptchaNet
+
+        return NumpyCaptchaNet.load(model_symbol_path, model_npz_path)
 
     @staticmethod
     def read_index(path):
@@ -70,11 +152,9 @@ class WeiboComCaptcha(object):
 
         return index_dict['index2ch'], index_dict['ch2index']
 
-    @staticmethod
-    def transform(image):
+    @classmethod
+    def transform(cls, image):
         """
-        This function resizes the input image and converts so that it could be fed into the network.
+        This function converts an image array so that it could be fed into the network.
         """
-        image = image / 255.
-        image = (image - 0.942532484060557) / 0.15926149044640417
-        return image
+        return image * cls.SCALE - cls.SHIFT
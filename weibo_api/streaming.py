@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import io
+import os
+from urllib.parse import quote_plus
+
+
+class BufferReader(object):
+    """
+    Read-only file-like view over a bytes-like object.
+
+    Only the requested slice is copied on each read, so wrapping a large buffer costs no extra memory. `len` is the
+    number of bytes left, which is what requests and MultipartEncoder use for Content-Length.
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast('B')
+        self.position = 0
+
+    @property
+    def len(self):
+        return len(self.view) - self.position
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        data = self.view[self.position:end].tobytes()
+        self.position = end
+        return data
+
+
+class SizedReader(object):
+    """File-like wrapper exposing the remaining length of a seekable stream that has no file descriptor."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        start = stream.tell()
+        self.end = stream.seek(0, io.SEEK_END)
+        stream.seek(start)
+
+    @property
+    def len(self):
+        return self.end - self.stream.tell()
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+def as_stream(data):
+    """
+    Wrap bytes, memoryviews, BytesIO and other readable objects so they can be streamed with a known length and
+    without copying the whole payload. Real files are returned as they are.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return BufferReader(data)
+    if hasattr(data, 'fileno'):
+        try:
+            data.fileno()
+            return data
+        except (io.UnsupportedOperation, OSError):
+            pass
+    if hasattr(data, 'getbuffer'):
+        # BytesIO.getvalue() would copy the whole buffer
+        return BufferReader(data.getbuffer()[data.tell():])
+    if hasattr(data, 'seek') and hasattr(data, 'tell'):
+        return SizedReader(data)
+    raise TypeError(f'Unable to stream object of type {type(data).__name__}')
+
+
+def stream_len(data):
+    """Number of bytes as_stream(data) would produce."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return memoryview(data).nbytes
+    stream = as_stream(data)
+    if stream is data:
+        return os.fstat(data.fileno()).st_size - data.tell()
+    return stream.len
+
+
+class Base64FormBody(object):
+    """
+    application/x-www-form-urlencoded body with a single field holding the base64 encoding of a binary stream.
+
+    The stream is encoded in fixed-size blocks while the body is sent, so memory use does not depend on the stream
+    size. The Content-Length is found with an extra encoding pass before sending, which only counts bytes.
+    """
+
+    # A multiple of 3, so no block but the last is padded.
+    BLOCK_SIZE = 3 * 64 * 1024
+
+    def __init__(self, field, stream, block_size=BLOCK_SIZE):
+        if block_size % 3:
+            raise ValueError('block_size has to be a multiple of 3.')
+        self.stream = stream
+        self.block_size = block_size
+        self.pending = bytearray(quote_plus(field).encode('ascii') + b'=')
+        self.total = len(self.pending) + self.__encoded_len()
+        self.sent = 0
+        self.blocks = self.__encoded_blocks()
+
+    @property
+    def len(self):
+        return self.total - self.sent
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self.pending) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.pending += block
+        if size is None or size < 0:
+            size = len(self.pending)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        self.sent += len(data)
+        return data
+
+    def __encoded_len(self):
+        start = self.stream.tell()
+        length = 0
+        for block in iter(lambda: self.stream.read(self.block_size), b''):
+            encoded = base64.b64encode(block)
+            # Each of + / = becomes a three character escape
+            length += len(encoded) + 2 * (encoded.count(b'+') + encoded.count(b'/') + encoded.count(b'='))
+        self.stream.seek(start)
+        return length
+
+    def __encoded_blocks(self):
+        for block in iter(lambda: self.stream.read(self.block_size), b''):
+            yield base64.b64encode(block).replace(b'+', b'%2B').replace(b'/', b'%2F').replace(b'=', b'%3D')
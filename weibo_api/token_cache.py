@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+
+
+class TokenCache(object):
+    """
+    Thread-safe single-value cache with a TTL.
+
+    `fetch` is called on a miss. Concurrent readers that miss at the same time wait for one refresh instead of
+    each issuing their own request.
+    """
+
+    def __init__(self, fetch, ttl=300, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__token = None
+        self.__expires_at = 0
+
+    def get(self):
+        with self.__lock:
+            if self.__token is not None and self.clock() < self.__expires_at:
+                self.hits += 1
+                return self.__token
+            self.misses += 1
+            token = self.fetch()
+            self.__token = token
+            self.__expires_at = self.clock() + self.ttl
+            return token
+
+    def invalidate(self, token=None):
+        """
+        Drop the cached token. If `token` is given, only drop it if it is still the cached one, so a caller holding a
+        stale token does not throw away a refresh made by another thread.
+        """
+        with self.__lock:
+            if token is None or token == self.__token:
+                self.__token = None
+                self.__expires_at = 0
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class AsyncTokenCache(object):
+    """
+    TokenCache for asyncio code: `fetch` is a coroutine function, and concurrent tasks that miss at the same time
+    await one refresh.
+    """
+
+    def __init__(self, fetch, ttl=300, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.__lock = None
+        self.__token = None
+        self.__expires_at = 0
+
+    async def get(self):
+        if self.__lock is None:
+            # Created lazily, so the cache can be built outside of the event loop it is used in.
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            if self.__token is not None and self.clock() < self.__expires_at:
+                self.hits += 1
+                return self.__token
+            self.misses += 1
+            token = await self.fetch()
+            self.__token = token
+            self.__expires_at = self.clock() + self.ttl
+            return token
+
+    def invalidate(self, token=None):
+        if token is None or token == self.__token:
+            self.__token = None
+            self.__expires_at = 0
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -1 +1,2 @@
-from .weibo_cn_api import WeiboCnApi
+from .batch_poster import BatchPoster, JobResult, PostJob
+from .weibo_cn_api import WeiboCnApi, PicUploadResult
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import ConnectionError, ConnectTimeout
+from urllib3.exceptions import ConnectTimeoutError
+
+from .weibo_cn_api_requests import is_throttled
+from ..exceptions import CircuitOpenError, WeiboApiError
+from ..rate_limiter import TokenBucket
+
+# A post when repost_id is None, otherwise a repost of repost_id with `content` as comment.
+PostJob = namedtuple('PostJob', ['account', 'content', 'pic_ids', 'repost_id'], defaults=(None, None))
+# rsp_data of the successful attempt, or the error of the last attempt.
+JobResult = namedtuple('JobResult', ['job', 'rsp_data', 'error', 'attempts'])
+
+
+def is_retryable(error):
+    """
+    Whether a failed post can be sent again without risking a duplicate: it was answered with `ok != 1`, or it never
+    reached the server (circuit open, or no connection). Read timeouts and resets may come after the server got it.
+    """
+    if isinstance(error, (WeiboApiError, CircuitOpenError, ConnectTimeout)):
+        return True
+    if isinstance(error, ConnectionError) and error.args:
+        # urllib3 wraps connection failures in MaxRetryError; NewConnectionError is a ConnectTimeoutError
+        return isinstance(getattr(error.args[0], 'reason', error.args[0]), ConnectTimeoutError)
+    return False
+
+
+class _Account(object):
+
+    def __init__(self, rate, burst, clock):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.jobs = deque()
+        self.busy = False
+        self.strikes = 0
+        self.backoff_until = 0
+        self.throttled = 0
+
+
+class BatchPoster(object):
+    """
+    Posts and reposts queued jobs for many accounts, as fast as the rate limits allow.
+
+    Every account has its own token bucket (account_rate posts per second, bursts of account_burst), and all
+    accounts share a global one. An account never has more than one job in flight, and its jobs are sent in the
+    order they were submitted.
+
+    A job that fails with `ok != 1`, or before it was sent (see is_retryable), is retried up to max_attempts times
+    after an exponential, jittered backoff of its account. Throttling responses (THROTTLE_ERRNOS) also halve the rate
+    of the account; every success raises it again by a tenth of account_rate, up to account_rate. Other errors, e.g.
+    LoginExceptions or read timeouts after which the post may have been published, are not retried.
+
+    :param apis: mapping from account name to its WeiboCnApi (anything with post_status and repost)
+    """
+
+    # Successful posts within this many seconds count towards posts_per_minute.
+    THROUGHPUT_WINDOW = 60
+
+    def __init__(self, apis, **kwargs):
+        self.logger = logging.getLogger(__name__)
+
+        self.apis = apis
+        self.account_rate = kwargs.get('account_rate', 1 / 30)
+        self.account_burst = kwargs.get('account_burst', 1)
+        self.min_account_rate = kwargs.get('min_account_rate', self.account_rate / 16)
+        self.max_workers = kwargs.get('max_workers', 4)
+        self.max_attempts = kwargs.get('max_attempts', 3)
+        self.backoff_base = kwargs.get('backoff_base', 60)
+        self.backoff_max = kwargs.get('backoff_max', 900)
+        self.clock = kwargs.get('clock', time.monotonic)
+        self.global_bucket = TokenBucket(kwargs.get('global_rate', 1), kwargs.get('global_burst', 5), self.clock)
+
+        self.__condition = threading.Condition()
+        self.__accounts = {}
+        self.__results = {}
+        self.__seq = 0
+        self.__queued = 0
+        self.__in_flight = 0
+        self.__completions = deque()
+        self.__stats = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'retried': 0, 'throttled': 0,
+                        'max_queue_depth': 0}
+
+    def submit(self, job):
+        """Queue a PostJob. Jobs can be submitted while run() is running."""
+        if job.account not in self.apis:
+            raise ValueError(f'Unknown account {job.account}.')
+        with self.__condition:
+            account = self.__accounts.get(job.account)
+            if account is None:
+                account = _Account(self.account_rate, self.account_burst, self.clock)
+                self.__accounts[job.account] = account
+            account.jobs.append((self.__seq, job, 1))
+            self.__seq += 1
+            self.__queued += 1
+            self.__stats['submitted'] += 1
+            self.__stats['max_queue_depth'] = max(self.__stats['max_queue_depth'], self.__queued)
+            self.__condition.notify_all()
+
+    def run(self, jobs=()):
+        """
+        Submit `jobs`, then send queued jobs until the queue is empty.
+
+        :return: a JobResult for every job handled by this run, in submission order
+        """
+        for job in jobs:
+            self.submit(job)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            with self.__condition:
+                while self.__queued or self.__in_flight:
+                    name, wait = self.__next_account()
+                    if name is None:
+                        self.__condition.wait(wait)
+                        continue
+                    account = self.__accounts[name]
+                    seq, job, attempt = account.jobs.popleft()
+                    account.busy = True
+                    self.__queued -= 1
+                    self.__in_flight += 1
+                    future = executor.submit(self.__send, job)
+                    future.add_done_callback(lambda f, a=(seq, job, attempt): self.__done(*a, f))
+            results = [self.__results.pop(seq) for seq in sorted(self.__results)]
+        return results
+
+    @property
+    def stats(self):
+        with self.__condition:
+            now = self.clock()
+            while self.__completions and self.__completions[0] <= now - self.THROUGHPUT_WINDOW:
+                self.__completions.popleft()
+            stats = dict(self.__stats, queue_depth=self.__queued, in_flight=self.__in_flight,
+                         posts_per_minute=len(self.__completions) * 60 / self.THROUGHPUT_WINDOW)
+            stats['accounts'] = {name: {'queue_depth': len(account.jobs), 'rate': account.bucket.rate,
+                                        'throttled': account.throttled}
+                                 for name, account in self.__accounts.items()}
+            return stats
+
+    def __next_account(self):
+        """
+        The account whose next job can be sent now, oldest job first, and otherwise how long to wait for one (None:
+        until a job in flight completes). Takes the rate limit tokens for the job.
+        """
+        now = self.clock()
+        ready = None
+        wait = None
+        for name, account in self.__accounts.items():
+            if account.busy or not account.jobs:
+                continue
+            account_wait = max(account.backoff_until - now, account.bucket.delay())
+            if account_wait > 0:
+                wait = account_wait if wait is None else min(wait, account_wait)
+            elif ready is None or account.jobs[0][0] < self.__accounts[ready].jobs[0][0]:
+                ready = name
+        if ready is None:
+            return None, wait
+        global_wait = self.global_bucket.delay()
+        if global_wait > 0:
+            return None, global_wait
+        self.global_bucket.try_acquire()
+        self.__accounts[ready].bucket.try_acquire()
+        return ready, None
+
+    def __send(self, job):
+        api = self.apis[job.account]
+        if job.repost_id is not None:
+            return api.repost(job.repost_id, job.content)
+        return api.post_status(job.content, job.pic_ids)
+
+    def __done(self, seq, job, attempt, future):
+        with self.__condition:
+            account = self.__accounts[job.account]
+            account.busy = False
+            self.__in_flight -= 1
+            error = future.exception()
+            if error is None:
+                account.strikes = 0
+                account.bucket.rate = min(self.account_rate, account.bucket.rate + self.account_rate / 10)
+                self.__finish(seq, JobResult(job, future.result(), None, attempt), 'succeeded')
+            elif not is_retryable(error) or attempt >= self.max_attempts:
+                self.logger.error(f'Giving up on job {seq} of {job.account} after {attempt} attempts: {error}')
+                self.__backoff(account, error)
+                self.__finish(seq, JobResult(job, None, error, attempt), 'failed')
+            else:
+                delay = self.__backoff(account, error)
+                self.logger.warning(f'Job {seq} of {job.account} failed (attempt {attempt}), '
+                                    f'retrying in {delay:.1f}s: {error}')
+                account.jobs.appendleft((seq, job, attempt + 1))
+                self.__queued += 1
+                self.__stats['retried'] += 1
+            self.__condition.notify_all()
+
+    def __backoff(self, account, error):
+        account.strikes += 1
+        if isinstance(error, WeiboApiError) and error.rsp_data is not None and is_throttled(error.rsp_data):
+            account.throttled += 1
+            self.__stats['throttled'] += 1
+            account.bucket.rate = max(self.min_account_rate, account.bucket.rate / 2)
+        delay = min(self.backoff_base * 2 ** (account.strikes - 1), self.backoff_max) * random.uniform(0.8, 1.2)
+        account.backoff_until = self.clock() + delay
+        return delay
+
+    def __finish(self, seq, result, outcome):
+        self.__results[seq] = result
+        self.__stats[outcome] += 1
+        if outcome == 'succeeded':
+            self.__completions.append(self.clock())
@@ -1,139 +1,180 @@
 # -*- coding: utf-8 -*-
 
-import copy
 import logging
-import mimetypes
 import os
-import pickle
 import time
-from io import BytesIO
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from PIL import Image
 from requests_toolbelt import MultipartEncoder
 
 from .weibo_cn_api_constants import *
-from ..exceptions import LoginException
+from .weibo_cn_api_requests import *
+from ..hashing import stream_digest
+from ..image_compressor import ImageCompressor
 from ..requests_wrapper import RequestsWrapper
+from ..session_factory import SessionFactory
+from ..session_store import SessionStore
+from ..streaming import as_stream, stream_len
+from ..token_cache import TokenCache
+
+PicUploadResult = namedtuple('PicUploadResult', ['pic_ids', 'errors'])
 
 
 class WeiboCnApi(RequestsWrapper):
     """m.weibo.cn API"""
 
-    __COMMON_HEADERS = {
-        'Accept': '*/*',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Accept-Language': 'en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7,zh-TW;q=0.6',
-        'User-Agent': 'Mozilla/5.0 (Linux; Android 7.0; SM-G892A Build/NRD90M; wv) AppleWebKit/537.36 '
-                      '(KHTML, like Gecko) Version/4.0 Chrome/67.0.3396.87 Mobile Safari/537.36',
-    }
+    # Shared by default, so pictures reused across instances are only recompressed once.
+    image_compressor = ImageCompressor(max_bytes=PIC_SIZE_LIMIT - 1)
 
     def __init__(self, **kwargs):
         self.logger = logging.getLogger(__name__)
 
         self.timeout = kwargs.get('timeout', 60)
+        self.wire_trace = kwargs.get('wire_trace', self.wire_trace)
+        self.retry_policy = kwargs.get('retry_policy', self.retry_policy)
+        self.session_factory = kwargs.get('session_factory', None)
+        self.session_store = kwargs.get('session_store', None) or SessionStore()
         self.session = kwargs.get('session', None)
         if self.session is None:
             self.session = self.__load_session(kwargs.get('weibo_session_file', None))
+        elif self.session_factory is not None:
+            self.session_factory.mount(self.session)
         if self.session is None:
             raise ValueError('session is None. Please provide either a session directly, or a valid session file.')
+        self.image_compressor = kwargs.get('image_compressor', self.image_compressor)
+        self.pic_cache = kwargs.get('pic_cache', None)
+        self.pic_upload_concurrency = kwargs.get('pic_upload_concurrency', 4)
+        self.account = kwargs.get('account', kwargs.get('weibo_session_file', None))
+        if self.pic_cache is not None and not self.account:
+            # Cached picture ids are only valid for the account that uploaded them.
+            raise ValueError('pic_cache needs the account (or weibo_session_file) of the session.')
+        self.st_cache = TokenCache(self.__fetch_st, ttl=kwargs.get('st_ttl', 300))
 
     def __load_session(self, session_file):
         if session_file and os.path.isfile(session_file):
-            with open(session_file, 'rb') as f:
-                self.logger.info(f'Loading session from {session_file}')
-                return pickle.load(f)
-
-    def __upload_pic_multipart(self, pic, pic_file):
-        boundary = hex(int(time.time() * 1000))
-        encoder = MultipartEncoder([('type', 'json'), ('st', self.__st),
-                                    # https://github.com/requests/toolbelt/blob/master/requests_toolbelt/multipart/encoder.py#L227
-                                    # (file, (file_name, file_pointer, file_type))
-                                    ('pic', ('pic', pic, self.__guess_content_type(pic_file)))],
-                                   boundary)
-        headers = copy.deepcopy(WeiboCnApi.__COMMON_HEADERS)
-        headers.update({
-            'Content-Type': f'multipart/form-data; boundary={boundary}',
-            'X-Requested-With': 'XMLHttpRequest',
-            'MWeibo-Pwa': '1',
-            'Origin': 'https://m.weibo.cn',
-            'Referer': 'https://m.weibo.cn/compose/',
-            'X-XSRF-TOKEN': self.__st
-        })
-        rsp = self.post(UPLOAD_PIC_URL, headers=headers, data=encoder.to_string(), timeout=self.timeout)
-        rsp_data = rsp.json()
-        if 'pic_id' not in rsp_data:
-            raise RuntimeError(f'Unknown error when uploading pic {pic_file}')
-        pic_id = rsp_data['pic_id']
-        self.logger.debug(f'Pic {rsp_data["pic_id"]} is uploaded.')
+            self.logger.info(f'Loading session from {session_file}')
+            return self.session_store.load(session_file, (self.session_factory or SessionFactory()).create())
+
+    def __upload_pic_multipart(self, pic, pic_name):
+        start = pic.tell() if hasattr(pic, 'tell') and not isinstance(pic, memoryview) else None
+
+        def upload(st):
+            if start is not None:
+                pic.seek(start)
+            boundary = hex(int(time.time() * 1000))
+            encoder = MultipartEncoder([('type', 'json'), ('st', st),
+                                        # https://github.com/requests/toolbelt/blob/master/requests_toolbelt/multipart/encoder.py#L227
+                                        # (file, (file_name, file_pointer, file_type))
+                                        ('pic', ('pic', as_stream(pic), guess_content_type(pic_name)))],
+                                       boundary)
+            # The encoder is passed as a stream, so the body is read in blocks while it is sent.
+            return self.post(UPLOAD_PIC_URL, headers=multipart_headers(st, boundary), data=encoder,
+                             timeout=self.timeout, operation='cn.upload_pic').json()
+
+        pic_id = parse_pic_id(self.__with_st(upload), pic_name)
+        self.logger.debug(f'Pic {pic_id} is uploaded.')
         return pic_id
 
+    def is_login(self):
+        """Whether the session is still logged in. Fetches a fresh st token on the way."""
+        self.st_cache.invalidate()
+        try:
+            self.st_cache.get()
+            return True
+        except LoginException:
+            return False
+
     def post_status(self, content, pic_ids=None):
-        data = {'content': content, 'st': self.__st}
-        if pic_ids and len(pic_ids) > 0:
-            data['picId'] = ','.join(pic_ids)
-        headers = copy.deepcopy(WeiboCnApi.__COMMON_HEADERS)
-        headers.update({
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'X-Requested-With': 'XMLHttpRequest',
-            'MWeibo-Pwa': '1',
-            'Origin': 'https://m.weibo.cn',
-            'Referer': 'https://m.weibo.cn/compose/',
-            'X-XSRF-TOKEN': self.__st
-        })
-        rsp = self.post(POST_STATUS_URL, headers=headers, data=data, timeout=self.timeout)
-        rsp_data = rsp.json()
-        if rsp_data['ok'] == 1:
-            self.logger.info(f'Weibo {content} is posted.')
-        else:
-            raise RuntimeError(f'Unknown error posting weibo {content}. Response: {rsp_data}')
+        rsp_data = check_post_status(self.__post_form(POST_STATUS_URL, post_status_form(content, pic_ids),
+                                                      'cn.post_status'), content)
+        self.logger.info(f'Weibo {content} is posted.')
         return rsp_data
 
     def repost(self, repost_id, content):
-        data = {'id': repost_id, 'mid': repost_id, 'content': content, 'st': self.__st}
-        headers = copy.deepcopy(WeiboCnApi.__COMMON_HEADERS)
-        headers.update({
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'X-Requested-With': 'XMLHttpRequest',
-            'MWeibo-Pwa': '1',
-            'Origin': 'https://m.weibo.cn',
-            'Referer': 'https://m.weibo.cn/compose/',
-            'X-XSRF-TOKEN': self.__st
-        })
-        rsp = self.post(REPOST_URL, headers=headers, data=data, timeout=self.timeout)
-        rsp_data = rsp.json()
-        if rsp_data['ok'] == 1:
-            self.logger.info(f'Weibo {repost_id}:{content} is reposted.')
-        else:
-            raise RuntimeError(f'Error posting weibo {repost_id}:{content}. Response: {rsp_data}')
+        rsp_data = check_repost(self.__post_form(REPOST_URL, repost_form(repost_id, content), 'cn.repost'), repost_id,
+                                content)
+        self.logger.info(f'Weibo {repost_id}:{content} is reposted.')
         return rsp_data
 
     def get_pic_id(self, pic_file):
-        pic_size = os.stat(pic_file).st_size
-        if pic_size >= 5000000:  # m.weibo.cn pic upload limitation is 5MB
-            with Image.open(pic_file) as pic:
-                with BytesIO() as buffer:
-                    # save to BytesIO instead of file
-                    # https://stackoverflow.com/a/41818645/4214478
-                    pic.save(buffer, 'JPEG', optimize=True)
-                    pic_id = self.__upload_pic_multipart(buffer.getvalue(), pic_file)
-                    return pic_id
-        else:
-            with open(pic_file, 'rb') as f:
-                pic_id = self.__upload_pic_multipart(f, pic_file)
+        """
+        Upload a picture and return its pic_id.
+
+        :param pic_file: a file path, a binary file object, or a bytes-like object (bytes, bytearray, memoryview).
+        """
+        content_hash = None
+        if self.pic_cache is not None:
+            content_hash = stream_digest(pic_file)
+            pic_id = self.pic_cache.get(content_hash, 'weibo.cn', self.account)
+            if pic_id is not None:
+                self.logger.debug(f'Pic {pic_id} found in cache.')
                 return pic_id
 
-    @property
-    def __st(self):
-        rsp = self.get(ST_URL, headers=WeiboCnApi.__COMMON_HEADERS, timeout=self.timeout).json()
-        if not rsp['data']['login']:
-            raise LoginException('Login required.')
+        if isinstance(pic_file, (str, os.PathLike)):
+            pic_size = os.stat(pic_file).st_size
+            with open(pic_file, 'rb') as f:
+                pic_id = self.__upload_pic(f, os.fspath(pic_file), pic_size)
         else:
-            return rsp['data']['st']
-
-    @staticmethod
-    def __guess_content_type(url):
-        n = url.rfind('.')
-        if n == (-1):
-            return 'application/octet-stream'
-        ext = url[n:]
-        return mimetypes.types_map.get(ext, 'application/octet-stream')
+            pic_id = self.__upload_pic(pic_file, getattr(pic_file, 'name', None) or 'pic', stream_len(pic_file))
+
+        if self.pic_cache is not None:
+            self.pic_cache.put(content_hash, 'weibo.cn', self.account, pic_id)
+        return pic_id
+
+    def get_pic_ids(self, pic_files, max_workers=None):
+        """
+        Upload several pictures concurrently, e.g. the (up to nine) pictures of one post.
+
+        A failed upload does not cancel the others.
+
+        :param pic_files: file paths, binary file objects or bytes-like objects, as accepted by get_pic_id
+        :param max_workers: number of concurrent uploads, the pic_upload_concurrency kwarg by default
+        :return: PicUploadResult, where pic_ids holds the pic_ids of the successful uploads in input order, ready to
+                 pass to post_status, and errors maps the input index of every failed upload to its exception.
+        """
+        pic_files = list(pic_files)
+        results = [None] * len(pic_files)
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers or self.pic_upload_concurrency) as executor:
+            futures = {executor.submit(self.get_pic_id, pic_file): i for i, pic_file in enumerate(pic_files)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    self.logger.error(f'Error uploading pic {i}: {e}')
+                    errors[i] = e
+        pic_ids = [pic_id for i, pic_id in enumerate(results) if i not in errors]
+        return PicUploadResult(pic_ids, errors)
+
+    def __upload_pic(self, pic, pic_name, pic_size):
+        if pic_size >= PIC_SIZE_LIMIT:
+            data = self.image_compressor.compress(pic)
+            return self.__upload_pic_multipart(data, os.path.splitext(pic_name)[0] + '.jpg')
+        else:
+            return self.__upload_pic_multipart(pic, pic_name)
+
+    def __post_form(self, url, data, operation):
+        def post(st):
+            return self.post(url, headers=form_headers(st), data=dict(data, st=st), timeout=self.timeout,
+                             operation=operation).json()
+
+        return self.__with_st(post)
+
+    def __with_st(self, send):
+        """
+        Call send(st) with the cached st token. If the server rejects the token, drop it and retry once with a
+        fresh one.
+        """
+        st = self.st_cache.get()
+        rsp_data = send(st)
+        if is_st_expired(rsp_data):
+            self.logger.info('st token expired, refreshing.')
+            self.st_cache.invalidate(st)
+            # Raises LoginException (and caches nothing) if the session itself is no longer logged in.
+            rsp_data = send(self.st_cache.get())
+        return rsp_data
+
+    def __fetch_st(self):
+        return parse_st(self.get(ST_URL, headers=COMMON_HEADERS, timeout=self.timeout, operation='cn.st').json())
@@ -5,3 +5,11 @@ ST_URL = 'https://m.weibo.cn/api/config'
 UPLOAD_PIC_URL = 'https://m.weibo.cn/api/statuses/uploadPic'
 POST_STATUS_URL = 'https://m.weibo.cn/api/statuses/update'
 REPOST_URL = 'https://m.weibo.cn/api/statuses/repost'
+
+PIC_SIZE_LIMIT = 5000000  # m.weibo.cn pic upload limitation is 5MB
+
+# errno values m.weibo.cn returns when the st (XSRF) token is no longer accepted
+ST_EXPIRED_ERRNOS = ('100005', '100006')
+
+# errno values m.weibo.cn returns when an account posts too frequently
+THROTTLE_ERRNOS = ('20016', '10023', '10024')
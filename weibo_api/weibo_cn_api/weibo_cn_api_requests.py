@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Request building and response checking for m.weibo.cn, shared by the blocking and the asyncio clients.
+"""
+
+import copy
+import mimetypes
+
+from .weibo_cn_api_constants import *
+from ..exceptions import LoginException, WeiboApiError
+
+COMMON_HEADERS = {
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7,zh-TW;q=0.6',
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 7.0; SM-G892A Build/NRD90M; wv) AppleWebKit/537.36 '
+                  '(KHTML, like Gecko) Version/4.0 Chrome/67.0.3396.87 Mobile Safari/537.36',
+}
+
+
+def xsrf_headers(st, content_type):
+    headers = copy.deepcopy(COMMON_HEADERS)
+    headers.update({
+        'Content-Type': content_type,
+        'X-Requested-With': 'XMLHttpRequest',
+        'MWeibo-Pwa': '1',
+        'Origin': 'https://m.weibo.cn',
+        'Referer': 'https://m.weibo.cn/compose/',
+        'X-XSRF-TOKEN': st
+    })
+    return headers
+
+
+def form_headers(st):
+    return xsrf_headers(st, 'application/x-www-form-urlencoded')
+
+
+def multipart_headers(st, boundary):
+    return xsrf_headers(st, f'multipart/form-data; boundary={boundary}')
+
+
+def post_status_form(content, pic_ids=None):
+    data = {'content': content}
+    if pic_ids and len(pic_ids) > 0:
+        data['picId'] = ','.join(pic_ids)
+    return data
+
+
+def repost_form(repost_id, content):
+    return {'id': repost_id, 'mid': repost_id, 'content': content}
+
+
+def parse_st(rsp_data):
+    if not rsp_data['data']['login']:
+        raise LoginException('Login required.')
+    else:
+        return rsp_data['data']['st']
+
+
+def is_st_expired(rsp_data):
+    return str(rsp_data.get('errno', '')) in ST_EXPIRED_ERRNOS
+
+
+def is_throttled(rsp_data):
+    return str(rsp_data.get('errno', '')) in THROTTLE_ERRNOS
+
+
+def check_post_status(rsp_data, content):
+    if rsp_data['ok'] != 1:
+        raise WeiboApiError(f'Unknown error posting weibo {content}. Response: {rsp_data}', rsp_data)
+    return rsp_data
+
+
+def check_repost(rsp_data, repost_id, content):
+    if rsp_data['ok'] != 1:
+        raise WeiboApiError(f'Error posting weibo {repost_id}:{content}. Response: {rsp_data}', rsp_data)
+    return rsp_data
+
+
+def parse_pic_id(rsp_data, pic_name):
+    if 'pic_id' not in rsp_data:
+        raise RuntimeError(f'Unknown error when uploading pic {pic_name}')
+    return rsp_data['pic_id']
+
+
+def guess_content_type(url):
+    n = url.rfind('.')
+    if n == (-1):
+        return 'application/octet-stream'
+    ext = url[n:]
+    return mimetypes.types_map.get(ext, 'application/octet-stream')
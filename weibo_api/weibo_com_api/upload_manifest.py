@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+class UploadManifest(object):
+    """
+    On-disk progress record of a chunked video upload, so an interrupted upload only resends missing chunks.
+
+    A manifest is keyed by the file's absolute path, size, mtime and MD5; any change to the file starts a new upload.
+    It records the fileToken, the chunk size and the startloc offsets the server acknowledged. Manifests older than
+    `ttl` seconds are ignored since the server side file token will have expired by then.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, key, ttl=24 * 3600):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.key = key
+        self.ttl = ttl
+        self.file_token = None
+        self.chunk_bytes = None
+        self.created_at = None
+        self.acked = set()
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def load(cls, manifest_dir, filename, md5, ttl=24 * 3600):
+        stat = os.stat(filename)
+        key = '|'.join([os.path.abspath(filename), str(stat.st_size), str(stat.st_mtime_ns), md5])
+        path = os.path.join(manifest_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+        manifest = cls(path, key, ttl)
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data['version'] == cls.VERSION and data['key'] == key and time.time() - data['created_at'] < ttl:
+                    manifest.file_token = data['file_token']
+                    manifest.chunk_bytes = data['chunk_bytes']
+                    manifest.created_at = data['created_at']
+                    manifest.acked = set(data['acked'])
+                    manifest.logger.info(f'Resuming upload of {filename}: {len(manifest.acked)} chunks already sent.')
+            except (ValueError, KeyError, OSError) as e:
+                manifest.logger.warning(f'Ignoring unreadable upload manifest {path}: {e}')
+        return manifest
+
+    @property
+    def resumable(self):
+        return self.file_token is not None
+
+    def start(self, file_token, chunk_bytes):
+        with self.__lock:
+            self.file_token = file_token
+            self.chunk_bytes = chunk_bytes
+            self.created_at = time.time()
+            self.acked = set()
+            self.__save()
+
+    def ack(self, start_location):
+        with self.__lock:
+            self.acked.add(start_location)
+            self.__save()
+
+    def delete(self):
+        with self.__lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+    def __save(self):
+        data = {
+            'version': self.VERSION,
+            'key': self.key,
+            'file_token': self.file_token,
+            'chunk_bytes': self.chunk_bytes,
+            'created_at': self.created_at,
+            'acked': sorted(self.acked),
+        }
+        manifest_dir = os.path.dirname(self.path)
+        os.makedirs(manifest_dir, exist_ok=True)
+        # Write to a temp file and rename, so a crash mid-write never leaves a corrupt manifest behind.
+        fd, tmp_path = tempfile.mkstemp(dir=manifest_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
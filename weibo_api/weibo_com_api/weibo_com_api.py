@@ -1,159 +1,188 @@
 # -*- coding: utf-8 -*-
 
-import base64
-import hashlib
 import logging
 import os
-import pickle
-import random
 import time
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os.path import getsize
-from urllib.parse import parse_qs, urlparse
 
+from .upload_manifest import UploadManifest
 from .weibo_com_api_constants import *
-from ..exceptions import LoginException
+from .weibo_com_api_requests import *
+from ..exceptions import LoginException, UploadTokenError
+from ..hashing import file_digests, stream_digest
 from ..requests_wrapper import RequestsWrapper
+from ..session_factory import SessionFactory
+from ..session_store import SessionStore
+from ..streaming import Base64FormBody
 
 
 class WeiboComApi(RequestsWrapper):
     """weibo.com API for video upload"""
 
-    __COMMON_HEADERS = {
-        'X-Requested-With': 'XMLHttpRequest',
-        'Origin': 'http://weibo.com',
-        'Referer': 'http://weibo.com/?topnav=1&wvr=6&mod=logo',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/57.0.2987.133 Safari/537.36'
-    }
-
     def __init__(self, **kwargs):
         self.logger = logging.getLogger(__name__)
 
         self.timeout = kwargs.get('timeout', 60)
+        self.upload_concurrency = kwargs.get('upload_concurrency', 1)
+        self.chunk_retries = kwargs.get('chunk_retries', 3)
+        self.upload_manifest_dir = kwargs.get('upload_manifest_dir', None)
+        self.pic_cache = kwargs.get('pic_cache', None)
+        self.account = kwargs.get('account', kwargs.get('weibo_session_file', None))
+        if self.pic_cache is not None and not self.account:
+            # Cached picture ids are only valid for the account that uploaded them.
+            raise ValueError('pic_cache needs the account (or weibo_session_file) of the session.')
+        self.upload_manifest_ttl = kwargs.get('upload_manifest_ttl', 24 * 3600)
+        self.__chunk_bytes_hint = kwargs.get('chunk_bytes_hint', None)
+        self.wire_trace = kwargs.get('wire_trace', self.wire_trace)
+        self.retry_policy = kwargs.get('retry_policy', self.retry_policy)
+        self.session_factory = kwargs.get('session_factory', None)
+        self.session_store = kwargs.get('session_store', None) or SessionStore()
         self.session = kwargs.get('session', None)
         if self.session is None:
             self.session = self.__load_session(kwargs.get('weibo_session_file', None))
+        elif self.session_factory is not None:
+            self.session_factory.mount(self.session)
         if self.session is None:
             raise ValueError('session is None. Please provide either a session directly, or a valid session file.')
 
     def __load_session(self, session_file):
         if session_file and os.path.isfile(session_file):
-            with open(session_file, 'rb') as f:
-                self.logger.info(f'Loading session from {session_file}')
-                return pickle.load(f)
+            self.logger.info(f'Loading session from {session_file}')
+            return self.session_store.load(session_file, (self.session_factory or SessionFactory()).create())
+
+    def __upload_init(self, filename, md5):
+        res = self.post(MULTIMEDIA_INIT_URL, params=upload_init_params(filename, getsize(filename), md5),
+                        timeout=self.timeout, operation='upload_video.init')
+        return check_upload_init(res.json(), res.text)
+
+    def upload_video(self, filename, concurrency=None):
+        """
+        Upload a video and return its fid.
+
+        Chunks are sent by up to `concurrency` workers (the upload_concurrency kwarg by default). The last chunk is
+        only sent once every other chunk has been acknowledged, so the server answers it with the fid.
+
+        With the upload_manifest_dir kwarg set, acknowledged chunks are recorded on disk and a restarted upload of
+        the same, unchanged file only sends the missing chunks. The manifest is only deleted when the server rejects
+        its file token (UploadTokenError), so the next attempt starts over.
+
+        Chunks that fail with a connection error, a timeout or a 5xx are retried by the retry_policy; chunks the
+        server answers without acknowledging them are sent again up to chunk_retries times.
+        """
+        # Hash the whole file and, if the chunk size is already known from an earlier upload, every chunk in one
+        # bounded-memory pass.
+        md5, chunk_md5s = file_digests(filename, self.__chunk_bytes_hint)
+        manifest = None
+        if self.upload_manifest_dir:
+            manifest = UploadManifest.load(self.upload_manifest_dir, filename, md5, self.upload_manifest_ttl)
+
+        if manifest is not None and manifest.resumable:
+            file_token, chunk_bytes = manifest.file_token, manifest.chunk_bytes
+        else:
+            init_info = self.__upload_init(filename, md5)
+            file_token = init_info['fileToken']
+            chunk_bytes = init_info['length'] * 1024
+            if manifest is not None:
+                manifest.start(file_token, chunk_bytes)
+        if chunk_bytes != self.__chunk_bytes_hint:
+            # Chunks are hashed as they are read for upload instead.
+            chunk_md5s = None
+            self.__chunk_bytes_hint = chunk_bytes
+        start_locations = list(range(0, max(getsize(filename), 1), chunk_bytes))
+        section_checks = dict(zip(start_locations, chunk_md5s or []))
+
+        results = {}
+        pending = []
+        for start_location in start_locations[:-1]:
+            if manifest is not None and start_location in manifest.acked:
+                results[start_location] = True
+            else:
+                pending.append(start_location)
 
-    def __upload_init(self, filename):
-        with open(filename, 'rb') as f:
-            params = {
-                "length": getsize(filename),
-                "check": WeiboComApi.__calc_md5(f.read()),
-                "type": 'video',
-                "source": 2637646381,
-                "name": filename,
-                'client': 'web',
-                'mediaprops': '{"screenshot":0,"video_type":"normal"}',
-                "status": 'wired',
-                "ua": self.__COMMON_HEADERS['User-Agent'],
-                "count": 1
-            }
-        res = self.post(MULTIMEDIA_INIT_URL, params=params, timeout=self.timeout)
-        init_info = res.json()
-        if 'error' in init_info:
-            raise LoginException(f'Error in video upload initialization. Response: {res.text}')
-        return init_info
-
-    def upload_video(self, filename):
-        init_info = self.__upload_init(filename)
-        file_token = init_info['fileToken']
-        chunk_size = init_info['length']
-        with open(filename, 'rb') as f:
-            start_location = 0
-            while True:
-                chunk = f.read(chunk_size * 1024)
-                flag = self.__upload_data(file_token, start_location, chunk)
-                start_location += chunk_size * 1024
-                if flag is True:
-                    continue
-                else:
-                    if flag is not None:
-                        return flag
-
-    def __upload_data(self, file_token, start_location, chunk):
-        params = {
-            'source': 2637646381,
-            'filetoken': file_token,
-            'sectioncheck': WeiboComApi.__calc_md5(chunk),
-            'startloc': start_location,
-            'client': 'web',
-            'status': 'wired',
-            'ua': WeiboComApi.__COMMON_HEADERS['User-Agent'],
-            'v': WeiboComApi.__get_unique_key()
-        }
-        rsp = self.post(MULTIMEDIA_UPLOAD_DATA_URL, params=params, data=chunk, timeout=10 * self.timeout).json()
         try:
-            return rsp['succ']
-        except:
-            try:
-                return rsp['fid']
-            except:
-                return None
+            with ThreadPoolExecutor(max_workers=concurrency or self.upload_concurrency) as executor:
+                futures = {executor.submit(self.__upload_chunk, filename, file_token, start_location, chunk_bytes,
+                                           section_checks.get(start_location)): start_location
+                           for start_location in pending}
+                try:
+                    for future in as_completed(futures):
+                        start_location = futures[future]
+                        results[start_location] = future.result()
+                        if manifest is not None:
+                            manifest.ack(start_location)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            results[start_locations[-1]] = self.__upload_chunk(filename, file_token, start_locations[-1],
+                                                               chunk_bytes, section_checks.get(start_locations[-1]))
+        except UploadTokenError:
+            # Other errors keep the manifest, so the next attempt resumes.
+            if manifest is not None:
+                self.logger.warning(f'File token of {filename} was rejected, starting over next time.')
+                manifest.delete()
+            raise
+
+        for start_location in start_locations:
+            if results[start_location] is not True:
+                if manifest is not None:
+                    manifest.delete()
+                return results[start_location]
+        raise RuntimeError(f'No fid returned after uploading all chunks of {filename}.')
+
+    def __upload_chunk(self, filename, file_token, start_location, chunk_bytes, section_check=None):
+        with open(filename, 'rb') as f:
+            f.seek(start_location)
+            chunk = f.read(chunk_bytes)
+        for attempt in range(self.chunk_retries + 1):
+            flag = self.__upload_data(file_token, start_location, chunk, section_check)
+            if flag is not None:
+                return flag
+            self.logger.warning(f'Chunk {start_location} of {filename} was not acknowledged (attempt {attempt + 1}).')
+            if attempt < self.chunk_retries:
+                time.sleep(self.retry_policy.backoff(attempt + 1) if self.retry_policy is not None
+                           else min(0.5 * 2 ** attempt, 10))
+        raise RuntimeError(f'Unable to upload chunk {start_location} of {filename} '
+                           f'after {self.chunk_retries + 1} attempts.')
+
+    def __upload_data(self, file_token, start_location, chunk, section_check=None):
+        params = upload_data_params(file_token, start_location, chunk, section_check)
+        # Re-sending a chunk to the same startloc is safe, so the retry_policy retries transport errors.
+        rsp = self.post(MULTIMEDIA_UPLOAD_DATA_URL, params=params, data=chunk, timeout=10 * self.timeout,
+                        idempotent=True, operation='upload_video.chunk').json()
+        return parse_upload_data(rsp)
 
     def upload_pic(self, filename):
-        params = {
-            'cb': f'http://weibo.com/aj/static/upimgback.html?_wv=5&callback=STK_ijax_{WeiboComApi.__get_unique_key()}21',
-            'mime': 'image/jpeg',
-            'data': 'base64',
-            'url': 0,
-            'markpos': 1,
-            'logo': '',
-            'nick': 0,
-            'marks': 1,
-            'app': 'miniblog',
-            's': 'rdxt',
-            'file_source': 10
-        }
+        content_hash = None
+        if self.pic_cache is not None:
+            content_hash = stream_digest(filename)
+            pid = self.pic_cache.get(content_hash, 'weibo.com', self.account)
+            if pid is not None:
+                self.logger.debug(f'Pic {pid} found in cache.')
+                return pid
 
         with open(filename, 'rb') as f:
-            data = {'b64_data': base64.b64encode(f.read())}
-            rsp = self.post(MULTIMEDIA_UPLOAD_PIC_URL, params=params, data=data, timeout=self.timeout)
-            return parse_qs(urlparse(rsp.url).query)['pid'][0]
+            # The form body is base64 and url encoded block by block while it is sent.
+            data = Base64FormBody('b64_data', f)
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            rsp = self.post(MULTIMEDIA_UPLOAD_PIC_URL, params=upload_pic_params(), data=data, headers=headers,
+                            timeout=self.timeout, operation='upload_pic')
+            pid = parse_pid(rsp.url)
+
+        if self.pic_cache is not None:
+            self.pic_cache.put(content_hash, 'weibo.com', self.account, pid)
+        return pid
+
+    def is_login(self):
+        """Whether the session is still logged in."""
+        rsp = self.get(HOME_URL, headers=COMMON_HEADERS, timeout=self.timeout, operation='com.is_login')
+        return 'uid' in rsp.text
 
     def post_status(self, caption, video_id, pic_id, tags=None):
-        if len(caption) <= 6:
-            raise ValueError(f'Video caption must contain at least 6 characters. Caption: {caption}')
-
-        data = OrderedDict([
-            ('location', 'v6_group_content_home'),
-            ('text', caption),
-            ('appkey', ''),
-            ('style_type', 1),
-            ('pic_id', ''),
-            ('tid', ''),
-            ('mid', ''),
-            ('isReEdit', 'false'),
-            ('pdetail', ''),
-            ('video_fid', video_id),
-            ('video_titles', caption),
-            ('video_tags', '' if tags is None else "|".join(tags)),
-            ('video_covers', f'http://wx3.sinaimg.cn/large/{pic_id}.jpg|640|360'),
-            ('video_monitor', 1),
-            ('album_ids', ''),
-            ('rank', 0),
-            ('rankid', ''),
-            ('module', 'stissue'),
-            ('pub_source', 'main_'),
-            ('pub_type', 'dialog'),
-            ('isPri', 0),
-            ('_t', 0)
-        ])
-        params = OrderedDict([
-            ('ajwvr', 6),
-            ('__rnd', int(time.time() * 1000))
-        ])
-
-        rsp = self.post(POST_WEIBO_URL, data=data, params=params, timeout=self.timeout,
-                        allow_redirects=True, headers=WeiboComApi.__COMMON_HEADERS)
+        data = post_status_form(caption, video_id, pic_id, tags)
+        rsp = self.post(POST_WEIBO_URL, data=data, params=post_status_params(), timeout=self.timeout,
+                        allow_redirects=True, headers=COMMON_HEADERS, operation='com.post_status')
 
         try:
             rsp_data = rsp.json()
@@ -165,13 +194,3 @@ class WeiboComApi(RequestsWrapper):
         else:
             self.logger.error(f'Error posting weibo {caption}. Response: {rsp_data}')
         return rsp_data
-
-    @staticmethod
-    def __calc_md5(file_content):
-        md5obj = hashlib.md5()
-        md5obj.update(file_content)
-        return md5obj.hexdigest()
-
-    @staticmethod
-    def __get_unique_key():
-        return str(int(time.time() * 1000)) + str(random.randint(0, 99))
@@ -4,6 +4,7 @@ MULTIMEDIA_INIT_URL = 'https://fileplatform.api.weibo.com/2/multimedia/init.json
 MULTIMEDIA_UPLOAD_DATA_URL = 'https://fileplatform.api.weibo.com/2/multimedia/upload.json'
 MULTIMEDIA_UPLOAD_PIC_URL = 'https://picupload.weibo.com/interface/pic_upload.php'
 POST_WEIBO_URL = 'https://www.weibo.com/aj/mblog/add'
+HOME_URL = 'https://weibo.com/'
 
 # https://fileplatform.api.weibo.com/2/multimedia/discovery.json?source=2637646381&type=video&size=850293&version=&status=
 # source: 2637646381
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Request building and response parsing for the weibo.com upload and post endpoints, shared by the blocking and the
+asyncio clients.
+"""
+
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+from ..exceptions import LoginException, UploadTokenError
+
+COMMON_HEADERS = {
+    'X-Requested-With': 'XMLHttpRequest',
+    'Origin': 'http://weibo.com',
+    'Referer': 'http://weibo.com/?topnav=1&wvr=6&mod=logo',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/57.0.2987.133 Safari/537.36'
+}
+
+
+def upload_init_params(filename, length, md5):
+    return {
+        "length": length,
+        "check": md5,
+        "type": 'video',
+        "source": 2637646381,
+        "name": filename,
+        'client': 'web',
+        'mediaprops': '{"screenshot":0,"video_type":"normal"}',
+        "status": 'wired',
+        "ua": COMMON_HEADERS['User-Agent'],
+        "count": 1
+    }
+
+
+def check_upload_init(init_info, rsp_text):
+    if 'error' in init_info:
+        raise LoginException(f'Error in video upload initialization. Response: {rsp_text}')
+    return init_info
+
+
+def upload_data_params(file_token, start_location, chunk, section_check=None):
+    return {
+        'source': 2637646381,
+        'filetoken': file_token,
+        'sectioncheck': section_check or calc_md5(chunk),
+        'startloc': start_location,
+        'client': 'web',
+        'status': 'wired',
+        'ua': COMMON_HEADERS['User-Agent'],
+        'v': get_unique_key()
+    }
+
+
+def parse_upload_data(rsp_data):
+    """
+    True for an acknowledged chunk, the fid once the upload is complete, None if the chunk was not acknowledged.
+
+    :raise UploadTokenError: if the server rejected the file token
+    """
+    if 'error' in rsp_data:
+        raise UploadTokenError(f'Upload rejected: {rsp_data["error"]}', rsp_data)
+    if rsp_data.get('succ'):
+        return True
+    return rsp_data.get('fid')
+
+
+def upload_pic_params():
+    return {
+        'cb': f'http://weibo.com/aj/static/upimgback.html?_wv=5&callback=STK_ijax_{get_unique_key()}21',
+        'mime': 'image/jpeg',
+        'data': 'base64',
+        'url': 0,
+        'markpos': 1,
+        'logo': '',
+        'nick': 0,
+        'marks': 1,
+        'app': 'miniblog',
+        's': 'rdxt',
+        'file_source': 10
+    }
+
+
+def parse_pid(url):
+    return parse_qs(urlparse(url).query)['pid'][0]
+
+
+def post_status_form(caption, video_id, pic_id, tags=None):
+    if len(caption) <= 6:
+        raise ValueError(f'Video caption must contain at least 6 characters. Caption: {caption}')
+
+    return OrderedDict([
+        ('location', 'v6_group_content_home'),
+        ('text', caption),
+        ('appkey', ''),
+        ('style_type', 1),
+        ('pic_id', ''),
+        ('tid', ''),
+        ('mid', ''),
+        ('isReEdit', 'false'),
+        ('pdetail', ''),
+        ('video_fid', video_id),
+        ('video_titles', caption),
+        ('video_tags', '' if tags is None else "|".join(tags)),
+        ('video_covers', f'http://wx3.sinaimg.cn/large/{pic_id}.jpg|640|360'),
+        ('video_monitor', 1),
+        ('album_ids', ''),
+        ('rank', 0),
+        ('rankid', ''),
+        ('module', 'stissue'),
+        ('pub_source', 'main_'),
+        ('pub_type', 'dialog'),
+        ('isPri', 0),
+        ('_t', 0)
+    ])
+
+
+def post_status_params():
+    return OrderedDict([
+        ('ajwvr', 6),
+        ('__rnd', int(time.time() * 1000))
+    ])
+
+
+def calc_md5(file_content):
+    md5obj = hashlib.md5()
+    md5obj.update(file_content)
+    return md5obj.hexdigest()
+
+
+def get_unique_key():
+    return str(int(time.time() * 1000)) + str(random.randint(0, 99))
@@ -1 +1,2 @@
+from .login_flow import ConsoleProvider, LoginFlow, PendingVerifications, VerificationRequest
 from .weibo_login import WeiboLoginApi
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError
+
+from ..exceptions import VerificationTimeout
+
+# Input a login is waiting for.
+#   account: login_user of the login
+#   site: 'weibo.com' or 'weibo.cn'
+#   channel: 'sms' or 'private_msg'
+#   kind: 'code', answered with the verification code, or 'confirm', answered with True once the login request was
+#       approved in the private message (False cancels the login)
+#   prompt: description for a person
+VerificationRequest = namedtuple('VerificationRequest', ['account', 'site', 'channel', 'kind', 'prompt'])
+
+
+class LoginFlow(object):
+    """
+    A login that suspends while it waits for a secondary verification, without holding a thread.
+
+    start() runs the login until it needs a verification code or confirmation and returns the VerificationRequest
+    (also in `pending`), or None once the login is done. resume(answer) continues it with the answer the same way.
+    A suspended flow is just a paused generator, so any number of them can wait for their codes at once; each
+    resumes on the thread that calls resume().
+
+    run(provider) drives a flow to the end on the current thread, asking `provider` for the answers.
+    """
+
+    def __init__(self, steps):
+        self.__steps = steps
+        self.pending = None
+        self.pending_since = None
+        self.done = False
+        self.error = None
+
+    def start(self):
+        return self.__advance(lambda: next(self.__steps))
+
+    def resume(self, answer):
+        if self.pending is None:
+            raise RuntimeError('The login is not waiting for verification.')
+        return self.__advance(lambda: self.__steps.send(answer))
+
+    def fail(self, error):
+        """End a suspended login with `error`, e.g. a VerificationTimeout for a code that never arrived."""
+        if self.pending is None:
+            raise RuntimeError('The login is not waiting for verification.')
+        return self.__advance(lambda: self.__steps.throw(error))
+
+    def run(self, provider, timeout=None):
+        """
+        Run the login to the end. `provider(request)` returns the answer, or a Future of it; Futures are waited for
+        at most `timeout` seconds.
+
+        :raise VerificationTimeout: if an answer did not arrive in time
+        """
+        request = self.start()
+        while request is not None:
+            answer = provider(request)
+            if isinstance(answer, Future):
+                try:
+                    answer = answer.result(timeout)
+                except TimeoutError:
+                    answer.cancel()
+                    request = self.fail(VerificationTimeout(f'No {request.channel} verification for '
+                                                           f'{request.account} within {timeout}s.'))
+                    continue
+            request = self.resume(answer)
+        return self
+
+    def __advance(self, step):
+        try:
+            self.pending = step()
+            self.pending_since = time.monotonic()
+            return self.pending
+        except StopIteration:
+            self.pending = None
+            self.done = True
+            return None
+        except BaseException as e:
+            self.pending = None
+            self.done = True
+            self.error = e
+            raise
+
+
+class ConsoleProvider(object):
+    """
+    Asks for verification on the console. input() runs on a daemon thread, so a timeout can end the wait.
+
+    input() cannot be interrupted: after a timeout, the prompt keeps reading stdin, and the next line typed is
+    consumed (and dropped) by it.
+    """
+
+    def __call__(self, request):
+        future = Future()
+
+        def ask():
+            try:
+                answer = self.__ask(request)
+            except BaseException as e:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+                return
+            # Cancelled when the login timed out meanwhile
+            if future.set_running_or_notify_cancel():
+                future.set_result(answer)
+
+        threading.Thread(target=ask, name='verification-input', daemon=True).start()
+        return future
+
+    @staticmethod
+    def __ask(request):
+        if request.kind == 'code':
+            return input(request.prompt)
+        while True:
+            confirm = input(request.prompt)
+            if confirm == 'confirm':
+                return True
+            elif confirm == 'cancel':
+                return False
+
+
+class PendingVerifications(object):
+    """
+    Provider answered from elsewhere, e.g. a chat bot or a web hook receiving the codes: every request waits for
+    supply(account, answer).
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__pending = {}
+
+    def __call__(self, request):
+        future = Future()
+        future.request = request
+        with self.__lock:
+            previous = self.__pending.get(request.account)
+            if previous is not None:
+                previous.cancel()
+            self.__pending[request.account] = future
+        future.add_done_callback(lambda f: self.__discard(request.account, f))
+        return future
+
+    def requests(self):
+        """The requests waiting for an answer."""
+        with self.__lock:
+            return [future.request for future in self.__pending.values()]
+
+    def supply(self, account, answer):
+        """Answer the request of `account`. Returns False if there is none."""
+        with self.__lock:
+            future = self.__pending.pop(account, None)
+        return future is not None and future.set_running_or_notify_cancel() and not future.set_result(answer)
+
+    def __discard(self, account, future):
+        with self.__lock:
+            if self.__pending.get(account) is future:
+                del self.__pending[account]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""
+Extractors for the login pages, over the raw response bytes.
+
+Matching bytes skips decoding the pages to text, which for responses without a declared charset also means guessing
+the encoding. Every pattern starts with a literal, so a search only tries the positions where that literal occurs.
+"""
+
+import json
+import re
+
+from ..exceptions import LoginException
+
+PRELOGIN_CALLBACK = re.compile(rb'preloginCallBack\((.+?)\)', re.S)
+CROSS_DOMAIN_URL_LIST = re.compile(rb'setCrossDomainUrlList\((.+?)\)', re.S)
+LOCATION_REPLACE = {
+    '"': re.compile(rb'location\.replace\("([^"]+)"\);'),
+    "'": re.compile(rb"location\.replace\('([^']+)'\)"),
+}
+ENCRYPTED_MOBILE = re.compile(rb'value="([^"]+)" class="W_radio"')
+PHONE_LIST = re.compile(rb"phoneList: JSON\.parse\('([^']+)'\),")
+
+
+def _search(pattern, content, what):
+    match = pattern.search(content)
+    if match is None:
+        raise LoginException(f'Unable to find {what} in the login response.')
+    return match.group(1)
+
+
+def prelogin_data(content):
+    """The data of the sinaSSOController.preloginCallBack(...) script."""
+    return json.loads(_search(PRELOGIN_CALLBACK, content, 'the prelogin data'))
+
+
+def cross_domain_urls(content):
+    """The URLs of setCrossDomainUrlList(...)."""
+    return json.loads(_search(CROSS_DOMAIN_URL_LIST, content, 'the cross domain URLs'))['arrURL']
+
+
+def location_replace(content, quote='"'):
+    """The URL of the first location.replace(...) written with `quote`."""
+    return _search(LOCATION_REPLACE[quote], content, 'the redirect URL').decode('utf-8')
+
+
+def encrypted_mobile(content):
+    """The encrypted mobile number on the weibo.com protection page."""
+    return _search(ENCRYPTED_MOBILE, content, 'the mobile number').decode('utf-8')
+
+
+def phone_list(content):
+    """The phones on the weibo.cn verification page."""
+    return json.loads(_search(PHONE_LIST, content, 'the phone list'))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import rsa
+
+PUBLIC_EXPONENT = 65537
+
+
+def _cryptography_available():
+    try:
+        import cryptography.hazmat.primitives.asymmetric.rsa  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class RsaKeyCache(object):
+    """
+    Encrypts login passwords (PKCS#1 v1.5) with the public keys of the prelogin data, cached by their rsakv.
+
+    The backend is `cryptography` when it is installed (`pip install weibo_api[cryptography]`), which encrypts in C,
+    and the pure-Python `rsa` package otherwise; pass backend='cryptography' or 'rsa' to choose explicitly. One cache
+    is shared by all WeiboLoginApi instances by default, as weibo.com uses the same key for all accounts.
+    """
+
+    def __init__(self, backend='auto'):
+        if backend == 'auto':
+            backend = 'cryptography' if _cryptography_available() else 'rsa'
+        if backend not in ('cryptography', 'rsa'):
+            raise ValueError(f'Unknown RSA backend {backend}.')
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__keys = {}
+
+    def public_key(self, rsakv, pubkey):
+        """The public key with the hex modulus `pubkey`, cached by `rsakv`."""
+        with self.__lock:
+            cached = self.__keys.get(rsakv)
+            # A rotated key under an old rsakv would otherwise encrypt with the wrong key.
+            if cached is not None and cached[0] == pubkey:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        key = self.__build(int(pubkey, 16))
+        with self.__lock:
+            self.__keys[rsakv] = (pubkey, key)
+        return key
+
+    def encrypt(self, rsakv, pubkey, message):
+        key = self.public_key(rsakv, pubkey)
+        if self.backend == 'cryptography':
+            from cryptography.hazmat.primitives.asymmetric import padding
+
+            return key.encrypt(message, padding.PKCS1v15())
+        return rsa.encrypt(message, key)
+
+    def clear(self):
+        with self.__lock:
+            self.__keys.clear()
+
+    def __build(self, modulus):
+        if self.backend == 'cryptography':
+            from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+
+            return RSAPublicNumbers(PUBLIC_EXPONENT, modulus).public_key()
+        return rsa.PublicKey(modulus, PUBLIC_EXPONENT)
+
+
+default_rsa_key_cache = RsaKeyCache()
@@ -4,18 +4,21 @@ import copy
 import json
 import logging
 import os
-import pickle
 import random
-import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote, parse_qs, urlparse, unquote
 
 import requests
-import rsa
-
 from ..exceptions import LoginException
 from ..requests_wrapper import RequestsWrapper
+from ..session_factory import SessionFactory
+from ..session_store import SessionStore, cookie_key
 from ..simple_captcha.weibo_com_captcha import WeiboComCaptcha
+from . import login_parsing
+from .login_flow import ConsoleProvider, LoginFlow, VerificationRequest
+from .rsa_keys import default_rsa_key_cache
 
 
 class WeiboLoginApi(RequestsWrapper):
@@ -45,15 +48,45 @@ class WeiboLoginApi(RequestsWrapper):
             raise ValueError(f'Unsupported secondary verification type. '
                              f'Supported types are: {self.__SUPPORTED_VERIFICATION_TYPE}')
 
-        self.captcha_cracker = WeiboComCaptcha(save_captcha=kwargs.get('save_captcha', False))
+        self.save_captcha = kwargs.get('save_captcha', False)
+        self.__captcha_cracker = kwargs.get('captcha_cracker', None)
+        self.__captcha_lock = threading.Lock()
         self.timeout = kwargs.get('timeout', 60)
+        self.wire_trace = kwargs.get('wire_trace', self.wire_trace)
+        self.retry_policy = kwargs.get('retry_policy', self.retry_policy)
         self.session_file = kwargs.get('weibo_session_file', None)
+        self.session_factory = kwargs.get('session_factory', None) or SessionFactory()
+        self.session_store = kwargs.get('session_store', None) or SessionStore()
         self.session = self.__load_session()
+        self.cross_domain_concurrency = kwargs.get('cross_domain_concurrency', 8)
+        self.cross_domain_timeout = kwargs.get('cross_domain_timeout', 10)
+        # Seconds each domain of the last cross domain login took, keyed by host
+        self.cross_domain_timings = {}
+        self.__cookie_lock = threading.Lock()
+        # Answers secondary verification requests of weibo_com_login and weibo_cn_login; see LoginFlow.run
+        self.verification_provider = kwargs.get('verification_provider', None) or ConsoleProvider()
+        self.verification_timeout = kwargs.get('verification_timeout', 300)
+        self.rsa_key_cache = kwargs.get('rsa_key_cache', None) or default_rsa_key_cache
+
+    @property
+    def captcha_cracker(self):
+        """The captcha model is only loaded the first time a captcha has to be solved."""
+        with self.__captcha_lock:
+            if self.__captcha_cracker is None:
+                self.__captcha_cracker = WeiboComCaptcha(save_captcha=self.save_captcha)
+            return self.__captcha_cracker
 
     ##########################################################################################
     # weibo.com login
     ##########################################################################################
     def weibo_com_login(self):
+        self.weibo_com_login_flow().run(self.verification_provider, self.verification_timeout)
+
+    def weibo_com_login_flow(self):
+        """Login to weibo.com as a LoginFlow, which suspends while waiting for secondary verification."""
+        return LoginFlow(self.__weibo_com_login_steps())
+
+    def __weibo_com_login_steps(self):
         prelogin_data = self.__weibo_com_prelogin()
         ajax_login_url = 'https://www.weibo.com/ajaxlogin.php?framelogin=1&callback=parent.sinaSSOController.feedBackUrlCallBack'
         payload = {
@@ -89,13 +122,14 @@ class WeiboLoginApi(RequestsWrapper):
                 'prelt': 2041
             })
 
-        login_data = self.post('https://login.sina.com.cn/sso/login.php?client=ssologin.js(v1.4.19)', data=payload).json()
+        login_data = self.post('https://login.sina.com.cn/sso/login.php?client=ssologin.js(v1.4.19)', data=payload,
+                               operation='weibo_com_login.login').json()
         if login_data['retcode'] == '0':
             self.__weibo_com_sso(ajax_login_url, login_data['ticket'])
         elif login_data['retcode'] == '2071' and login_data['reason'] == u'请使用扫码登录':
             self.logger.info('Weibo.com secondary verification required.')
             protection_url = unquote(login_data['protection_url'])
-            redirect_url = self.__weibo_com_secondary_verification(protection_url)
+            redirect_url = yield from self.__weibo_com_secondary_verification(protection_url)
             self.__weibo_com_cross_domain_login(redirect_url)
         elif login_data['retcode'] == '2070' and login_data['reason'] == u'输入的验证码不正确':
             self.logger.error(f'Wrong captcha: {prelogin_data.get("pin", None)}. Reporting...')
@@ -120,8 +154,9 @@ class WeiboLoginApi(RequestsWrapper):
         }
         headers = copy.deepcopy(self.__COMMON_HEADERS)
         headers.update({'Referer': 'https://weibo.com/'})
-        response = self.get('https://login.sina.com.cn/sso/prelogin.php', params=params, headers=headers)
-        prelogin_data = json.loads(re.findall(r'preloginCallBack\(([\w\W]+?)\)', response.text)[0])
+        response = self.get('https://login.sina.com.cn/sso/prelogin.php', params=params, headers=headers,
+                            operation='weibo_com_login.prelogin')
+        prelogin_data = login_parsing.prelogin_data(response.content)
         if prelogin_data.get('showpin', 0) == 1:
             prelogin_data['pin'] = self.__get_pin(prelogin_data['pcid'])
         return prelogin_data
@@ -132,13 +167,13 @@ class WeiboLoginApi(RequestsWrapper):
             'r': random.randint(10000, 100000),
             's': 0
         }
-        pic = self.get('http://login.sina.com.cn/cgi/pin.php', params=params)
+        pic = self.get('http://login.sina.com.cn/cgi/pin.php', params=params, operation='weibo_com_login.pin')
         pin = self.captcha_cracker.predict(pic.content)
         self.logger.info('Weibo.com captcha: %s', pin)
         return pin
 
     def __weibo_com_sso(self, ajax_login_url, ticket):
-        self.get('https://i.sso.sina.com.cn/js/ssologin.js')
+        self.get('https://i.sso.sina.com.cn/js/ssologin.js', operation='weibo_com_login.sso_js')
         params = {
             'callback': 'sinaSSOController.doCrossDomainCallBack',
             'client': 'ssologin.js(v1.4.19)',
@@ -148,8 +183,8 @@ class WeiboLoginApi(RequestsWrapper):
             'ssosavestate': 7,
             'url': ajax_login_url + '&sudaref=www.weibo.com',
         }
-        self.get('http://passport.weibo.com/wbsso/login', params=params)
-        self.get(ajax_login_url + '&sudaref=www.weibo.com')
+        self.get('http://passport.weibo.com/wbsso/login', params=params, operation='weibo_com_login.sso')
+        self.get(ajax_login_url + '&sudaref=www.weibo.com', operation='weibo_com_login.ajax_login')
         # interest = self.get('http://weibo.com/nguide/interest', timeout=self.timeout)
         # uid = re.search(r"CONFIG\['uid'\]='([^']+)'", interest.text).group(1)
         # nick = re.search(r"CONFIG\['nick'\]='([^']+)'", interest.text).group(1)
@@ -157,9 +192,9 @@ class WeiboLoginApi(RequestsWrapper):
     def __weibo_com_secondary_verification(self, protection_url):
         token = parse_qs(urlparse(protection_url).query)['token'][0]
         if self.verification_type == 'sms':
-            check_data = self.__weibo_com_sms_verification(protection_url, token)
+            check_data = yield from self.__weibo_com_sms_verification(protection_url, token)
         elif self.verification_type == 'private_msg':
-            check_data = self.__weibo_com_private_msg_verification(token)
+            check_data = yield from self.__weibo_com_private_msg_verification(token)
         else:
             raise ValueError('verification_type can only be sms or private_msg')
 
@@ -169,56 +204,112 @@ class WeiboLoginApi(RequestsWrapper):
         return check_data['data']['redirect_url']
 
     def __weibo_com_sms_verification(self, protection_url, token):
-        protection_page = self.get(protection_url)
-        encrypted_mobile = re.search(r'value="([^"]+)" class="W_radio"', protection_page.text).group(1)
+        protection_page = self.get(protection_url, operation='weibo_com_login.protection_page')
+        encrypted_mobile = login_parsing.encrypted_mobile(protection_page.content)
         params = {'token': token}
         payload = {'encrypt_mobile': encrypted_mobile}
-        send_code = self.post('https://passport.weibo.com/protection/mobile/sendcode', params=params, data=payload).json()
+        send_code = self.post('https://passport.weibo.com/protection/mobile/sendcode', params=params, data=payload,
+                              operation='weibo_com_login.sms_send').json()
         if send_code['retcode'] != 20000000:
             raise LoginException('Exceeds mobile verification limit.')
-        code = input('Please input the verification code you received through sms: ')
+        code = yield self.__verification_request(
+            'weibo.com', 'code', 'Please input the verification code you received through sms: ')
         payload.update({'code': code})
-        return self.get('https://passport.weibo.com/protection/mobile/confirm', params=params, data=payload).json()
+        # Not retried: a repeated confirmation may be rejected, or count as a second verification attempt.
+        return self.get('https://passport.weibo.com/protection/mobile/confirm', params=params, data=payload,
+                        idempotent=False, operation='weibo_com_login.sms_confirm').json()
 
     def __weibo_com_private_msg_verification(self, token):
         payload = {'token': token}
-        self.post('https://passport.weibo.com/protection/privatemsg/send', data=payload)
-        while True:
-            confirm = input('Type "confirm" to make sure you approved the login request in private message, '
-                            'or type "cancel" to cancel the login: ')
-            if confirm == 'confirm':
-                break
-            elif confirm == 'cancel':
-                raise LoginException('User canceled the login.')
-        return self.post('https://passport.weibo.com/protection/privatemsg/getstatus', data=payload).json()
+        self.post('https://passport.weibo.com/protection/privatemsg/send', data=payload,
+                  operation='weibo_com_login.private_msg_send')
+        confirmed = yield self.__verification_request(
+            'weibo.com', 'confirm', 'Type "confirm" to make sure you approved the login request in private message, '
+                                    'or type "cancel" to cancel the login: ')
+        if not confirmed:
+            raise LoginException('User canceled the login.')
+        return self.post('https://passport.weibo.com/protection/privatemsg/getstatus', data=payload,
+                         operation='weibo_com_login.private_msg_status').json()
 
     def __weibo_com_cross_domain_login(self, redirect_url):
-        redirect_response = self.get(redirect_url)
-        cross_domain_url = re.search(r'location.replace\("([^"]+)"\);', redirect_response.text).group(1)
-        cross_domain_response = self.get(cross_domain_url)
-        domains = json.loads(re.search(r'setCrossDomainUrlList\(([\w\W]+?)\)', cross_domain_response.text).group(1))['arrURL']
-        for domain_url in domains:
-            try:
-                self.get(domain_url)
-            except Exception as e:
-                self.logger.warning(f'Unable to finish cross domain authentication for {domain_url}', e)
-        login_url = re.search(r'location.replace\(\'([^\']+)\'\)', cross_domain_response.text).group(1)
-        self.get(login_url, allow_redirects=True)
+        redirect_response = self.get(redirect_url, operation='weibo_com_login.redirect')
+        cross_domain_url = login_parsing.location_replace(redirect_response.content)
+        cross_domain_response = self.get(cross_domain_url, operation='weibo_com_login.cross_domain')
+        domains = login_parsing.cross_domain_urls(cross_domain_response.content)
+        self.__cross_domain_fan_out(domains, 'weibo_com_login.cross_domain_url', ignore_errors=True)
+        login_url = login_parsing.location_replace(cross_domain_response.content, quote="'")
+        self.get(login_url, allow_redirects=True, operation='weibo_com_login.cross_domain_login')
 
     def __weibo_com_cn_auth(self):
-        root = self.get('https://weibo.cn/')
-        cross_domain_url = re.search(r'location.replace\("([^"]+)"\);', root.text).group(1)
-        cross_domain_response = self.get(cross_domain_url)
-        domains = json.loads(re.search(r'setCrossDomainUrlList\(([\w\W]+?)\)', cross_domain_response.text).group(1))['arrURL']
-        for domain_url in domains:
-            self.get(domain_url)
-        cross_domain_login_url = re.search(r'location.replace\(\'([^\']+)\'\)', cross_domain_response.text).group(1)
-        self.get(cross_domain_login_url, allow_redirects=True)
+        root = self.get('https://weibo.cn/', operation='weibo_com_cn_auth.root')
+        cross_domain_url = login_parsing.location_replace(root.content)
+        cross_domain_response = self.get(cross_domain_url, operation='weibo_com_cn_auth.cross_domain')
+        domains = login_parsing.cross_domain_urls(cross_domain_response.content)
+        self.__cross_domain_fan_out(domains, 'weibo_com_cn_auth.cross_domain_url')
+        cross_domain_login_url = login_parsing.location_replace(cross_domain_response.content, quote="'")
+        self.get(cross_domain_login_url, allow_redirects=True, operation='weibo_com_cn_auth.login')
+
+    def __cross_domain_fan_out(self, domain_urls, operation, ignore_errors=False):
+        """
+        GET the cross domain login URLs concurrently, each with a copy of the session cookies, and merge the cookies
+        they set back into the session. Takes about as long as the slowest domain.
+        """
+        def visit(domain_url):
+            session = requests.Session()
+            session.adapters = self.session.adapters  # share the connection pools
+            session.headers = self.session.headers
+            with self.__cookie_lock:
+                snapshot = [copy.copy(cookie) for cookie in self.session.cookies]
+            for cookie in snapshot:
+                session.cookies.set_cookie(cookie)
+            start = time.perf_counter()
+            try:
+                self.get(domain_url, session=session, timeout=self.cross_domain_timeout, operation=operation)
+            finally:
+                timings[urlparse(domain_url).netloc] = time.perf_counter() - start
+            self.__merge_cookies(snapshot, session.cookies)
+
+        timings = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.cross_domain_concurrency, len(domain_urls)))) as executor:
+            futures = [(domain_url, executor.submit(visit, domain_url)) for domain_url in domain_urls]
+        self.cross_domain_timings = timings
+        if timings:
+            slowest = max(timings, key=timings.get)
+            self.logger.info(f'Cross domain login to {len(timings)} domains took {time.perf_counter() - start:.2f}s, '
+                             f'slowest {slowest}: {timings[slowest]:.2f}s')
+        for domain_url, future in futures:
+            error = future.exception()
+            if error is not None:
+                if not ignore_errors:
+                    raise error
+                self.logger.warning(f'Unable to finish cross domain authentication for {domain_url}: {error}')
+
+    def __merge_cookies(self, snapshot, cookies):
+        """Apply the cookies set or removed since `snapshot` was taken to the session."""
+        before = {cookie_key(cookie): (cookie.value, cookie.expires) for cookie in snapshot}
+        after = {cookie_key(cookie): cookie for cookie in cookies}
+        with self.__cookie_lock:
+            for key, cookie in after.items():
+                if before.get(key) != (cookie.value, cookie.expires):
+                    self.session.cookies.set_cookie(cookie)
+            for key in before.keys() - after.keys():
+                try:
+                    self.session.cookies.clear(*key)
+                except KeyError:
+                    pass
 
     ##########################################################################################
     # weibo.cn login
     ##########################################################################################
     def weibo_cn_login(self):
+        self.weibo_cn_login_flow().run(self.verification_provider, self.verification_timeout)
+
+    def weibo_cn_login_flow(self):
+        """Login to weibo.cn as a LoginFlow, which suspends while waiting for secondary verification."""
+        return LoginFlow(self.__weibo_cn_login_steps())
+
+    def __weibo_cn_login_steps(self):
         sso_headers = copy.deepcopy(self.__COMMON_HEADERS)
         sso_headers.update({
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -234,16 +325,17 @@ class WeiboLoginApi(RequestsWrapper):
             'entry': 'wapsso',
             'sinacnlogin': 1,
         }
-        sso_response = self.post('https://passport.sina.cn/sso/login', headers=sso_headers, data=payload).json()
+        sso_response = self.post('https://passport.sina.cn/sso/login', headers=sso_headers, data=payload,
+                                 operation='weibo_cn_login.sso').json()
 
         if sso_response['retcode'] == 50050011:
             self.logger.info('Weibo.cn secondary verification required.')
-            self.__weibo_cn_secondary_verification(sso_response['data']['errurl'])
+            yield from self.__weibo_cn_secondary_verification(sso_response['data']['errurl'])
         elif sso_response['retcode'] == 20000000:
             login_result_url = sso_response['data']['loginresulturl'] + '&savestate=1&url=https://sina.cn'
-            self.get(login_result_url)
-            self.get('https://sina.cn')
-            self.get('https://m.weibo.cn/?vt=4&pos=108')
+            self.get(login_result_url, operation='weibo_cn_login.login_result')
+            self.get('https://sina.cn', operation='weibo_cn_login.sina_cn')
+            self.get('https://m.weibo.cn/?vt=4&pos=108', operation='weibo_cn_login.m_weibo_cn')
         else:
             raise LoginException('Login to m.weibo.cn failed.')
 
@@ -251,60 +343,66 @@ class WeiboLoginApi(RequestsWrapper):
         self.logger.info('Weibo login succeeded!')
 
     def __weibo_cn_secondary_verification(self, verification_page_url):
-        verification_page = self.get(verification_page_url)
+        verification_page = self.get(verification_page_url, operation='weibo_cn_login.verification_page')
         send_code_params = {'msg_type': self.verification_type}
         if self.verification_type == 'sms':
-            mobile = json.loads(re.search(r'phoneList: JSON.parse\(\'([^\']+)\'\),', verification_page.text).group(1))
+            mobile = login_parsing.phone_list(verification_page.content)
             send_code_params.update({
                 'number': mobile[0]['number'],
                 'mask_mobile': mobile[0]['maskMobile'],
                 'msg_type': self.verification_type,
             })
         elif self.verification_type == 'private_msg':
-            self.get('https://passport.weibo.cn/signin/secondverify/index', params={'way': self.verification_type})
+            self.get('https://passport.weibo.cn/signin/secondverify/index', params={'way': self.verification_type},
+                     operation='weibo_cn_login.verification_index')
         else:
             raise ValueError('verification_type can only be sms or private_msg')
 
-        send_code_data = self.get('https://passport.weibo.cn/signin/secondverify/ajsend', params=send_code_params).json()
+        # Not retried: every request sends another code and invalidates the previous one.
+        send_code_data = self.get('https://passport.weibo.cn/signin/secondverify/ajsend', params=send_code_params,
+                                  idempotent=False, operation='weibo_cn_login.send_code').json()
         if send_code_data['retcode'] != 100000:
             raise LoginException(f'Unable to send verification code. Server response: {json.dumps(send_code_data)}')
 
-        code = input(f'Please input the verification code you got from {self.verification_type}: ')
+        code = yield self.__verification_request(
+            'weibo.cn', 'code', f'Please input the verification code you got from {self.verification_type}: ')
         check_code_params = {
             'msg_type': self.verification_type,
             'code': code,
         }
-        check_code_data = self.get('https://passport.weibo.cn/signin/secondverify/ajcheck', params=check_code_params).json()
+        # Not retried: every request counts as another attempt at the code.
+        check_code_data = self.get('https://passport.weibo.cn/signin/secondverify/ajcheck', params=check_code_params,
+                                   idempotent=False, operation='weibo_cn_login.check_code').json()
         if check_code_data['retcode'] == 100000:
             login_url = check_code_data['data']['url']
-            self.get(login_url)
+            self.get(login_url, operation='weibo_cn_login.verified')
         else:
             raise LoginException(f'Secondary verification error. Response: {json.dumps(check_code_data)}')
 
     ##########################################################################################
     # Utilities
     ##########################################################################################
+    def __verification_request(self, site, kind, prompt):
+        return VerificationRequest(self.login_user, site, self.verification_type, kind, prompt)
+
     def __save_session(self):
         if self.session_file:
-            with open(self.session_file, 'wb') as f:
-                pickle.dump(self.session, f)
-                self.logger.info(f'Dumped session file to {self.session_file}')
+            self.session_store.save(self.session_file, self.session)
 
     def __load_session(self):
         if self.session_file and os.path.isfile(self.session_file):
-            with open(self.session_file, 'rb') as f:
-                self.logger.info(f'Loading session from {self.session_file}')
-                return pickle.load(f)
+            self.logger.info(f'Loading session from {self.session_file}')
+            return self.session_store.load(self.session_file, self.session_factory.create())
         else:
             self.logger.info('Session file does not exist.')
-            return requests.Session()
+            return self.session_factory.create()
 
     def is_cn_login(self):
-        response_json = self.get('https://m.weibo.cn/api/config').json()
+        response_json = self.get('https://m.weibo.cn/api/config', operation='cn.is_login').json()
         return response_json['data']['login']
 
     def is_com_login(self):
-        response = self.get('https://weibo.com/', headers=self.__COMMON_HEADERS)
+        response = self.get('https://weibo.com/', headers=self.__COMMON_HEADERS, operation='com.is_login')
         return u'uid' in response.text
 
     def get(self, *args, **kwargs):
@@ -327,11 +425,10 @@ class WeiboLoginApi(RequestsWrapper):
         """
         Get encrypted password
         """
-        pubkey = int(prelogin_data.get('pubkey', ''), 16)
-        rsa_key = rsa.PublicKey(pubkey, 65537)  # Create public key
         secret = str(prelogin_data.get('servertime', '')) + '\t' + \
                  str(prelogin_data.get('nonce', '')) + '\n' + str(self.login_password)
-        pwd = rsa.encrypt(secret.encode('utf-8'), rsa_key)  # Encrypt with RSA
+        pwd = self.rsa_key_cache.encrypt(prelogin_data.get('rsakv', ''), prelogin_data.get('pubkey', ''),
+                                         secret.encode('utf-8'))  # Encrypt with RSA
         return binascii.b2a_hex(pwd)  # Convert encrypted data to HEX
 
     @property
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from urllib.parse import urlparse
+
+WIRE_TRACE_OFF = 'off'
+WIRE_TRACE_HEADERS = 'headers'
+WIRE_TRACE_FULL = 'full'
+
+
+class WireTrace(object):
+    """
+    Formats request/response pairs for debug logging.
+
+    Modes:
+        off:     no work at all.
+        headers: request line, status line and headers only.
+        full:    headers plus bodies, each body truncated to max_body_bytes.
+
+    Nothing is formatted unless the logger is enabled for DEBUG, so a non-debug logger costs a single level check
+    per request regardless of the mode.
+    """
+
+    MODES = (WIRE_TRACE_OFF, WIRE_TRACE_HEADERS, WIRE_TRACE_FULL)
+
+    def __init__(self, mode=WIRE_TRACE_FULL, max_body_bytes=1024):
+        if mode not in self.MODES:
+            raise ValueError(f'Unsupported wire trace mode {mode}. Supported modes are: {self.MODES}')
+        self.mode = mode
+        self.max_body_bytes = max_body_bytes
+
+    def log(self, logger, rsp):
+        if self.mode == WIRE_TRACE_OFF or not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug(self.format(rsp))
+
+    def format(self, rsp):
+        request = rsp.request
+        uri = urlparse(request.url)
+        path = uri.path + ('?' + uri.query if uri.query else '')
+        lines = [f'< {request.method} {path} HTTP/1.1']
+        headers = request.headers.copy()
+        lines.append(f'< Host: {headers.pop("Host", uri.netloc)}')
+        lines.extend(f'< {name}: {value}' for name, value in headers.items())
+        lines.append('<')
+        if self.mode == WIRE_TRACE_FULL and request.body:
+            lines.append('< ' + self.__format_body(request.body))
+
+        lines.append(f'> HTTP/1.1 {rsp.status_code} {rsp.reason}')
+        lines.extend(f'> {name}: {value}' for name, value in rsp.headers.items())
+        lines.append('>')
+        if self.mode == WIRE_TRACE_FULL:
+            lines.append('> ' + self.__format_body(rsp.content))
+        return '\n'.join(lines)
+
+    def __format_body(self, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if not isinstance(body, (bytes, bytearray, memoryview)):
+            # Streamed bodies (files, encoders, generators) are never read here.
+            size = getattr(body, 'len', None)
+            return f'<< streamed body of {size if size is not None else "unknown"} bytes >>'
+        text = str(bytes(body[:self.max_body_bytes]), encoding='utf-8', errors='ignore').replace('\r\n', '\n')
+        if len(body) > self.max_body_bytes:
+            text += f'... << truncated, {len(body)} bytes in total >>'
+        return text